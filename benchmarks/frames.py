@@ -0,0 +1,87 @@
+"""
+Benchmark the memory use and attribute access time of frame objects.
+
+Compares the slotted :class:`stompclient.frame.Frame` against a frame class laid out
+the way frames used to be (instance `__dict__`, headers only accessible through a
+`__getattr__` fallback).
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/frames.py [num_frames]
+"""
+import sys
+import timeit
+
+from stompclient.frame import Frame, VALID_COMMANDS
+
+__authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
+__copyright__ = "Copyright 2010 Hans Lellelid"
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+ 
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+class UnslottedFrame(object):
+    """ A frame with an instance __dict__ and __getattr__-only header access (the old layout). """
+    
+    def __init__(self, command=None, headers=None, body=None):
+        self.command = command
+        self.body = body if body is not None else ''
+        self.headers = headers if headers is not None else {}
+    
+    def _get_cmd(self):
+        return self._cmd
+    
+    def _set_cmd(self, cmd):
+        if cmd is not None:
+            cmd = cmd.upper()
+            if cmd not in VALID_COMMANDS:
+                raise ValueError(cmd)
+        self._cmd = cmd
+    
+    command = property(_get_cmd, _set_cmd)
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError()
+        try:
+            return self.headers[name]
+        except KeyError:
+            return self.headers.get(name.replace('_', '-'))
+
+def frame_size(frame):
+    """ The memory used by the frame object itself (excluding headers and body, which are shared). """
+    size = sys.getsizeof(frame)
+    if hasattr(frame, '__dict__'):
+        size += sys.getsizeof(frame.__dict__)
+    return size
+
+def bench(frame_class, num_frames):
+    headers = {'destination': '/queue/test', 'message-id': 'id-1234', 'content-length': '4'}
+    body = 'body'
+    
+    construct = lambda: frame_class('MESSAGE', headers, body)
+    t_construct = min(timeit.repeat(construct, number=num_frames, repeat=3)) / num_frames
+    
+    frame = construct()
+    access = lambda: (frame.message_id, frame.destination)
+    t_access = min(timeit.repeat(access, number=num_frames, repeat=3)) / num_frames
+    
+    return (frame_size(frame), t_construct, t_access)
+
+def main():
+    num_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print "%-16s %12s %16s %22s" % ('class', 'bytes/frame', 'construct (us)', 'message_id+dest (us)')
+    for frame_class in (UnslottedFrame, Frame):
+        (size, t_construct, t_access) = bench(frame_class, num_frames)
+        print "%-16s %12d %16.3f %22.3f" % (frame_class.__name__, size, t_construct * 1e6, t_access * 1e6)
+
+if __name__ == '__main__':
+    main()
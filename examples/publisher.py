@@ -1,21 +1,22 @@
 import time
 import logging
-import pickle
 from datetime import datetime
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 from stompclient import PublishClient
+from stompclient.codec import CodecRegistry, JSONCodec, PickleCodec
 
-client = PublishClient('127.0.0.1', 61613)
+# The pickle codec is not registered by default; only use it between trusted peers.
+client = PublishClient('127.0.0.1', 61613, codecs=CodecRegistry([JSONCodec(), PickleCodec()]))
 client.connect()
 
 try:
     payload = {'key': 'value', 'counter': 0, 'list': ['a', 'b', 'c'], 'date': datetime.now()}
     while True:
         logger.debug("Sending message: {0}".format(payload))
-        client.send('/queue/example', pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+        client.send('/queue/example', payload, codec='pickle')
         time.sleep(1.0)
         payload['counter'] += 1
         payload['date'] = datetime.now()
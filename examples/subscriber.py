@@ -6,18 +6,19 @@ subscribe to incoming messages (and don't need to get fancy in how you handle
 the received frames).
 """
 import logging
-import pickle
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 from stompclient import PublishSubscribeClient
+from stompclient.codec import CodecRegistry, JSONCodec, PickleCodec
 
-def frame_received(frame):
-    # Do something with the frame!
-    payload = pickle.loads(frame.body)
+def frame_received(frame, payload):
+    # Do something with the frame (and its decoded body)!
     logger.info("Received data: {0!r}".format(payload))
 
-client = PublishSubscribeClient('127.0.0.1', 61613)
+# Unpickling runs code chosen by the publisher, so the pickle codec must be registered
+# explicitly (and only when every publisher to the destination is trusted).
+client = PublishSubscribeClient('127.0.0.1', 61613, codecs=CodecRegistry([JSONCodec(), PickleCodec()]))
 client.connect()
-client.subscribe("/queue/example", frame_received)
+client.subscribe("/queue/example", frame_received, decode=True)
 client.listen_forever()
@@ -9,18 +9,19 @@ PublishSubscribeClient.
 import threading
 import logging
 import time
-import pickle
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 from stompclient import PublishSubscribeClient
+from stompclient.codec import CodecRegistry, JSONCodec, PickleCodec
 
-def frame_received(frame):
-    # Do something with the frame!
-    payload = pickle.loads(frame.body)
+def frame_received(frame, payload):
+    # Do something with the frame (and its decoded body)!
     logger.info("Received data: {0!r}".format(payload))
 
-client = PublishSubscribeClient('127.0.0.1', 61613)
+# Unpickling runs code chosen by the publisher, so the pickle codec must be registered
+# explicitly (and only when every publisher to the destination is trusted).
+client = PublishSubscribeClient('127.0.0.1', 61613, codecs=CodecRegistry([JSONCodec(), PickleCodec()]))
 listener = threading.Thread(target=client.listen_forever, name='Frame-Receiver')
 listener.start()
 
@@ -30,7 +31,7 @@ client.listening_event.wait()
 try:
     result = client.connect()
     logger.info("Got session response from connect: {0}".format(result.session))
-    client.subscribe("/queue/example", frame_received)
+    client.subscribe("/queue/example", frame_received, decode=True)
     
     while True:
         time.sleep(1.0)
@@ -50,11 +50,11 @@ setup(name='stompclient',
       keywords='stomp client',
       test_suite="nose.collector",
       tests_require=['nose>=0.11', 'mock'],
+      extras_require={'aio': ['trollius']},
       classifiers=["Development Status :: 3 - Alpha",
                    "Intended Audience :: Developers",
                    "License :: OSI Approved :: Apache Software License",
                    "Operating System :: OS Independent",
-                   "Programming Language :: Python :: 2.6",
                    "Programming Language :: Python :: 2.7",
                    "Topic :: Software Development :: Libraries :: Python Modules",
                    ],
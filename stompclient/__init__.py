@@ -1,3 +1,3 @@
 from stompclient.simplex import PublishClient
 from stompclient.duplex import PublishSubscribeClient
-from stompclient.connection import ConnectionPool, ThreadLocalConnectionPool
\ No newline at end of file
+from stompclient.connection import ConnectionPool, ThreadLocalConnectionPool, BoundedConnectionPool
\ No newline at end of file
@@ -0,0 +1,654 @@
+"""
+Clients and a transport for asyncio-style event loops.
+
+Python 2 has no `asyncio` module, so this module requires its backport, `trollius`
+(``pip install stompclient[aio]``).  Coroutines are written in the trollius style::
+
+    @asyncio.coroutine
+    def consume():
+        client = AsyncPublishSubscribeClient('127.0.0.1')
+        yield From(client.connect())
+        subscription = yield From(client.subscribe('/queue/example'))
+        while True:
+            frame = yield From(subscription.get())
+            if frame is None:
+                break
+            yield From(client.send('/queue/replies', frame.body))
+"""
+import socket
+import logging
+from collections import deque
+
+import trollius as asyncio
+from trollius import From, Return
+
+from stompclient import frame
+from stompclient.simplex import BaseClient
+from stompclient.util import FrameBuffer
+from stompclient.exceptions import ConnectionError, NotConnectedError, FrameError, FrameSizeError
+
+__authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
+__copyright__ = "Copyright 2010 Hans Lellelid"
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+class AsyncConnection(asyncio.Protocol):
+    """
+    A STOMP connection driven by an event loop.
+
+    Received data is parsed with a :class:`stompclient.util.FrameBuffer` as it arrives and
+    the complete frames are passed to the `frame_handler` (typically a client's
+    :meth:`process_frames` method).  Sending never blocks: frames are handed to the
+    transport, and :meth:`send` returns a future that completes once the transport's write
+    buffer has drained below its high-water mark.
+
+    :ivar host: The STOMP server hostname or IP address.
+    :type host: str
+
+    :ivar port: The STOMP server port.
+    :type port: int
+
+    :ivar loop: The event loop.
+
+    :ivar buffer_options: Keyword arguments for the :class:`stompclient.util.FrameBuffer`
+                            that parses received frames.
+    :type buffer_options: dict
+
+    :ivar escape_headers: Whether header values are escaped as specified by STOMP 1.1, both
+                          in sent frames (see :meth:`stompclient.frame.Frame.pack`) and in
+                          received frames.
+    :type escape_headers: bool
+
+    :ivar frame_handler: The callable that is passed each batch of received frames.
+    :type frame_handler: `callable`
+
+    :ivar lost_handler: The callable that is passed the exception (or `None`) when the
+                        connection is closed.
+    :type lost_handler: `callable`
+    """
+
+    def __init__(self, host, port=61613, loop=None, buffer_options=None, escape_headers=False):
+        """
+        :param buffer_options: Keyword arguments for the :class:`stompclient.util.FrameBuffer`
+                                that parses received frames (e.g. `{'lazy_headers': True}`).
+        :type buffer_options: dict
+
+        :param escape_headers: Whether to escape the header values of sent frames (and to
+                                unescape those of received frames).
+        :type escape_headers: bool
+        """
+        self.log = logging.getLogger('%s.%s' % (self.__module__, self.__class__.__name__))
+        self.host = host
+        self.port = port
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.buffer_options = buffer_options if buffer_options else {}
+        self.escape_headers = escape_headers
+        self.frame_handler = None
+        self.lost_handler = None
+        self.transport = None
+        options = dict(self.buffer_options)
+        options.setdefault('unescape_headers', escape_headers)
+        self._buffer = FrameBuffer(**options)
+        self._connect_lock = asyncio.Lock(loop=self.loop)
+        self._drain_waiter = None
+        self._paused = False
+
+    @property
+    def connected(self):
+        """
+        Whether this connection is currently connected.
+        """
+        return self.transport is not None
+
+    @asyncio.coroutine
+    def connect(self):
+        """
+        Connects to the STOMP server if not already connected.
+
+        :raise stompclient.exceptions.ConnectionError: If the connection cannot be established.
+        """
+        with (yield From(self._connect_lock)):
+            if self.transport is not None:
+                return
+            try:
+                yield From(self.loop.create_connection(lambda: self, self.host, self.port))
+            except (socket.error, OSError), e:
+                raise ConnectionError(*e.args)
+
+    def disconnect(self):
+        """
+        Closes the connection (data that has already been sent is flushed first).
+
+        :raise stompclient.exceptions.NotConnectedError: If the connection is not currently connected.
+        """
+        if self.transport is None:
+            raise NotConnectedError()
+        self.transport.close()
+
+    def send(self, frame):
+        """
+        Sends a frame to the STOMP server.
+
+        :param frame: The frame to send.
+        :type frame: :class:`stompclient.frame.Frame`
+
+        :return: A future that completes when the frame may be followed by further frames
+                    without overfilling the transport's write buffer (see :meth:`drain`).
+        :rtype: :class:`trollius.Future`
+
+        :raise stompclient.exceptions.NotConnectedError: If the connection is not currently connected.
+        """
+        if self.transport is None:
+            raise NotConnectedError()
+        self.transport.write(frame.pack(escape=self.escape_headers))
+        return self.drain()
+
+    def drain(self):
+        """
+        Returns a future that completes when the transport's write buffer is below its
+        high-water mark (immediately, unless a large amount of data is waiting to be written).
+
+        :rtype: :class:`trollius.Future`
+        """
+        if self._paused:
+            if self._drain_waiter is None:
+                self._drain_waiter = asyncio.Future(loop=self.loop)
+            return self._drain_waiter
+        waiter = asyncio.Future(loop=self.loop)
+        waiter.set_result(None)
+        return waiter
+
+    def connection_made(self, transport):
+        sock = transport.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.transport = transport
+        self._paused = False
+
+    def data_received(self, data):
+        buf = self._buffer
+        buf.append(data)
+        while True:
+            try:
+                frames = buf.extract_frames()
+            except FrameSizeError, e:
+                self.log.error("Discarded received frame: %s" % e)
+                continue
+            if not frames:
+                break
+            if self.frame_handler is not None:
+                self.frame_handler(frames)
+            else:
+                self.log.debug("Ignoring %d frames received without a handler." % len(frames))
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        waiter = self._drain_waiter
+        if waiter is not None:
+            self._drain_waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self._buffer.clear()
+        self._paused = False
+        waiter = self._drain_waiter
+        if waiter is not None:
+            self._drain_waiter = None
+            if not waiter.done():
+                waiter.set_exception(ConnectionError("Connection lost."))
+        if self.lost_handler is not None:
+            self.lost_handler(exc)
+
+class AsyncPublishClient(BaseClient):
+    """
+    A publish-only STOMP client for event loops.
+
+    Like :class:`stompclient.simplex.PublishClient`, this client does not support the
+    'receipt' header or process CONNECTED frames.  The methods that send frames
+    (:meth:`send`, :meth:`ack`, :meth:`begin`, etc.) return a future that completes once
+    the frame has been handed to the transport and its write buffer has room for more::
+
+        yield From(client.send('/queue/example', 'body'))
+
+    The client owns a single :class:`AsyncConnection`, which is shared by all of the
+    coroutines that use the client.
+
+    :ivar loop: The event loop.
+
+    :ivar buffer_options: Keyword arguments for the :class:`stompclient.util.FrameBuffer`
+                            that parses received frames.
+    :type buffer_options: dict
+
+    :ivar timeout: How long (in seconds) to wait for responses from the server (e.g. the
+                    CONNECTED frame) before raising `trollius.TimeoutError`.
+    :type timeout: float
+    """
+
+    def __init__(self, host, port=61613, loop=None, timeout=5.0, connection_options=None,
+                 compression=None, codecs=None, frame_pool=None):
+        """
+        :param loop: The event loop (defaults to the current event loop).
+
+        :param timeout: How long (in seconds) to wait for responses from the server.
+        :type timeout: float
+
+        :param connection_options: Additional keyword arguments for the :class:`AsyncConnection`
+                                    (e.g. `buffer_options`, `escape_headers`).
+        :type connection_options: dict
+
+        :param compression: (optional) Message body compression.
+        :type compression: :class:`stompclient.compression.ZlibCompression`
+
+        :param codecs: (optional) The codec registry.
+        :type codecs: :class:`stompclient.codec.CodecRegistry`
+
+        :param frame_pool: (optional) A pool of reusable SEND and ACK frames.
+        :type frame_pool: :class:`stompclient.frame.FramePool`
+        """
+        super(AsyncPublishClient, self).__init__(host, port=port, socket_timeout=None, compression=compression,
+                                                 codecs=codecs, frame_pool=frame_pool)
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.timeout = timeout
+        self._connection = AsyncConnection(host, port, loop=self.loop, **(connection_options or {}))
+        self._connection.frame_handler = self.process_frames
+        self._connection.lost_handler = self.connection_lost
+
+    @property
+    def connection(self):
+        """
+        The connection used by this client.
+        :rtype: :class:`AsyncConnection`
+        """
+        return self._connection
+
+    @asyncio.coroutine
+    def connect(self, login=None, passcode=None, extra_headers=None):
+        """
+        Connects to the STOMP server (if necessary) and sends the CONNECT frame.
+        """
+        yield From(self.connection.connect())
+        connect = frame.ConnectFrame(login, passcode, extra_headers=extra_headers)
+        yield From(self.send_frame(connect))
+
+    @asyncio.coroutine
+    def disconnect(self, extra_headers=None):
+        """
+        Sends the DISCONNECT frame and closes the connection.
+        """
+        if self.connection.connected:
+            disconnect = frame.DisconnectFrame(extra_headers=extra_headers)
+            yield From(self.send_frame(disconnect))
+            try:
+                self.connection.disconnect()
+            except NotConnectedError:
+                pass
+
+    def __enter__(self):
+        raise TypeError("Use 'yield From(client.connect())' to connect an asynchronous client.")
+
+    def unsubscribe(self, destination, extra_headers=None):
+        """
+        Unsubscribe from a given destination.
+
+        :param destination: The destination to subscribe to.
+        :type destination: C{str}
+        """
+        raise NotImplementedError("%s client does not implement UNSUBSCRIBE" % (self.__class__,))
+
+    def send_frame(self, frame):
+        """
+        Sends a frame to the STOMP server.
+
+        :param frame: The frame instance to send.
+        :type frame: :class:`stompclient.frame.Frame`
+
+        :return: A future that completes when the transport can accept more data.
+        :rtype: :class:`trollius.Future`
+
+        :raise NotImplementedError: If the frame includes a 'receipt' header.
+        :raise stompclient.exceptions.NotConnectedError: If the client is not connected.
+        """
+        if 'receipt' in frame.headers:
+            raise NotImplementedError('%s client implementation does not support message receipts.' % (self.__class__,))
+        return self.connection.send(frame)
+
+    def process_frames(self, frames):
+        """
+        Dispatches a batch of received frames.
+
+        If the client was configured with `compression`, compressed message bodies are
+        decompressed first (frames that cannot be decompressed are logged and skipped).
+
+        :param frames: The received frames.
+        :type frames: `list` of :class:`stompclient.frame.Frame`
+        """
+        compression = self.compression
+        if compression is not None:
+            max_size = self.connection.buffer_options.get('max_body_size')
+        for frame in frames:
+            if compression is not None:
+                try:
+                    compression.decompress_frame(frame, max_size)
+                except FrameError as e:
+                    self.log.error("Discarded received frame: %s" % e)
+                    continue
+            self.dispatch_frame(frame)
+
+    def dispatch_frame(self, frame):
+        """
+        Handles a received frame.  This client only logs ERROR frames.
+
+        :param frame: Received frame.
+        :type frame: :class:`stompclient.frame.Frame`
+        """
+        if frame.command == 'ERROR':
+            self.log.error("Received error frame: %s" % frame)
+        else:
+            self.log.debug("Ignoring frame from server: %s" % frame)
+
+    def connection_lost(self, exc):
+        """
+        Called when the connection is closed.
+
+        :param exc: The exception that closed the connection (`None` if it was closed normally).
+        """
+        if exc is not None:
+            self.log.warning("Connection lost: %s" % exc)
+
+class Subscription(object):
+    """
+    The messages received for a destination subscribed to by an :class:`AsyncPublishSubscribeClient`.
+
+    Messages are queued as they are received; :meth:`get` returns the next one::
+
+        subscription = yield From(client.subscribe('/queue/example'))
+        while True:
+            frame = yield From(subscription.get())
+            if frame is None:
+                break
+
+    :ivar destination: The subscribed destination.
+    :type destination: str
+
+    :ivar decode: Whether the messages are returned together with their decoded bodies.
+    :type decode: bool
+    """
+
+    def __init__(self, destination, decode=False, maxsize=0, loop=None):
+        """
+        :param maxsize: The maximum number of queued messages (0 for no limit).  Messages
+                        received while the queue is full are logged and dropped.
+        :type maxsize: int
+        """
+        self.log = logging.getLogger('%s.%s' % (self.__module__, self.__class__.__name__))
+        self.destination = destination
+        self.decode = decode
+        self.maxsize = maxsize
+        self.closed = False
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self._messages = deque()
+        self._waiters = deque()
+
+    def __len__(self):
+        return len(self._messages)
+
+    def put(self, item):
+        """
+        Queues a received message (or its `(frame, payload)` tuple if `decode` is set).
+        """
+        if self.closed:
+            return
+        if self.maxsize and len(self._messages) >= self.maxsize:
+            self.log.error("Subscription queue for %s is full; dropped message." % self.destination)
+            return
+        self._messages.append(item)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def close(self):
+        """
+        Closes the subscription: once the queued messages have been consumed, :meth:`get`
+        returns `None`.
+        """
+        self.closed = True
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @asyncio.coroutine
+    def get(self):
+        """
+        Returns the next message, waiting until one is received.
+
+        :return: The MESSAGE frame (or a `(frame, payload)` tuple if `decode` is set), or
+                    `None` if the subscription has been closed (by :meth:`unsubscribe` or
+                    because the connection was lost).
+        """
+        while not self._messages:
+            if self.closed:
+                raise Return(None)
+            waiter = asyncio.Future(loop=self.loop)
+            self._waiters.append(waiter)
+            yield From(waiter)
+        raise Return(self._messages.popleft())
+
+class AsyncPublishSubscribeClient(AsyncPublishClient):
+    """
+    A publish-subscribe STOMP client for event loops.
+
+    Subscriptions are :class:`Subscription` queues of received messages, and frames sent
+    with a 'receipt' header return a future for the RECEIPT frame::
+
+        receipt = yield From(client.send('/queue/example', 'body', extra_headers={'receipt': 'r1'}))
+
+    :ivar subscribed_destinations: The active subscriptions, keyed by destination.
+    :type subscribed_destinations: `dict` of `str` to :class:`Subscription`
+
+    :ivar errors: A queue of the ERROR frames received from the server that did not
+                    answer a pending request.
+    :type errors: :class:`trollius.Queue`
+
+    :ivar session: The session id from the most recent CONNECTED frame.
+    :type session: str
+    """
+
+    def __init__(self, host, port=61613, loop=None, timeout=5.0, connection_options=None,
+                 compression=None, codecs=None, frame_pool=None):
+        super(AsyncPublishSubscribeClient, self).__init__(host, port=port, loop=loop, timeout=timeout,
+                                                          connection_options=connection_options,
+                                                          compression=compression, codecs=codecs,
+                                                          frame_pool=frame_pool)
+        self.subscribed_destinations = {}
+        self.errors = asyncio.Queue(loop=self.loop)
+        self.session = None
+        self._receipts = {}
+        self._connected = None
+
+    @asyncio.coroutine
+    def connect(self, login=None, passcode=None, extra_headers=None):
+        """
+        Connects to the STOMP server (if necessary), sends the CONNECT frame and returns the
+        CONNECTED frame.
+
+        :rtype: :class:`stompclient.frame.Frame`
+
+        :raise stompclient.exceptions.FrameError: If the server responds with an ERROR frame.
+        :raise trollius.TimeoutError: If no response is received within `timeout` seconds.
+        """
+        yield From(self.connection.connect())
+        self._connected = waiter = asyncio.Future(loop=self.loop)
+        try:
+            connect = frame.ConnectFrame(login, passcode, extra_headers=extra_headers)
+            yield From(self.connection.send(connect))
+            connected = yield From(asyncio.wait_for(waiter, self.timeout, loop=self.loop))
+        finally:
+            self._connected = None
+        raise Return(connected)
+
+    @asyncio.coroutine
+    def disconnect(self, extra_headers=None):
+        """
+        Unsubscribes from all destinations, sends the DISCONNECT frame and closes the connection.
+        """
+        if self.connection.connected:
+            for destination in list(self.subscribed_destinations):
+                yield From(self.unsubscribe(destination))
+            yield From(super(AsyncPublishSubscribeClient, self).disconnect(extra_headers=extra_headers))
+
+    @asyncio.coroutine
+    def subscribe(self, destination, ack=None, extra_headers=None, decode=False, maxsize=0):
+        """
+        Subscribes to a destination.
+
+        :param destination: The destination "path" to subscribe to.
+        :type destination: `str`
+
+        :param ack: If set to 'client' will require clients to explicitly :meth:`ack` any
+                    frames received (in order for server to consider them delivered).
+        :type ack: `str`
+
+        :param decode: Whether to return messages with their bodies decoded by the codec
+                        for their content-type, as `(frame, payload)` tuples (messages whose
+                        body cannot be decoded are logged and dropped).
+        :type decode: `bool`
+
+        :param maxsize: The maximum number of queued messages (0 for no limit).
+        :type maxsize: `int`
+
+        :return: The subscription.
+        :rtype: :class:`Subscription`
+        """
+        subscription = Subscription(destination, decode=decode, maxsize=maxsize, loop=self.loop)
+        previous = self.subscribed_destinations.get(destination)
+        self.subscribed_destinations[destination] = subscription
+        if previous is not None:
+            previous.close()
+        subscribe = frame.SubscribeFrame(destination, ack=ack, extra_headers=extra_headers)
+        yield From(self.send_frame(subscribe))
+        raise Return(subscription)
+
+    @asyncio.coroutine
+    def unsubscribe(self, destination, extra_headers=None):
+        """
+        Unsubscribes from a destination and closes its subscription.
+
+        :param destination: The destination to unsubscribe from.
+        :type destination: `str`
+        """
+        unsubscribe = frame.UnsubscribeFrame(destination, extra_headers=extra_headers)
+        subscription = self.subscribed_destinations.pop(destination, None)
+        if subscription is not None:
+            subscription.close()
+        yield From(self.send_frame(unsubscribe))
+
+    def send_frame(self, frame):
+        """
+        Sends a frame to the STOMP server.
+
+        If the frame has a 'receipt' header, the returned future completes with the
+        RECEIPT frame (or raises `trollius.TimeoutError` if none is received within
+        `timeout` seconds), but, as for other frames, not before the transport can accept
+        more data.
+
+        :param frame: The frame instance to send.
+        :type frame: :class:`stompclient.frame.Frame`
+
+        :rtype: :class:`trollius.Future`
+        """
+        receipt = frame.headers.get('receipt')
+        if receipt is None:
+            return self.connection.send(frame)
+        waiter = asyncio.Future(loop=self.loop)
+        self._receipts[receipt] = waiter
+        try:
+            drained = self.connection.send(frame)
+        except:
+            del self._receipts[receipt]
+            raise
+        return asyncio.ensure_future(self._wait_for_receipt(receipt, waiter, drained), loop=self.loop)
+
+    @asyncio.coroutine
+    def _wait_for_receipt(self, receipt, waiter, drained):
+        try:
+            yield From(drained)
+            result = yield From(asyncio.wait_for(waiter, self.timeout, loop=self.loop))
+        finally:
+            self._receipts.pop(receipt, None)
+        raise Return(result)
+
+    def dispatch_frame(self, frame):
+        """
+        Routes a received frame to its subscription, receipt or connect request.
+
+        :param frame: Received frame.
+        :type frame: :class:`stompclient.frame.Frame`
+        """
+        command = frame.command
+        if command == 'MESSAGE':
+            subscription = self.subscribed_destinations.get(frame.destination)
+            if subscription is None:
+                self.log.debug("Ignoring frame for unsubscribed destination: %s" % frame)
+            elif subscription.decode:
+                try:
+                    payload = self.codecs.decode_frame(frame)
+                except Exception:
+                    self.log.exception("Unable to decode body of frame: %r" % frame)
+                    return
+                subscription.put((frame, payload))
+            else:
+                subscription.put(frame)
+        elif command == 'RECEIPT':
+            waiter = self._receipts.pop(frame.receipt_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(frame)
+        elif command == 'CONNECTED':
+            self.session = frame.get_header('session')
+            if self._connected is not None and not self._connected.done():
+                self._connected.set_result(frame)
+        elif command == 'ERROR':
+            if self._connected is not None and not self._connected.done():
+                self._connected.set_exception(FrameError("Connection refused: %s" % frame.get_header('message')))
+            else:
+                waiter = self._receipts.pop(frame.receipt_id, None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_exception(FrameError("Server error: %s" % frame.get_header('message')))
+                else:
+                    self.errors.put_nowait(frame)
+        else:
+            self.log.info("Ignoring frame from server: %s" % frame)
+
+    def connection_lost(self, exc):
+        """
+        Called when the connection is closed: pending receipts fail with a
+        :class:`stompclient.exceptions.ConnectionError` and the subscriptions are closed.
+        """
+        super(AsyncPublishSubscribeClient, self).connection_lost(exc)
+        waiters = self._receipts.values()
+        if self._connected is not None:
+            waiters.append(self._connected)
+        self._receipts.clear()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(ConnectionError("Connection lost."))
+        subscriptions = self.subscribed_destinations.values()
+        self.subscribed_destinations.clear()
+        for subscription in subscriptions:
+            subscription.close()
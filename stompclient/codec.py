@@ -0,0 +1,257 @@
+"""
+Encoding and decoding of message bodies, selected by content-type.
+"""
+import abc
+import json
+import time
+import threading
+import cPickle
+import cStringIO
+
+from stompclient.frame import _as_bytes
+
+__authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
+__copyright__ = "Copyright 2010 Hans Lellelid"
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+ 
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+class Codec(object):
+    """
+    Abstract base class for message body codecs.
+    
+    Codec instances are shared by all threads using a client, so any state they reuse
+    across calls (e.g. encoder objects or scratch buffers) must be thread-safe.
+    
+    :ivar name: The short name used to select the codec (e.g. `client.send(..., codec='json')`).
+    :type name: str
+    
+    :ivar content_type: The value of the content-type header for encoded bodies.
+    :type content_type: str
+    """
+    __metaclass__ = abc.ABCMeta
+    
+    name = None
+    content_type = None
+    
+    @abc.abstractmethod
+    def encode(self, obj):
+        """
+        Encodes an object as a message body.
+        
+        :rtype: str
+        """
+    
+    @abc.abstractmethod
+    def decode(self, body):
+        """
+        Decodes a message body.
+        
+        :param body: The message body (a `str` or other buffer-protocol object).
+        
+        :return: The decoded object.
+        """
+
+class JSONCodec(Codec):
+    """
+    Encodes message bodies as JSON.
+    
+    A single (stateless and therefore thread-safe) encoder and decoder are reused for all
+    messages, rather than being configured anew by every `json.dumps`/`json.loads` call.
+    """
+    name = 'json'
+    content_type = 'application/json'
+    
+    def __init__(self, **encoder_options):
+        """
+        :param encoder_options: Keyword arguments for the `json.JSONEncoder` (e.g. `default`).
+        """
+        encoder_options.setdefault('separators', (',', ':'))
+        self.encoder = json.JSONEncoder(**encoder_options)
+        self.decoder = json.JSONDecoder()
+    
+    def encode(self, obj):
+        return self.encoder.encode(obj)
+    
+    def decode(self, body):
+        return self.decoder.decode(_as_bytes(body))
+
+class PickleCodec(Codec):
+    """
+    Encodes message bodies with `cPickle`.
+    
+    Each thread reuses its own pickler and output buffer across messages.  Only decode
+    pickled messages from trusted senders: unpickling can execute arbitrary code.  This
+    codec is therefore not in the default :class:`CodecRegistry`; register it explicitly
+    (e.g. `CodecRegistry([JSONCodec(), PickleCodec()])`) where every publisher is trusted.
+    """
+    name = 'pickle'
+    content_type = 'application/x-python-pickle'
+    
+    def __init__(self, protocol=cPickle.HIGHEST_PROTOCOL):
+        """
+        :param protocol: The pickle protocol.
+        :type protocol: int
+        """
+        self.protocol = protocol
+        self._local = threading.local()
+    
+    def encode(self, obj):
+        local = self._local
+        try:
+            (buf, pickler) = local.pickler
+        except AttributeError:
+            buf = cStringIO.StringIO()
+            pickler = cPickle.Pickler(buf, self.protocol)
+            local.pickler = (buf, pickler)
+        buf.seek(0)
+        buf.truncate()
+        pickler.clear_memo()
+        pickler.dump(obj)
+        return buf.getvalue()
+    
+    def decode(self, body):
+        return cPickle.loads(_as_bytes(body))
+
+class CodecStats(object):
+    """
+    Counters for the work done by a codec.
+    
+    The times are processor (CPU) times as measured by `time.clock`, in seconds.
+    
+    :ivar encoded: The number of encoded messages.
+    :type encoded: int
+    
+    :ivar encode_time: The time spent encoding messages.
+    :type encode_time: float
+    
+    :ivar decoded: The number of decoded messages.
+    :type decoded: int
+    
+    :ivar decode_time: The time spent decoding messages.
+    :type decode_time: float
+    """
+    
+    def __init__(self):
+        self.encoded = 0
+        self.encode_time = 0.0
+        self.decoded = 0
+        self.decode_time = 0.0
+    
+    def __repr__(self):
+        return '<%s encoded=%d (%.3fs) decoded=%d (%.3fs)>' % (self.__class__.__name__, self.encoded,
+                                                             self.encode_time, self.decoded, self.decode_time)
+
+class CodecRegistry(object):
+    """
+    A registry of codecs, selected by name for encoding and by content-type for decoding.
+    
+    The content-type of a received message is chosen by its publisher, so only codecs
+    that are safe to run on untrusted input should be registered for subscribers.
+    
+    :ivar stats: The :class:`CodecStats` of each registered codec, keyed by codec name.  The 
+                    registry is shared by the threads using a client, so the counters are only 
+                    updated while holding a lock.
+    :type stats: dict
+    """
+    
+    def __init__(self, codecs=None):
+        """
+        :param codecs: The codecs to register (defaults to just the JSON codec).
+        :type codecs: `list` of :class:`Codec`
+        """
+        self._by_name = {}
+        self._by_content_type = {}
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        if codecs is None:
+            codecs = [JSONCodec()]
+        for codec in codecs:
+            self.register(codec)
+    
+    def register(self, codec):
+        """
+        Registers a codec (replacing any codec with the same name or content-type).
+        
+        :param codec: The codec.
+        :type codec: :class:`Codec`
+        """
+        self._by_name[codec.name] = codec
+        self._by_content_type[codec.content_type] = codec
+        self.stats[codec.name] = CodecStats()
+    
+    def get(self, name):
+        """
+        Returns the codec registered with the specified name.
+        
+        :rtype: :class:`Codec`
+        
+        :raise KeyError: If there is no such codec.
+        """
+        return self._by_name[name]
+    
+    def for_content_type(self, content_type):
+        """
+        Returns the codec for the specified content-type (any parameters, such as a
+        charset, are ignored), or `None` if there is no such codec.
+        
+        :rtype: :class:`Codec`
+        """
+        if content_type is None:
+            return None
+        codec = self._by_content_type.get(content_type)
+        if codec is None and ';' in content_type:
+            codec = self._by_content_type.get(content_type.split(';', 1)[0].strip())
+        return codec
+    
+    def encode(self, name, obj):
+        """
+        Encodes an object with the named codec.
+        
+        :param name: The codec name (e.g. 'json').
+        :type name: str
+        
+        :return: The encoded body and its content-type.
+        :rtype: `tuple`
+        
+        :raise KeyError: If there is no such codec.
+        """
+        codec = self._by_name[name]
+        start = time.clock()
+        body = codec.encode(obj)
+        elapsed = time.clock() - start
+        with self._stats_lock:
+            stats = self.stats[codec.name]
+            stats.encode_time += elapsed
+            stats.encoded += 1
+        return (body, codec.content_type)
+    
+    def decode_frame(self, frame):
+        """
+        Decodes the body of a received frame using the codec for its content-type.
+        
+        :param frame: The received frame.
+        :type frame: :class:`stompclient.frame.Frame`
+        
+        :return: The decoded object, or the body itself if the frame has no content-type
+                    header or there is no codec for its content-type.
+        """
+        codec = self.for_content_type(frame.get_header('content-type'))
+        if codec is None:
+            return frame.body
+        start = time.clock()
+        obj = codec.decode(frame.body)
+        elapsed = time.clock() - start
+        with self._stats_lock:
+            stats = self.stats[codec.name]
+            stats.decode_time += elapsed
+            stats.decoded += 1
+        return obj
@@ -0,0 +1,213 @@
+"""
+Transparent compression of message bodies.
+"""
+import time
+import zlib
+import struct
+
+from stompclient.frame import _as_bytes
+from stompclient.exceptions import FrameError, FrameSizeError
+
+__authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
+__copyright__ = "Copyright 2010 Hans Lellelid"
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+ 
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+# The header that identifies compressed bodies (STOMP passes unknown headers through to
+# subscribers unchanged).
+ENCODING_HEADER = 'content-encoding'
+
+class CompressionStats(object):
+    """
+    Counters for the work done by a :class:`ZlibCompression` instance.
+    
+    The times are processor (CPU) times as measured by `time.clock`, in seconds.
+    
+    :ivar compressed_frames: The number of frames whose body was compressed.
+    :type compressed_frames: int
+    
+    :ivar uncompressed_bytes: The total size of the compressed bodies before compression.
+    :type uncompressed_bytes: int
+    
+    :ivar compressed_bytes: The total size of the compressed bodies after compression.
+    :type compressed_bytes: int
+    
+    :ivar compress_time: The time spent compressing bodies.
+    :type compress_time: float
+    
+    :ivar decompressed_frames: The number of received frames whose body was decompressed.
+    :type decompressed_frames: int
+    
+    :ivar decompress_time: The time spent decompressing bodies.
+    :type decompress_time: float
+    """
+    
+    def __init__(self):
+        self.compressed_frames = 0
+        self.uncompressed_bytes = 0
+        self.compressed_bytes = 0
+        self.compress_time = 0.0
+        self.decompressed_frames = 0
+        self.decompress_time = 0.0
+    
+    @property
+    def ratio(self):
+        """
+        The compression ratio (compressed size / uncompressed size) of the compressed bodies,
+        or `None` if no bodies have been compressed.
+        """
+        if not self.uncompressed_bytes:
+            return None
+        return float(self.compressed_bytes) / self.uncompressed_bytes
+    
+    def __repr__(self):
+        return '<%s compressed=%d ratio=%s decompressed=%d>' % (self.__class__.__name__, self.compressed_frames,
+                                                               self.ratio, self.decompressed_frames)
+
+class ZlibCompression(object):
+    """
+    Compresses the bodies of sent frames with zlib, and decompresses received ones.
+    
+    Compressed frames are tagged with a 'content-encoding: zlib' header.  Only bodies of
+    at least `threshold` bytes are compressed (small bodies rarely shrink enough to be
+    worth the CPU time), and a body is sent uncompressed if compressing it does not make
+    it smaller.  Both the sending and the receiving client must be configured with a
+    compression instance::
+        
+        client = PublishClient('localhost', compression=ZlibCompression(threshold=4096))
+    
+    (Preset dictionaries are not supported, since the Python 2 zlib module does not
+    expose them.)
+    
+    :ivar threshold: The minimum size (in bytes) of bodies to compress.
+    :type threshold: int
+    
+    :ivar level: The zlib compression level (1-9).
+    :type level: int
+    
+    :ivar max_size: The maximum size (in bytes) of decompressed bodies, used when the
+                    receiving client does not pass a limit (`None` for no limit).
+    :type max_size: int
+    
+    :ivar stats: The compression statistics.
+    :type stats: :class:`CompressionStats`
+    """
+    
+    # The value of the content-encoding header for zlib-compressed bodies.
+    encoding = 'zlib'
+    
+    def __init__(self, threshold=1024, level=6, max_size=None):
+        """
+        :param threshold: The minimum size (in bytes) of bodies to compress.
+        :type threshold: int
+        
+        :param level: The zlib compression level (1 is fastest, 9 gives the best compression).
+        :type level: int
+        
+        :param max_size: The maximum size (in bytes) of decompressed bodies.
+        :type max_size: int
+        """
+        self.threshold = threshold
+        self.level = level
+        self.max_size = max_size
+        self.stats = CompressionStats()
+    
+    def compress_frame(self, frame):
+        """
+        Compresses the body of a frame to be sent (if it is large enough), setting the
+        content-encoding header.
+        
+        Frames that already have a content-encoding header are left alone.
+        
+        :param frame: The frame (which is modified in place).
+        :type frame: :class:`stompclient.frame.Frame`
+        
+        :return: Whether the body was compressed.
+        :rtype: bool
+        """
+        body = frame.body
+        if len(body) < self.threshold or ENCODING_HEADER in frame.headers:
+            return False
+        
+        body = _as_bytes(body)
+        start = time.clock()
+        compressed = zlib.compress(body, self.level)
+        elapsed = time.clock() - start
+        
+        stats = self.stats
+        stats.compress_time += elapsed
+        if len(compressed) >= len(body):
+            return False
+        stats.compressed_frames += 1
+        stats.uncompressed_bytes += len(body)
+        stats.compressed_bytes += len(compressed)
+        
+        frame.body = compressed
+        frame.headers[ENCODING_HEADER] = self.encoding
+        return True
+    
+    def decompress_frame(self, frame, max_size=None):
+        """
+        Decompresses the body of a received frame if it has a zlib content-encoding header
+        (which is removed).
+        
+        The decompressed body is limited to `max_size` bytes, so that a small compressed
+        body cannot expand beyond the size limits of the connection's frame buffer.
+        
+        :param frame: The frame (which is modified in place).
+        :type frame: :class:`stompclient.frame.Frame`
+        
+        :param max_size: The maximum size (in bytes) of the decompressed body (defaults to
+                            the `max_size` of this instance).
+        :type max_size: int
+        
+        :return: Whether the body was decompressed.
+        :rtype: bool
+        
+        :raise stompclient.exceptions.FrameSizeError: If the decompressed body would exceed
+                    the maximum size.
+        :raise stompclient.exceptions.FrameError: If the body cannot be decompressed.
+        """
+        if frame.get_header(ENCODING_HEADER) != self.encoding:
+            return False
+        if max_size is None:
+            max_size = self.max_size
+        
+        data = _as_bytes(frame.body)
+        start = time.clock()
+        decompressor = zlib.decompressobj()
+        try:
+            if max_size is None:
+                body = decompressor.decompress(data) + decompressor.flush()
+            else:
+                # Asking for one byte more than allowed tells an oversized body apart.
+                body = decompressor.decompress(data, max_size + 1)
+                if len(body) <= max_size and not decompressor.unconsumed_tail:
+                    body += decompressor.flush(max_size + 1 - len(body))
+                if len(body) > max_size or decompressor.unconsumed_tail:
+                    raise FrameSizeError("Decompressed frame body exceeds maximum size (%d bytes)" % max_size)
+        except zlib.error, e:
+            raise FrameError("Unable to decompress frame body: %s" % e)
+        # Unlike zlib.decompress, a decompressor does not complain about a truncated stream,
+        # so check the trailing (big-endian) adler32 checksum of the complete stream.
+        stream = data[:len(data) - len(decompressor.unused_data)]
+        if stream[-4:] != struct.pack('>I', zlib.adler32(body) & 0xffffffff):
+            raise FrameError("Unable to decompress frame body: incomplete or truncated stream")
+        self.stats.decompress_time += time.clock() - start
+        self.stats.decompressed_frames += 1
+        
+        headers = frame.headers
+        del headers[ENCODING_HEADER]
+        if 'content-length' in headers:
+            headers['content-length'] = str(len(body))
+        frame.body = body
+        return True
@@ -1,10 +1,18 @@
 import abc
+import math
+import time
+import random
 import socket
+import select
 import errno
+import logging
 import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 
+from stompclient.frame import Frame, CONNECT, CONNECTED, DISCONNECT, SUBSCRIBE, UNSUBSCRIBE, ERROR, parse_heart_beat, _body_length
 from stompclient.util import FrameBuffer
-from stompclient.exceptions import ConnectionError, ConnectionTimeoutError, NotConnectedError
+from stompclient.exceptions import ConnectionError, ConnectionTimeoutError, NotConnectedError, FrameError, PoolTimeoutError
 
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>', 'Andy McCurdy (redis)']
 __copyright__ = "Copyright 2010 Hans Lellelid, Copyright 2010 Andy McCurdy"
@@ -20,6 +28,22 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
+def _poll_readable(sock, timeout=0):
+    """
+    Returns whether a socket is readable (or has been closed) within `timeout` seconds.
+    
+    `poll` is used where available, since `select` cannot watch descriptors of 
+    FD_SETSIZE (typically 1024) or above.
+    
+    :rtype: bool
+    """
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(int(math.ceil(timeout * 1000))))
+    (readable, _, _) = select.select([sock], [], [], timeout)
+    return bool(readable)
+
 class ConnectionPool(object):
     """
     A global pool of connections keyed by host:port.
@@ -27,10 +51,20 @@ class ConnectionPool(object):
     This pool does not provide any thread-localization for the connections that 
     it stores; use the ThreadLocalConnectionPool subclass if you want to ensure
     that connections cannot be shared between threads.   
+    
+    :ivar connection_class: The class of the connections created by this pool (e.g.
+                            :class:`ReconnectingConnection`).
+    :type connection_class: type
+    
+    :ivar connection_kwargs: Additional keyword arguments passed to the constructor of
+                            each :class:`Connection` created by this pool.
+    :type connection_kwargs: dict
     """
     
-    def __init__(self):
+    def __init__(self, connection_class=None, **connection_kwargs):
         self.connections = {}
+        self.connection_class = connection_class if connection_class is not None else Connection
+        self.connection_kwargs = connection_kwargs
 
     def make_connection_key(self, host, port):
         """
@@ -44,7 +78,7 @@ class ConnectionPool(object):
         """
         key = self.make_connection_key(host, port)
         if key not in self.connections:
-            self.connections[key] = Connection(host, port, socket_timeout)
+            self.connections[key] = self.connection_class(host, port, socket_timeout, **self.connection_kwargs)
         return self.connections[key]
 
     def get_all_connections(self):
@@ -62,6 +96,358 @@ class ThreadLocalConnectionPool(ConnectionPool, threading.local):
     """
     pass
 
+class BoundedConnectionPool(ConnectionPool):
+    """
+    A pool that shares a bounded number of connections per host:port between threads.
+    
+    Connections are checked out for exclusive use and checked back in afterwards; when all
+    of the connections for a host:port are in use, :meth:`checkout` waits for one to be
+    checked in::
+    
+        pool = BoundedConnectionPool(max_connections=4)
+        with pool.connection('localhost', 61613) as conn:
+            conn.send(frame)
+    
+    A :class:`stompclient.simplex.PublishClient` created with this pool checks out a 
+    connection for every frame it sends, so any number of threads can publish over at most
+    `max_connections` sockets.  (Duplex clients need a dedicated connection for their 
+    listening loop and cannot use this pool.)
+    
+    Checked-in connections are checked for health (see :meth:`check_connection`) and closed
+    if they have failed.  Idle connections are reused most recently used first, so that 
+    surplus connections stay idle and are closed after `idle_timeout`.
+    
+    The pool has no timer thread: if the CONNECT frame requests heart-beats, the application
+    must call :meth:`heartbeat` periodically so that idle connections keep beating (otherwise 
+    the server closes them and they are only replaced when they are next checked in).
+    
+    :ivar min_connections: The number of connections per host:port that are opened when a 
+                            connection to it is first checked out (and re-opened by later
+                            checkouts if some have been closed), and kept open regardless of
+                            `idle_timeout`.
+    :type min_connections: int
+    
+    :ivar max_connections: The maximum number of connections per host:port.
+    :type max_connections: int
+    
+    :ivar timeout: How long (in seconds) :meth:`checkout` waits for a connection by default
+                    (`None` to wait indefinitely).
+    :type timeout: float
+    
+    :ivar idle_timeout: How long (in seconds) connections beyond `min_connections` may be idle
+                        before they are closed (`None` to keep them open).
+    :type idle_timeout: float
+    """
+    
+    def __init__(self, min_connections=0, max_connections=8, timeout=None, idle_timeout=None, 
+                 connection_class=None, **connection_kwargs):
+        """
+        The remaining keyword arguments are passed to the constructor of each connection.
+        
+        :raise ValueError: If `max_connections` is less than 1 or less than `min_connections`.
+        """
+        if max_connections < 1 or min_connections > max_connections:
+            raise ValueError("Invalid pool size: min_connections=%r, max_connections=%r" 
+                             % (min_connections, max_connections))
+        super(BoundedConnectionPool, self).__init__(connection_class, **connection_kwargs)
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.log = logging.getLogger('%s.%s' % (self.__module__, self.__class__.__name__))
+        # Signalled when a connection is checked in or closed.
+        self._available = threading.Condition(threading.Lock())
+        # The idle connections (with their check-in times) per key, least recently used first.
+        self._idle = {}
+        # The key of each connection (the host and port of a ReconnectingConnection may change).
+        self._keys = {}
+        # The CONNECT frame sent on each new connection, per key.
+        self._connect_frames = {}
+    
+    def get_connection(self, host, port, socket_timeout=None):
+        """
+        Not supported: connections must be checked out (see :meth:`checkout`).
+        
+        :raise TypeError: Always, since connections that are not checked in again would 
+                    exhaust the pool.
+        """
+        raise TypeError("%s connections must be checked out with checkout() or connection(), "
+                        "not get_connection()." % (self.__class__.__name__,))
+    
+    def get_all_connections(self):
+        "Return a list of all connection objects (idle or in use) the pool knows about"
+        with self._available:
+            return [conn for conns in self.connections.values() for conn in conns]
+    
+    def set_connect_frame(self, host, port, frame):
+        """
+        Sets the CONNECT frame that is sent on each connection to the specified host:port when
+        it connects (or `None` to send nothing).
+        """
+        with self._available:
+            self._connect_frames[self.make_connection_key(host, port)] = frame
+    
+    def checkout(self, host, port, socket_timeout=None, block=True, timeout=None):
+        """
+        Checks out a connection to the specified host and port for exclusive use.  The 
+        connection is connected if necessary; the CONNECT frame set with 
+        :meth:`set_connect_frame` is then sent on it and the server's CONNECTED frame is read
+        (see :meth:`Connection.read_connected`).
+        
+        If the pool holds fewer than `min_connections` connections to the host:port, the 
+        missing ones are then opened (in the calling thread) and added to the idle connections.
+        
+        :param block: Whether to wait for a connection if all of them are in use.
+        :type block: bool
+        
+        :param timeout: How long (in seconds) to wait (defaults to the pool's `timeout`).
+        :type timeout: float
+        
+        :return: The connection, which must be returned with :meth:`checkin`.
+        :rtype: :class:`Connection`
+        
+        :raise stompclient.exceptions.PoolTimeoutError: If no connection became available in time.
+        :raise stompclient.exceptions.ConnectionError: If connecting failed (the connection is 
+                    discarded).
+        :raise stompclient.exceptions.FrameError: If the server refused the CONNECT frame (the
+                    connection is discarded).
+        """
+        key = self.make_connection_key(host, port)
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None
+        with self._available:
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    (conn, _) = idle.pop()
+                    break
+                conns = self.connections.setdefault(key, [])
+                if len(conns) < self.max_connections:
+                    conn = self.connection_class(host, port, socket_timeout, **self.connection_kwargs)
+                    conns.append(conn)
+                    self._keys[conn] = key
+                    break
+                if not block:
+                    raise PoolTimeoutError("All %d connections to %s are in use." % (len(conns), key))
+                if timeout is None:
+                    self._available.wait()
+                else:
+                    if deadline is None:
+                        deadline = time.time() + timeout
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolTimeoutError("No connection to %s became available within %.3f seconds." 
+                                               % (key, timeout))
+                    self._available.wait(remaining)
+            connect_frame = self._connect_frames.get(key)
+            # Reserve the slots of the connections that are missing below min_connections.
+            conns = self.connections.setdefault(key, [])
+            filling = []
+            while len(conns) < self.min_connections:
+                extra = self.connection_class(host, port, socket_timeout, **self.connection_kwargs)
+                conns.append(extra)
+                self._keys[extra] = key
+                filling.append(extra)
+        
+        try:
+            self._open(conn, connect_frame)
+        except:
+            for extra in filling:
+                self._discard(extra)
+            raise
+        for extra in filling:
+            try:
+                self._open(extra, connect_frame)
+            except (socket.error, FrameError), e:
+                self.log.warning("Unable to open pooled connection to %s: %s" % (key, e))
+            else:
+                self.checkin(extra)
+        return conn
+    
+    def _open(self, connection, connect_frame):
+        """
+        Connects a checked-out connection (if necessary), sending the CONNECT frame and reading
+        the server's CONNECTED frame.  The connection is discarded if this fails.
+        """
+        if connection.connected:
+            return
+        try:
+            connection.connect()
+            if connect_frame is not None:
+                connection.send(connect_frame)
+                # Otherwise the CONNECTED frame would be left on the socket (and heart-beats
+                # would not be negotiated).
+                connection.read_connected()
+        except:
+            self._discard(connection)
+            raise
+    
+    def checkin(self, connection, discard=False):
+        """
+        Returns a checked-out connection to the pool.  Connections that fail the health 
+        check (or are to be discarded) are closed instead.
+        
+        :param discard: Whether to close the connection (e.g. after an error).
+        :type discard: bool
+        """
+        if discard or not self.check_connection(connection):
+            self._discard(connection)
+            return
+        now = time.time()
+        expired = []
+        with self._available:
+            key = self._keys[connection]
+            idle = self._idle.setdefault(key, deque())
+            idle.append((connection, now))
+            if self.idle_timeout is not None:
+                conns = self.connections[key]
+                while idle and len(conns) > self.min_connections and idle[0][1] < now - self.idle_timeout:
+                    (conn, _) = idle.popleft()
+                    self._remove(conn)
+                    expired.append(conn)
+            self._available.notify()
+        for conn in expired:
+            self._close(conn)
+    
+    @contextmanager
+    def connection(self, host, port, socket_timeout=None, block=True, timeout=None):
+        """
+        A context manager that checks out a connection (see :meth:`checkout`) and checks it
+        in again; the connection is discarded if a socket error (e.g. a 
+        :class:`stompclient.exceptions.ConnectionError`) is raised while it is in use.
+        """
+        conn = self.checkout(host, port, socket_timeout, block=block, timeout=timeout)
+        discard = False
+        try:
+            yield conn
+        except socket.error:
+            discard = True
+            raise
+        finally:
+            self.checkin(conn, discard=discard)
+    
+    def check_connection(self, connection):
+        """
+        Returns whether a connection is still usable: it must be connected, and the server 
+        must neither have closed the socket nor sent anything but heart-beats.
+        
+        The data waiting on the socket is read without blocking.  (Nothing else is received on
+        a publishing connection once the CONNECTED frame has been read by :meth:`checkout`; 
+        another frame would typically be an ERROR frame sent before the server closes the
+        connection.)  A heart-beat is then sent if one is due (see :meth:`Connection.heartbeat`).
+        
+        :rtype: bool
+        """
+        sock = connection._sock
+        if sock is None:
+            return False
+        try:
+            while _poll_readable(sock):
+                data = sock.recv(4096)
+                if not data or data.strip('\r\n'):
+                    return False
+            connection.heartbeat()
+        except (socket.error, select.error, ValueError, NotConnectedError):
+            return False
+        return True
+    
+    def heartbeat(self):
+        """
+        Checks the idle connections (see :meth:`check_connection`), which sends the heart-beats
+        that are due, and closes those that have failed.
+        
+        Idle connections are not otherwise written to, so when heart-beats have been negotiated
+        this must be called periodically (at the returned interval) to keep them open.
+        
+        :return: The time (in seconds) until this method should next be called, or `None` if
+                    no idle connection heart-beats.
+        :rtype: float
+        """
+        with self._available:
+            checking = [(key, conn) for (key, idle) in self._idle.items() for (conn, _) in idle]
+        wait = None
+        for (key, conn) in checking:
+            # Each connection is taken out of the pool only while it is being checked, so the
+            # others can still be checked out meanwhile.
+            with self._available:
+                idle = self._idle.get(key, ())
+                entries = [entry for entry in idle if entry[0] is conn]
+                if not entries:
+                    # Checked out (or expired) meanwhile.
+                    continue
+                since = entries[0][1]
+                idle.remove(entries[0])
+            if not self.check_connection(conn):
+                self._discard(conn)
+                continue
+            with self._available:
+                idle = self._idle.setdefault(key, deque())
+                # Put back in check-in order (least recently used first).
+                position = len([entry for entry in idle if entry[1] <= since])
+                idle.rotate(-position)
+                idle.appendleft((conn, since))
+                idle.rotate(position)
+                self._available.notify()
+            if conn.send_heartbeat:
+                next_beat = max(conn._last_sent + conn.send_heartbeat - time.time(), 0)
+                wait = min(wait, next_beat) if wait is not None else next_beat
+        return wait
+    
+    def close(self, host=None, port=None, frame=None):
+        """
+        Closes the idle connections (to the specified host:port, or all of them), sending a
+        frame (e.g. DISCONNECT) on each one first, and forgets the CONNECT frame.  
+        Connections that are in use are not affected.
+        
+        :param frame: (optional) The frame to send before closing each connection.
+        :type frame: :class:`stompclient.frame.Frame`
+        """
+        with self._available:
+            if host is None:
+                keys = set(self.connections) | set(self._idle) | set(self._connect_frames)
+            else:
+                keys = [self.make_connection_key(host, port)]
+            closing = []
+            for key in keys:
+                self._connect_frames.pop(key, None)
+                idle = self._idle.pop(key, None) or []
+                for (conn, _) in idle:
+                    self._remove(conn)
+                    closing.append(conn)
+                if not self.connections.get(key, True):
+                    del self.connections[key]
+            self._available.notify_all()
+        for conn in closing:
+            if frame is not None and conn.connected:
+                try:
+                    conn.send(frame)
+                except ConnectionError:
+                    pass
+            self._close(conn)
+    
+    def _remove(self, connection):
+        """
+        Removes a connection from the pool.  Must be called with the lock held.
+        """
+        key = self._keys.pop(connection)
+        self.connections[key].remove(connection)
+    
+    def _discard(self, connection):
+        """
+        Removes a connection from the pool and closes it.
+        """
+        with self._available:
+            self._remove(connection)
+            self._available.notify()
+        self._close(connection)
+    
+    def _close(self, connection):
+        try:
+            connection.disconnect()
+        except NotConnectedError:
+            pass
+
 class Connection(object):
     """
     Manages TCP connection to the STOMP server and provides an abstracted interface for sending
@@ -87,17 +473,115 @@ class Connection(object):
     
     :ivar socket_timeout: Socket timeout (in seconds).
     :type socket_timeout: float
+    
+    :ivar buffer_options: Keyword arguments for the :class:`stompclient.util.FrameBuffer` 
+                            used to parse received frames (e.g. `lazy_headers` or size limits
+                            such as `max_body_size`).
+    :type buffer_options: dict
+    
+    :ivar escape_headers: Whether header keys and values are escaped as specified by STOMP 1.1 
+                            (both in sent frames and in received frames).  Only enable this for
+                            brokers that speak STOMP 1.1 or later; STOMP 1.0 brokers would take
+                            the escape sequences literally.
+    :type escape_headers: bool
+    
+    :ivar flush_bytes: In buffered-write mode, the number of pending bytes at which frames are 
+                        written to the socket.
+    :type flush_bytes: int
+    
+    :ivar flush_frames: In buffered-write mode, the number of pending frames at which frames are
+                        written to the socket.
+    :type flush_frames: int
+    
+    :ivar flush_interval: In buffered-write mode, the maximum time (in seconds) that a frame is 
+                            held back before being written to the socket (`None` to only write 
+                            frames when a threshold is reached or :meth:`flush` is called).
+    :type flush_interval: float
+    
+    :ivar send_heartbeat: The negotiated interval (in seconds) at which heart-beats are sent 
+                            to the server while no frames are sent (0 if not heart-beating).
+    :type send_heartbeat: float
+    
+    :ivar receive_heartbeat: The negotiated interval (in seconds) at which the server sends 
+                            heart-beats while idle (0 if not heart-beating).
+    :type receive_heartbeat: float
+    
+    :ivar nonblocking: Whether the socket is in non-blocking mode (see :meth:`set_nonblocking`).
+    :type nonblocking: bool
     """
-    def __init__(self, host, port=61613, socket_timeout=None):
+    
+    # Frames with a body of at least this many bytes (as sent) are written in parts (header 
+    # block, body, terminator) instead of being packed into a single string first, which would
+    # copy the body.  Smaller frames are cheaper to send with a single write.
+    gather_threshold = 65536
+    
+    # Bounds for the size of socket reads.  The read size adapts to the amount of data
+    # received: it doubles while reads fill the receive buffer and halves when they use
+    # less than a quarter of it, and it is raised to the number of bytes still missing 
+    # from a partially received frame.
+    min_read_size = 8192
+    max_read_size = 262144
+    
+    # The maximum number of bytes read from the socket in one go (while more data is
+    # immediately available) before the received frames are parsed.
+    max_drain_bytes = 1048576
+    
+    # The connection is considered dead if nothing has been received from the server for
+    # this multiple of the negotiated receive heart-beat interval.
+    heartbeat_tolerance = 2.0
+    
+    def __init__(self, host, port=61613, socket_timeout=None, buffer_options=None, escape_headers=False,
+                 flush_bytes=None, flush_frames=None, flush_interval=None):
+        """
+        Frames are written to the socket as they are sent, unless one of `flush_bytes`, 
+        `flush_frames` or `flush_interval` is specified.  In that (buffered-write) mode, sent
+        frames are collected and written with a single `sendall` call once one of the 
+        specified thresholds is reached, the flush interval has passed, or :meth:`flush` is 
+        called.  Frames that request a receipt, as well as CONNECT and DISCONNECT frames, 
+        are always written immediately (along with any frames pending before them).
+        """
         self.host = host
         self.port = port
         self.socket_timeout = socket_timeout
+        self.buffer_options = buffer_options if buffer_options else {}
+        self.escape_headers = escape_headers
         self._sock = None
-        self._buffer = FrameBuffer()
+        options = dict(self.buffer_options)
+        options.setdefault('unescape_headers', escape_headers)
+        self._buffer = FrameBuffer(**options)
+        self.flush_bytes = flush_bytes
+        self.flush_frames = flush_frames
+        self.flush_interval = flush_interval
+        self._buffered_writes = not (flush_bytes is None and flush_frames is None and flush_interval is None)
+        self.log = logging.getLogger('%s.%s' % (self.__module__, self.__class__.__name__))
         self._connected = threading.Event()
         self._connect_lock = threading.RLock()
         self._send_lock = threading.RLock()
         self._read_lock = threading.RLock()
+        # Packed frames waiting to be written (in buffered-write mode), their total size and 
+        # the time at which the first of them was sent.
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_since = None
+        # Signalled (with the send lock held) when frames become pending or the connection
+        # is closed; the flusher thread waits on it to enforce the flush interval.
+        self._flush_cond = threading.Condition(self._send_lock)
+        self._flusher = None
+        # The reusable receive buffer (and a view of it) and the current read size.
+        self._recv_buffer = bytearray(self.min_read_size)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._read_size = self.min_read_size
+        # Heart-beating: the intervals requested in the CONNECT frame (until the CONNECTED
+        # frame has been received), the negotiated intervals and the times of the last
+        # write to and read from the socket.
+        self._requested_heartbeat = None
+        self.send_heartbeat = 0.0
+        self.receive_heartbeat = 0.0
+        self._last_sent = 0.0
+        self._last_received = 0.0
+        # The data that a non-blocking socket could not accept yet.
+        self.nonblocking = False
+        self._unsent = bytearray()
         
     @property
     def connected(self):
@@ -122,16 +606,27 @@ class Connection(object):
                 raise ConnectionError(*exc.args)
             
             sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
-            sock.settimeout(self.socket_timeout)
+            if self.nonblocking:
+                sock.setblocking(False)
+            else:
+                sock.settimeout(self.socket_timeout)
             self._sock = sock
+            self._last_sent = self._last_received = time.time()
             self._connected.set()
         
     def disconnect(self, conf=None):
         """
         Disconnect from the server, if connected.
 
+        Any frames pending in buffered-write mode are written first (if possible).
+
         :raises NotConnectedError: If the connection is not currently connected. 
         """
+        if self._pending or self._unsent:
+            try:
+                self.flush()
+            except ConnectionError:
+                pass
         with self._connect_lock:
             if self._sock is None:
                 raise NotConnectedError()
@@ -141,7 +636,13 @@ class Connection(object):
                 pass
             self._sock = None
             self._buffer.clear()
+            del self._unsent[:]
+            self._requested_heartbeat = None
+            self.send_heartbeat = self.receive_heartbeat = 0.0
             self._connected.clear()
+        if self._flusher is not None:
+            with self._flush_cond:
+                self._flush_cond.notify()
     
     def send(self, frame):
         """
@@ -152,13 +653,332 @@ class Connection(object):
         """
         with self._send_lock:
             self.connect()
+            if isinstance(frame, Frame) and frame.command == CONNECT:
+                self._request_heartbeat(frame)
+            try:
+                if self._buffered_writes:
+                    self._buffer_frame(frame)
+                elif isinstance(frame, Frame):
+                    self._write_frame(frame)
+                else:
+                    self._sendall(str(frame))
+                    self._last_sent = time.time()
+            except socket.error, e:
+                if e.args[0] == errno.EPIPE:
+                    self.disconnect()
+                raise ConnectionError("Error %s while writing to socket. %s." % e.args)
+    
+    def flush(self):
+        """
+        Writes any frames pending in buffered-write mode to the socket.
+        
+        In non-blocking mode, this also waits until the socket has accepted all unsent data
+        (for at most the socket timeout).
+        """
+        with self._send_lock:
+            if not (self._pending or self._unsent) or self._sock is None:
+                return
             try:
-                self._sock.sendall(str(frame))
+                if self._pending:
+                    self._flush_pending()
+                if self._unsent:
+                    # Written in blocking mode, and the socket is made non-blocking again.
+                    self._sock.settimeout(self.socket_timeout)
+                    try:
+                        self._sock.sendall(self._unsent)
+                        del self._unsent[:]
+                    finally:
+                        if self.nonblocking and self._sock is not None:
+                            self._sock.setblocking(False)
             except socket.error, e:
                 if e.args[0] == errno.EPIPE:
                     self.disconnect()
                 raise ConnectionError("Error %s while writing to socket. %s." % e.args)
+    
+    def _buffer_frame(self, frame):
+        """
+        Adds a frame to the pending frames (in buffered-write mode), writing the pending
+        frames if a threshold has been reached or the frame must not be delayed.
+        
+        Must be called with the send lock held.
+        """
+        if isinstance(frame, Frame):
+            if _body_length(frame.body) >= self.gather_threshold:
+                # Not worth copying into the pending data.
+                if self._pending:
+                    self._flush_pending()
+                self._write_frame(frame)
+                return
+            data = frame.pack(escape=self.escape_headers)
+            urgent = 'receipt' in frame.headers or frame.command in (CONNECT, DISCONNECT)
+        else:
+            data = str(frame)
+            urgent = False
+        
+        pending = self._pending
+        pending.append(data)
+        self._pending_bytes += len(data)
+        if (urgent 
+            or (self.flush_bytes is not None and self._pending_bytes >= self.flush_bytes)
+            or (self.flush_frames is not None and len(pending) >= self.flush_frames)):
+            self._flush_pending()
+        elif len(pending) == 1 and self.flush_interval is not None:
+            self._pending_since = time.time()
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, 
+                                                 name='StompFlusher-%s:%s' % (self.host, self.port))
+                self._flusher.daemon = True
+                self._flusher.start()
+            else:
+                self._flush_cond.notify()
+    
+    def _flush_pending(self):
+        """
+        Writes the pending frames to the socket with a single call.
+        
+        The pending frames are discarded even if the write fails, since it is not known how
+        much of the data has been written.  Must be called with the send lock held.
+        """
+        data = ''.join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_since = None
+        self._sendall(data)
+        self._last_sent = time.time()
+    
+    def _flush_periodically(self):
+        """
+        Writes pending frames once they have been pending for `flush_interval` seconds (run
+        in a daemon thread until the connection is closed).
+        """
+        cond = self._flush_cond
+        with cond:
+            try:
+                while self._sock is not None:
+                    if not self._pending:
+                        cond.wait()
+                        continue
+                    remaining = self._pending_since + self.flush_interval - time.time()
+                    if remaining > 0:
+                        cond.wait(remaining)
+                    else:
+                        try:
+                            self._flush_pending()
+                        except socket.error:
+                            self.log.exception("Error writing pending frames to socket.")
+            finally:
+                self._flusher = None
 
+    def _write_frame(self, frame):
+        """
+        Writes a frame to the socket.
+        
+        Frames with large bodies are written as separate parts (see 
+        :meth:`stompclient.frame.Frame.pack_buffers`) so that the body is passed to the socket
+        as-is rather than copied into the packed frame.  (Python 2 sockets do not provide 
+        `sendmsg`, so the parts are written with one `sendall` call each.)
+        
+        :param frame: The frame to send.
+        :type frame: :class:`stompclient.frame.Frame`
+        """
+        # The byte length (as sent), which differs from len() for e.g. unicode bodies or
+        # memoryviews with multi-byte items.
+        if _body_length(frame.body) < self.gather_threshold:
+            self._sendall(frame.pack(escape=self.escape_headers))
+        else:
+            for part in frame.pack_buffers(escape=self.escape_headers):
+                self._sendall(part)
+        self._last_sent = time.time()
+    
+    def _sendall(self, data):
+        """
+        Writes data to the socket.  In non-blocking mode, the data that the socket does not
+        accept right away is kept (after any data already waiting) for :meth:`write_available`.
+        
+        Must be called with the send lock held.
+        """
+        if not self.nonblocking:
+            if self._unsent:
+                # Left over from non-blocking mode.
+                self._sock.sendall(self._unsent)
+                del self._unsent[:]
+            self._sock.sendall(data)
+            return
+        if not self._unsent:
+            try:
+                sent = self._sock.send(data)
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                sent = 0
+            if sent == len(data):
+                return
+            data = memoryview(data)[sent:]
+        self._unsent += data
+    
+    @property
+    def unsent_bytes(self):
+        """
+        The number of bytes that a non-blocking socket has not accepted yet.
+        """
+        return len(self._unsent)
+    
+    def set_nonblocking(self, nonblocking):
+        """
+        Switches the socket to (or from) non-blocking mode, for event loops such as the
+        :class:`stompclient.reactor.Reactor`.
+        
+        In non-blocking mode, sending never waits for the socket: the data that it cannot
+        accept is kept in memory (see :attr:`unsent_bytes`) until the event loop calls 
+        :meth:`write_available` once the socket is writable.  Leaving non-blocking mode 
+        restores the socket timeout; any unsent data is then written before the next frame.
+        
+        :param nonblocking: Whether the socket should be non-blocking.
+        :type nonblocking: bool
+        """
+        with self._send_lock:
+            self.nonblocking = nonblocking
+            if self._sock is not None:
+                if nonblocking:
+                    self._sock.setblocking(False)
+                else:
+                    self._sock.settimeout(self.socket_timeout)
+    
+    def write_available(self):
+        """
+        Writes as much of the unsent data as the socket accepts without blocking.
+        
+        This is intended for event loops, which call it once the socket has been reported
+        writable (see :meth:`set_nonblocking`).
+        
+        :return: The number of bytes still unsent.
+        :rtype: int
+        
+        :raise stompclient.exceptions.ConnectionError: If writing to the socket failed.
+        """
+        with self._send_lock:
+            unsent = self._unsent
+            if not unsent:
+                return 0
+            if self._sock is None:
+                raise NotConnectedError()
+            try:
+                sent = self._sock.send(unsent)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return len(unsent)
+                if e.args[0] == errno.EPIPE:
+                    self.disconnect()
+                raise ConnectionError("Error %s while writing to socket. %s." % e.args)
+            del unsent[:sent]
+            return len(unsent)
+    
+    def _request_heartbeat(self, frame):
+        """
+        Records the heart-beat intervals requested by a CONNECT frame, so that they can be
+        negotiated when the CONNECTED frame is received.  Heart-beating stops until then.
+        """
+        self.send_heartbeat = self.receive_heartbeat = 0.0
+        value = frame.get_header('heart-beat')
+        self._requested_heartbeat = parse_heart_beat(value) if value is not None else None
+    
+    def _negotiate_heartbeat(self, frames):
+        """
+        Sets the heart-beat intervals from the CONNECTED frame among received frames (if any),
+        as specified by STOMP 1.1: each side beats at the larger of the interval it offered and
+        the interval the other side wants, and not at all if either of them is 0.
+        """
+        for frame in frames:
+            if frame.command != CONNECTED:
+                continue
+            (cx, cy) = self._requested_heartbeat
+            self._requested_heartbeat = None
+            try:
+                (sx, sy) = parse_heart_beat(frame.get_header('heart-beat'))
+            except FrameError, e:
+                self.log.warning("Not heart-beating: %s" % e)
+                return
+            self.send_heartbeat = max(cx, sy) / 1000.0 if cx and sy else 0.0
+            self.receive_heartbeat = max(cy, sx) / 1000.0 if cy and sx else 0.0
+            self._last_sent = self._last_received = time.time()
+            if self.send_heartbeat or self.receive_heartbeat:
+                self.log.debug("Heart-beating (send every %.3fs, receive every %.3fs)" 
+                               % (self.send_heartbeat, self.receive_heartbeat))
+            return
+    
+    def heartbeat(self):
+        """
+        Sends a heart-beat if nothing has been sent for the negotiated send interval, and
+        checks that something has been received from the server recently enough.
+        
+        This is called by :meth:`read_many` while it waits for frames, and by the
+        :class:`stompclient.reactor.Reactor` for its connections, so a connection that is being
+        read needs no timer thread.  Publish-only clients that heart-beat (see 
+        :meth:`read_connected`) should call this periodically (at the returned interval) while 
+        idle.
+        
+        :return: The time (in seconds) until this method should next be called, or `None`
+                    if heart-beating has not been negotiated.
+        :rtype: float
+        
+        :raise stompclient.exceptions.ConnectionError: If nothing has been received from the
+                    server for `heartbeat_tolerance` times the receive interval (the connection
+                    is disconnected), or the heart-beat cannot be written.
+        """
+        if not (self.send_heartbeat or self.receive_heartbeat):
+            return None
+        now = time.time()
+        wait = None
+        if self.receive_heartbeat:
+            deadline = self._last_received + self.receive_heartbeat * self.heartbeat_tolerance
+            if now > deadline:
+                try:
+                    self.disconnect()
+                except NotConnectedError:
+                    pass
+                raise ConnectionError("No data received from server for %.1f seconds." % (now - self._last_received))
+            wait = deadline - now
+        if self.send_heartbeat:
+            next_beat = self._last_sent + self.send_heartbeat
+            if now >= next_beat:
+                with self._send_lock:
+                    if self._sock is None:
+                        raise NotConnectedError()
+                    try:
+                        if self._pending:
+                            self._flush_pending()
+                        else:
+                            self._sendall('\n')
+                            self._last_sent = now
+                    except socket.error, e:
+                        if e.args[0] == errno.EPIPE:
+                            self.disconnect()
+                        raise ConnectionError("Error %s while writing to socket. %s." % e.args)
+                next_beat = now + self.send_heartbeat
+            wait = min(wait, next_beat - now) if wait is not None else next_beat - now
+        return wait
+    
+    def _wait_readable(self):
+        """
+        Waits (sending heart-beats and checking the server's) until the socket is readable or
+        the socket timeout has passed.  Must be called with the read lock held.
+        
+        :return: Whether the socket is readable.
+        :rtype: bool
+        """
+        timeout_at = time.time() + self.socket_timeout if self.socket_timeout is not None else None
+        while True:
+            wait = self.heartbeat()
+            if wait is None:
+                return True
+            if timeout_at is not None:
+                remaining = timeout_at - time.time()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            if _poll_readable(self._sock, max(wait, 0)):
+                return True
+    
     def read(self):
         """
         Blocking call to read and return a frame from underlying socket.
@@ -168,29 +988,456 @@ class Connection(object):
         
         :return: A frame read from socket or buffered from previous socket read.
         :rtype: :class:`stompclient.frame.Frame`
+        
+        :raise stompclient.exceptions.FrameSizeError: If a received frame exceeds the size limits
+                    configured for the buffer (see `buffer_options`).
+        """
+        frames = self.read_many(1)
+        if frames:
+            return frames[0]
+        else:
+            return None
+    
+    def read_many(self, max_n=None):
+        """
+        Blocking call to read and return all complete frames available from underlying socket.
+        
+        If there are already complete frames in the buffer they are returned without reading 
+        from the socket; otherwise this blocks until at least one frame has been received (or
+        the socket times out).  All complete frames are extracted from the buffer in one go,
+        which is considerably cheaper than calling :meth:`read` for each one when the server 
+        sends frames in bursts.
+        
+        :param max_n: The maximum number of frames to return (`None` for no limit).
+        :type max_n: int
+        
+        :return: The frames read from socket or buffered from previous socket read (empty
+                    list if the socket timed out).
+        :rtype: `list` of :class:`stompclient.frame.Frame`
+        
+        :raise stompclient.exceptions.FrameSizeError: If a received frame exceeds the size limits
+                    configured for the buffer (see `buffer_options`).  The frame is discarded, so
+                    reading may continue.
+        :raise stompclient.exceptions.ConnectionError: If reading fails, the server has closed the
+                    connection or, when heart-beating, the server has stopped sending data (see
+                    :meth:`heartbeat`).
+        
+        While heart-beating has been negotiated (by sending a CONNECT frame with a 'heart-beat'
+        header), heart-beats are sent and the server's are checked while waiting for data.
         """
         with self._read_lock:
             self.connect()
             
-            buffered_frame = self._buffer.extract_frame()
+            buffered_frames = self._buffer.extract_frames(max_n)
             
-            if buffered_frame:
-                return buffered_frame
+            if buffered_frames:
+                if self._requested_heartbeat is not None:
+                    self._negotiate_heartbeat(buffered_frames)
+                return buffered_frames
             else:
                 # Read bytes from socket until we have read a frame (or timeout out) and then return it.
-                received_frame = None
+                received_frames = []
                 try:
                     while self._connected.is_set():
-                        bytes = self._sock.recv(8192)
-                        self._buffer.append(bytes)
-                        received_frame = self._buffer.extract_frame()
-                        if received_frame:
+                        if (self.send_heartbeat or self.receive_heartbeat) and not self._wait_readable():
+                            break
+                        if self._receive() == 0:
+                            self.disconnect()
+                            raise ConnectionError("Connection closed by server.")
+                        received_frames = self._buffer.extract_frames(max_n)
+                        if received_frames:
+                            if self._requested_heartbeat is not None:
+                                self._negotiate_heartbeat(received_frames)
                             break
                 except socket.timeout:
                     pass
+                except ConnectionError:
+                    raise
                 except socket.error, e:
                     if e.args[0] == errno.EPIPE:
                         self.disconnect()
                     raise ConnectionError("Error %s while reading from socket. %s." % e.args)
                 
-                return received_frame
\ No newline at end of file
+                return received_frames
+    
+    def read_connected(self):
+        """
+        Reads frames until the CONNECTED frame that answers a CONNECT frame has been received,
+        negotiating heart-beats from it (see :meth:`read_many`).
+        
+        Clients that do not otherwise read from the connection (i.e. publish-only clients) 
+        call this after sending a CONNECT frame that requests heart-beats, since heart-beating
+        only starts once the CONNECTED frame has been received.
+        
+        :return: The CONNECTED frame.
+        :rtype: :class:`stompclient.frame.Frame`
+        
+        :raise stompclient.exceptions.FrameError: If the server responded with an ERROR frame.
+        :raise stompclient.exceptions.ConnectionTimeoutError: If no frame was received within 
+                    the socket timeout.
+        """
+        with self._read_lock:
+            while True:
+                frames = self.read_many(1)
+                if not frames:
+                    raise ConnectionTimeoutError("No CONNECTED frame received from server.")
+                frame = frames[0]
+                if frame.command == CONNECTED:
+                    return frame
+                elif frame.command == ERROR:
+                    raise FrameError("Server refused connection: %s" % frame.get_header('message'))
+                self.log.debug("Ignoring frame received before CONNECTED: %s" % frame)
+    
+    def fileno(self):
+        """
+        Returns the file descriptor of the socket (connecting first, if necessary), so that
+        the connection can be watched by `select` or `poll` (see :class:`stompclient.reactor.Reactor`).
+        
+        The descriptor changes if the connection is closed and re-opened.
+        
+        :rtype: int
+        """
+        self.connect()
+        return self._sock.fileno()
+    
+    def read_available(self):
+        """
+        Reads the data that is available from the socket and returns the complete frames.
+        
+        This is intended for event loops, which call it once the socket has been reported
+        readable (so that it does not block); unlike :meth:`read_many` it returns an empty list
+        rather than waiting if no complete frame has been received yet.
+        
+        :return: The complete frames received (or buffered from previous reads).
+        :rtype: `list` of :class:`stompclient.frame.Frame`
+        
+        :raise stompclient.exceptions.ConnectionError: If the server closed the connection (the
+                    connection is disconnected) or reading from the socket failed.
+        :raise stompclient.exceptions.FrameSizeError: If a received frame exceeds the size limits
+                    configured for the buffer (see :meth:`read_many`).
+        """
+        with self._read_lock:
+            if self._sock is None:
+                raise NotConnectedError()
+            try:
+                received = self._receive()
+            except socket.timeout:
+                received = None
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # A non-blocking socket that was reported readable spuriously.
+                    received = None
+                else:
+                    if e.args[0] == errno.EPIPE:
+                        self.disconnect()
+                    raise ConnectionError("Error %s while reading from socket. %s." % e.args)
+            if received == 0:
+                self.disconnect()
+                raise ConnectionError("Connection closed by server.")
+            frames = self._buffer.extract_frames()
+            if frames and self._requested_heartbeat is not None:
+                self._negotiate_heartbeat(frames)
+            return frames
+    
+    def _receive(self):
+        """
+        Reads the data available from the socket into the frame buffer, blocking until at 
+        least some data has been received (or the socket times out).
+        
+        Data is read into a reusable buffer with `recv_into`, so reading does not allocate a 
+        new string for every call.  While reads fill the buffer completely and the socket 
+        remains readable (checked with a zero-timeout `poll`), reading continues (up to 
+        `max_drain_bytes`), so that everything the kernel has ready is parsed in one go.
+        
+        Must be called with the read lock held.
+        
+        :return: The number of bytes received (0 if the server closed the connection).
+        :rtype: int
+        """
+        sock = self._sock
+        buf = self._buffer
+        received = 0
+        while True:
+            size = max(self._read_size, min(buf.bytes_needed(), self.max_read_size))
+            if size > len(self._recv_buffer):
+                self._recv_buffer = bytearray(size)
+                self._recv_view = memoryview(self._recv_buffer)
+            n = sock.recv_into(self._recv_buffer, size)
+            if n:
+                buf.append(self._recv_view[:n])
+                received += n
+                self._last_received = time.time()
+            
+            # Adapt the read size to the amount of data that was available.
+            if n == size:
+                self._read_size = min(size * 2, self.max_read_size)
+            elif n < size // 4:
+                self._read_size = max(self._read_size // 2, self.min_read_size)
+            
+            if n < size or received >= self.max_drain_bytes or not self._readable(sock):
+                return received
+    
+    def _readable(self, sock):
+        """
+        Returns whether data can be read from the socket without blocking.
+        
+        :rtype: bool
+        """
+        return _poll_readable(sock)
+
+class ReconnectingConnection(Connection):
+    """
+    A connection that fails over between brokers and re-establishes the STOMP session when
+    the connection is lost.
+    
+    The connection remembers the last CONNECT frame and the active subscriptions (the
+    SUBSCRIBE frames sent and not yet unsubscribed, including their ack modes and other
+    headers).  When sending or reading fails, it reconnects -- trying the brokers in turn and
+    waiting with jittered exponential backoff once all of them have failed -- and then writes
+    the CONNECT frame and all SUBSCRIBE frames to the new socket in a single write, before 
+    the failed frame (if any) is sent again.  Reads that fail return no frames after 
+    reconnecting, so a listening loop simply carries on.  The CONNECTED frame that answers the
+    replayed CONNECT frame is not returned by the reads (the client did not send that CONNECT).
+    
+    Sending a DISCONNECT frame ends the session: nothing is replayed afterwards.
+    
+    Connection pools create reconnecting connections if configured accordingly::
+    
+        pool = ConnectionPool(ReconnectingConnection, failover=[('broker2', 61613)])
+        client = PublishSubscribeClient('broker1', connection_pool=pool)
+    
+    Frames may be lost or delivered twice around a reconnect (e.g. a frame written to a 
+    socket just before it fails); use receipts or transactions where this matters.
+    
+    :ivar brokers: The (host, port) addresses of the brokers, in the order they are tried.
+    :type brokers: `list` of `tuple`
+    
+    :ivar initial_delay: The maximum delay (in seconds) after the first failure to connect 
+                            to any of the brokers.
+    :type initial_delay: float
+    
+    :ivar max_delay: The maximum delay (in seconds) between attempts.
+    :type max_delay: float
+    
+    :ivar max_attempts: The number of failed connection attempts after which 
+                            :class:`stompclient.exceptions.ConnectionError` is raised (`None` 
+                            to keep trying).
+    :type max_attempts: int
+    """
+    
+    def __init__(self, host, port=61613, socket_timeout=None, failover=None, initial_delay=0.1, 
+                 max_delay=30.0, max_attempts=None, **kwargs):
+        """
+        :param failover: (optional) The (host, port) addresses of further brokers to fail over to.
+        :type failover: `list` of `tuple`
+        
+        The remaining keyword arguments are passed to :class:`Connection`.
+        """
+        super(ReconnectingConnection, self).__init__(host, port, socket_timeout, **kwargs)
+        self.brokers = [(host, port)] + list(failover or [])
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self._broker_index = 0
+        # The frames replayed after reconnecting.
+        self._connect_frame = None
+        self._subscriptions = OrderedDict()
+        # Whether a CONNECTED frame for the session has been returned to the caller, and 
+        # whether the server's answer to the replayed CONNECT frame is still to be received
+        # (it is only left out if the caller has already received a CONNECTED frame).
+        self._session_established = False
+        self._replay_pending = False
+    
+    def backoff_delay(self, attempt):
+        """
+        Returns the delay (in seconds) before the specified attempt to connect to the brokers 
+        again: the delay doubles with every attempt (up to `max_delay`) and is randomized by 
+        up to half, so that clients do not reconnect in lockstep after a broker restart.
+        
+        :param attempt: The number of times all brokers have failed (starting at 1).
+        :type attempt: int
+        
+        :rtype: float
+        """
+        delay = min(self.max_delay, self.initial_delay * (2 ** (attempt - 1)))
+        return random.uniform(delay / 2, delay)
+    
+    def connect(self):
+        """
+        Connects to the first broker that accepts the connection (starting with the broker 
+        that was last connected to), replaying the session if it was lost.
+        
+        :raise stompclient.exceptions.ConnectionError: If `max_attempts` attempts failed.
+        """
+        # The send lock is held so that no other frames are written before the session 
+        # has been replayed (it is acquired before the connect lock, as in send()).
+        with self._send_lock, self._connect_lock:
+            if self._sock:
+                return
+            attempts = 0
+            while True:
+                (self.host, self.port) = self.brokers[self._broker_index]
+                try:
+                    super(ReconnectingConnection, self).connect()
+                    self._replay()
+                    return
+                except socket.error, e:
+                    # (ConnectionError and ConnectionTimeoutError are socket errors too.)
+                    if self._sock is not None:
+                        self._close()
+                    attempts += 1
+                    self.log.warning("Unable to connect to %s:%s: %s" % (self.host, self.port, e))
+                    if self.max_attempts is not None and attempts >= self.max_attempts:
+                        if isinstance(e, ConnectionError):
+                            raise
+                        raise ConnectionError(*e.args)
+                    self._broker_index = (self._broker_index + 1) % len(self.brokers)
+                    if attempts % len(self.brokers) == 0:
+                        time.sleep(self.backoff_delay(attempts // len(self.brokers)))
+    
+    def _replay(self):
+        """
+        Writes the CONNECT frame and the SUBSCRIBE frames of the session (if any) to a new 
+        socket in a single write.  Must be called with the send and connect locks held.
+        """
+        self._replay_pending = False
+        if self._connect_frame is None:
+            return
+        frames = [self._connect_frame] + self._subscriptions.values()
+        data = ''.join([f.pack(escape=self.escape_headers) for f in frames])
+        self._request_heartbeat(self._connect_frame)
+        self._sendall(data)
+        self._last_sent = time.time()
+        # Otherwise the caller is still waiting for the answer to its own CONNECT frame.
+        self._replay_pending = self._session_established
+        self.log.info("Reconnected to %s:%s (resubscribed to %d destinations)" 
+                      % (self.host, self.port, len(self._subscriptions)))
+    
+    def _close(self):
+        """
+        Closes a failed socket, keeping the session so that it is replayed on reconnecting.
+        """
+        try:
+            self.disconnect()
+        except NotConnectedError:
+            pass
+    
+    def _record(self, frame):
+        """
+        Records the frames that make up the session (once they have been sent).
+        
+        :return: Whether the frame is replayed when reconnecting.
+        :rtype: bool
+        """
+        command = frame.command
+        if command == CONNECT:
+            self._connect_frame = frame
+            return True
+        elif command == SUBSCRIBE:
+            self._subscriptions[frame.get_header('id') or frame.destination] = frame
+            return True
+        elif command == UNSUBSCRIBE:
+            # Subscriptions may be ended by id or by destination, whichever was subscribed with.
+            sub_id = frame.get_header('id')
+            destination = frame.get_header('destination')
+            for (key, subscribe) in self._subscriptions.items():
+                if ((sub_id is not None and subscribe.get_header('id') == sub_id) 
+                        or (destination is not None and subscribe.get_header('destination') == destination)):
+                    del self._subscriptions[key]
+        elif command == DISCONNECT:
+            self._connect_frame = None
+            self._subscriptions.clear()
+            self._session_established = False
+        return False
+    
+    def send(self, frame):
+        """
+        Sends the specified frame to STOMP server, reconnecting (and sending the frame again,
+        unless it was replayed with the session) if this fails.
+        
+        :param frame: The frame to send to server.
+        :type frame: stompclient.frame.Frame
+        """
+        if not isinstance(frame, Frame):
+            return super(ReconnectingConnection, self).send(frame)
+        if frame.command == CONNECT:
+            # A new session (not to be replayed if connecting fails).
+            self._connect_frame = None
+            self._subscriptions.clear()
+            self._session_established = False
+        try:
+            super(ReconnectingConnection, self).send(frame)
+        except ConnectionError, e:
+            replayed = self._record(frame)
+            if frame.command == DISCONNECT:
+                raise
+            self.log.warning("Error sending frame (%s); reconnecting." % e)
+            self._close()
+            self.connect()
+            if not replayed:
+                super(ReconnectingConnection, self).send(frame)
+        else:
+            self._record(frame)
+    
+    def read_many(self, max_n=None):
+        """
+        Reads the available frames (see :meth:`Connection.read_many`), reconnecting if the 
+        connection has failed.
+        
+        :return: The frames read (empty after reconnecting).
+        :rtype: `list` of :class:`stompclient.frame.Frame`
+        """
+        while True:
+            try:
+                frames = super(ReconnectingConnection, self).read_many(max_n)
+            except ConnectionError, e:
+                if self._connect_frame is None:
+                    raise
+                self.log.warning("Error reading frames (%s); reconnecting." % e)
+                self._close()
+                self.connect()
+                return []
+            if not frames:
+                return frames
+            frames = self._filter_received(frames)
+            if frames:
+                return frames
+            # Only the replay's CONNECTED frame was read (an empty list would mean a timeout).
+    
+    def read_available(self):
+        """
+        Reads the available frames (see :meth:`Connection.read_available`), leaving out the
+        CONNECTED frame that answers a replayed session.
+        
+        :rtype: `list` of :class:`stompclient.frame.Frame`
+        """
+        frames = super(ReconnectingConnection, self).read_available()
+        if frames:
+            frames = self._filter_received(frames)
+        return frames
+    
+    def _filter_received(self, frames):
+        """
+        Removes the CONNECTED frame that answers a replayed CONNECT frame from received frames
+        (heart-beats have already been negotiated from it), if the caller has already received 
+        the CONNECTED frame of the session.  An ERROR frame answering the replay is returned,
+        since the session could not be re-established.
+        
+        :rtype: `list` of :class:`stompclient.frame.Frame`
+        """
+        if self._replay_pending:
+            for (i, frame) in enumerate(frames):
+                if frame.command == CONNECTED:
+                    self._replay_pending = False
+                    self.log.debug("Session re-established: %s" % frame)
+                    frames = frames[:i] + frames[i + 1:]
+                    break
+                elif frame.command == ERROR:
+                    self._replay_pending = False
+                    break
+        elif not self._session_established:
+            for frame in frames:
+                if frame.command == CONNECTED:
+                    self._session_established = True
+                    break
+        return frames
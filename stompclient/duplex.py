@@ -2,6 +2,7 @@
 Clients that support both sending and receiving messages (produce & consume).
 """
 import abc
+import logging
 import threading
 import warnings
 from copy import copy
@@ -9,7 +10,8 @@ from Queue import Queue, Empty
 
 from stompclient import frame
 from stompclient.simplex import BaseClient
-from stompclient.exceptions import NotConnectedError
+from stompclient.connection import BoundedConnectionPool
+from stompclient.exceptions import NotConnectedError, FrameError, FrameSizeError
 
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
 __copyright__ = "Copyright 2010 Hans Lellelid"
@@ -49,17 +51,25 @@ class BaseBlockingDuplexClient(BaseClient):
     
     :ivar subscription_lock: A `threading.RLock` used to guard access to `subscribed_destionations` property.
     :type subscription_lock: threading.RLock
+    
+    :ivar reactor: The reactor that receives this client's frames instead of its listening loop
+                    (set by :meth:`stompclient.reactor.Reactor.register`), if any.
+    :type reactor: :class:`stompclient.reactor.Reactor`
     """
     __metaclass__ = abc.ABCMeta
     
     debug = False
     
-    def __init__(self, host, port=61613, socket_timeout=3.0, connection_pool=None):
-        super(BaseBlockingDuplexClient, self).__init__(host, port=port, socket_timeout=socket_timeout, connection_pool=connection_pool)
+    def __init__(self, host, port=61613, socket_timeout=3.0, connection_pool=None, compression=None, 
+                 codecs=None, frame_pool=None):
+        super(BaseBlockingDuplexClient, self).__init__(host, port=port, socket_timeout=socket_timeout, 
+                                                       connection_pool=connection_pool, compression=compression,
+                                                       codecs=codecs, frame_pool=frame_pool)
         self.shutdown_event = threading.Event()
         self.listening_event = threading.Event()
         self.subscription_lock = threading.RLock()
         self.subscribed_destinations = {}
+        self.reactor = None
         
     @abc.abstractmethod
     def dispatch_frame(self, frame):
@@ -76,21 +86,58 @@ class BaseBlockingDuplexClient(BaseClient):
         
         This would typically be started within its own thread, since it will
         block until error or shutdown_event is set.
+        
+        All of the frames received in one read from the connection are dispatched as
+        a batch before the shutdown_event is checked again.  Received frames that exceed 
+        the connection's size limits are logged and skipped.
+        
+        If the client was configured with `compression`, compressed message bodies are
+        decompressed before the frames are dispatched (frames that cannot be decompressed
+        are logged and skipped). 
         """
         self.listening_event.set()
         self.shutdown_event.clear()
         try:
             while not self.shutdown_event.is_set():
-                frame = self.connection.read()
-                if frame:
-                    self.log.debug("Processing frame: %s" % frame)
-                    self.dispatch_frame(frame)
+                try:
+                    frames = self.connection.read_many()
+                except FrameSizeError as e:
+                    self.log.error("Discarded received frame: %s" % e)
+                    continue
+                if frames:
+                    self.process_frames(frames)
         except:
             self.log.exception("Error receiving data; aborting listening loop.")
             raise
         finally:
             self.listening_event.clear()
     
+    def process_frames(self, frames):
+        """
+        Dispatches a batch of received frames (see :meth:`listen_forever`).
+        
+        This is called by the listening loop, or by a :class:`stompclient.reactor.Reactor` 
+        that receives frames for the client.
+        
+        :param frames: The received frames.
+        :type frames: `list` of :class:`stompclient.frame.Frame`
+        """
+        log_frames = self.log.isEnabledFor(logging.DEBUG)
+        compression = self.compression
+        if compression is not None:
+            # Decompressed bodies are subject to the connection's body size limit too.
+            max_size = self.connection.buffer_options.get('max_body_size')
+        for frame in frames:
+            if compression is not None:
+                try:
+                    compression.decompress_frame(frame, max_size)
+                except FrameError as e:
+                    self.log.error("Discarded received frame: %s" % e)
+                    continue
+            if log_frames:
+                self.log.debug("Processing frame: %s" % frame)
+            self.dispatch_frame(frame)
+    
     def disconnect(self, extra_headers=None):
         """
         Sends DISCONNECT frame and disconnect from the server.
@@ -143,8 +190,11 @@ class QueueingDuplexClient(BaseBlockingDuplexClient):
     :type queue_timeout: `float`  
     """
     
-    def __init__(self, host, port=61613, socket_timeout=3.0, connection_pool=None, queue_timeout=5.0):
-        super(QueueingDuplexClient, self).__init__(host, port=port, socket_timeout=socket_timeout, connection_pool=connection_pool)
+    def __init__(self, host, port=61613, socket_timeout=3.0, connection_pool=None, queue_timeout=5.0, 
+                 compression=None, codecs=None, frame_pool=None):
+        super(QueueingDuplexClient, self).__init__(host, port=port, socket_timeout=socket_timeout, 
+                                                   connection_pool=connection_pool, compression=compression,
+                                                   codecs=codecs, frame_pool=frame_pool)
         self.connected_queue = Queue()
         self.message_queue = Queue()
         self.receipt_queue = Queue()
@@ -153,6 +203,8 @@ class QueueingDuplexClient(BaseBlockingDuplexClient):
         self.queue_timeout = queue_timeout
         if isinstance(connection_pool, threading.local):
             raise Exception("Cannot use a thread-local pool for duplex clients.")
+        if isinstance(connection_pool, BoundedConnectionPool):
+            raise Exception("Cannot use a bounded pool for duplex clients.")
     
     def dispatch_frame(self, frame):
         """
@@ -180,24 +232,31 @@ class QueueingDuplexClient(BaseBlockingDuplexClient):
         else:
             self.log.info("Ignoring frame from server: %s" % frame)
     
-    def connect(self, login=None, passcode=None, extra_headers=None):
+    def connect(self, login=None, passcode=None, extra_headers=None, heart_beat=None):
         """
         Send CONNECT frame to the STOMP server and return CONNECTED frame (if possible). 
         
         This method will issue a warning (`warnings.warn`) if the listener loop
         is not running.
         
+        :param heart_beat: (optional) The heart-beat intervals to request, in milliseconds (see
+                            :class:`stompclient.frame.ConnectFrame`).  Once negotiated, the
+                            listening loop sends heart-beats while idle and aborts with a
+                            :class:`stompclient.exceptions.ConnectionError` if the server's 
+                            heart-beats stop.
+        :type heart_beat: `tuple` of `int`
+        
         :return: The CONNECTED frame from the server.
         :rtype: :class:`stompclient.frame.Frame`
         """
-        connect = frame.ConnectFrame(login, passcode, extra_headers=extra_headers)
+        connect = frame.ConnectFrame(login, passcode, extra_headers=extra_headers, heart_beat=heart_beat)
         self.send_frame(connect)
         if not self.listening_event.is_set():
             self.log.warning("Cannot deliver connection response; listening loop is not running.")
             warnings.warn("Cannot deliver connection response; listening loop is not running.")
         else:
             try:
-                return self.connected_queue.get(timeout=self.queue_timeout)
+                return self._get_response(self.connected_queue)
             except Empty:
                 raise Exception("Expected CONNECTED frame, but none received.")
         
@@ -245,7 +304,8 @@ class QueueingDuplexClient(BaseBlockingDuplexClient):
         
         This implementation does NOT attempt to disconnect/reconnect if connection error
         received, because disconnecting the socket royally pisses off the listen_forever blocking
-        loop.
+        loop.  (Use a connection pool that creates :class:`stompclient.connection.ReconnectingConnection`
+        instances to reconnect, and resubscribe, transparently.)
         
         :param frame: The frame instance to send.
         :type frame: L{stomp.frame.Frame}
@@ -261,10 +321,22 @@ class QueueingDuplexClient(BaseBlockingDuplexClient):
         
         if need_receipt:
             try:
-                return self.receipt_queue.get(timeout=self.queue_timeout)
+                return self._get_response(self.receipt_queue)
             except Empty:
                 raise Exception("Expected RECEIPT response frame, but none received.")
+    
+    def _get_response(self, queue):
+        """
+        Waits (for at most `queue_timeout` seconds) for a response frame to be dispatched to
+        one of the queues.  With a reactor, this runs the reactor if nothing else would (see
+        :meth:`stompclient.reactor.Reactor.poll_until`).
         
+        :raise Queue.Empty: If no frame was received in time.
+        """
+        reactor = self.reactor
+        if reactor is not None:
+            return reactor.poll_until(queue, self.queue_timeout)
+        return queue.get(timeout=self.queue_timeout)
 
 class PublishSubscribeClient(QueueingDuplexClient):
     """
@@ -299,11 +371,20 @@ class PublishSubscribeClient(QueueingDuplexClient):
         else:
             self.log.info("Ignoring frame from server: %s" % frame)
     
-    def subscribe(self, destination, callback, ack=None, extra_headers=None):
+    def subscribe(self, destination, callback, ack=None, extra_headers=None, decode=False):
         """
         Subscribe to a given destination with specified callback function.
         
-        The callable will be passed the received :class:`stompclient.frame.Frame` object.
+        The callable will be passed the received :class:`stompclient.frame.Frame` object.  If
+        `decode` is set, it is also passed the body decoded by the codec for the frame's 
+        content-type (see :meth:`stompclient.codec.CodecRegistry.decode_frame`)::
+        
+            def handle(frame, payload):
+                print payload['key']
+            
+            client.subscribe('/queue/example', handle, decode=True)
+        
+        Frames whose body cannot be decoded are logged and not passed to the callable.
         
         :param destination: The destination "path" to subscribe to.
         :type destination: `str`
@@ -315,9 +396,31 @@ class PublishSubscribeClient(QueueingDuplexClient):
         :param ack: If set to 'client' will require clients to explicitly :meth:`ack` any
                     frames received (in order for server to consider them delivered).
         :type ack: `str` 
+        
+        :param decode: Whether to decode message bodies for the callable.
+        :type decode: `bool`
         """
+        if decode:
+            callback = self._decoding_callback(callback)
         subscribe = frame.SubscribeFrame(destination, ack=ack, extra_headers=extra_headers)
         res = self.send_frame(subscribe)
         with self.subscription_lock:
             self.subscribed_destinations[destination] = callback
-        return res
\ No newline at end of file
+        return res
+    
+    def _decoding_callback(self, callback):
+        """
+        Wraps a subscription callback so that it is called with the frame and its decoded body.
+        
+        :rtype: `callable`
+        """
+        decode = self.codecs.decode_frame
+        log = self.log
+        def decoding_callback(frame):
+            try:
+                payload = decode(frame)
+            except Exception:
+                log.exception("Unable to decode body of frame: %r" % frame)
+                return
+            callback(frame, payload)
+        return decoding_callback
\ No newline at end of file
@@ -27,7 +27,15 @@ class ConnectionError(socket.error):
 class ConnectionTimeoutError(socket.timeout):
     """Timed-out while establishing connection to the STOMP server."""
 
+class PoolTimeoutError(Exception):
+    """Timed-out waiting for a connection from a bounded connection pool."""
+
 class FrameError(Exception):
     """
     Raise for problem with frame generation or parsing.
     """
+
+class FrameSizeError(FrameError):
+    """
+    Raised when a received frame exceeds the configured header, body or buffer size limits.
+    """
@@ -3,7 +3,9 @@ Classes to support reading and writing STOMP frames.
 
 This is a mixture of code from the stomper project and the stompy project codebases.
 """
+import re
 import uuid
+import threading
 
 from stompclient.exceptions import FrameError
  
@@ -21,14 +23,204 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
+# STOMP Spec v1.0 commands (interned, so that command comparisons are usually identity checks).
+ABORT = intern('ABORT')
+ACK = intern('ACK')
+BEGIN = intern('BEGIN')
+COMMIT = intern('COMMIT')
+CONNECT = intern('CONNECT')
+CONNECTED = intern('CONNECTED')
+DISCONNECT = intern('DISCONNECT')
+MESSAGE = intern('MESSAGE')
+SEND = intern('SEND')
+SUBSCRIBE = intern('SUBSCRIBE')
+UNSUBSCRIBE = intern('UNSUBSCRIBE')
+RECEIPT = intern('RECEIPT')
+ERROR = intern('ERROR')
+
 # STOMP Spec v1.0 valid commands:
 VALID_COMMANDS = [
-    'ABORT', 'ACK', 'BEGIN', 'COMMIT', 
-    'CONNECT', 'CONNECTED', 'DISCONNECT', 'MESSAGE',
-    'SEND', 'SUBSCRIBE', 'UNSUBSCRIBE',
-    'RECEIPT', 'ERROR',    
+    ABORT, ACK, BEGIN, COMMIT, 
+    CONNECT, CONNECTED, DISCONNECT, MESSAGE,
+    SEND, SUBSCRIBE, UNSUBSCRIBE,
+    RECEIPT, ERROR,    
 ]
 
+# The valid commands as a set, for constant-time validation.
+VALID_COMMAND_SET = frozenset(VALID_COMMANDS)
+
+# The characters that are escaped in STOMP 1.1 (and later) header keys and values, and
+# their escape sequences.  STOMP 1.0 does not escape headers.
+ESCAPED_CHARS = '\\\n:\r'
+_ESCAPES = {'\\': '\\\\', '\n': '\\n', ':': '\\c', '\r': '\\r'}
+_UNESCAPES = dict((v[1], k) for (k, v) in _ESCAPES.items())
+_unescape_re = re.compile(r'\\(.?)', re.DOTALL)
+_unicode_escaped_chars = dict((ord(c), None) for c in ESCAPED_CHARS)
+
+def escape_header(s):
+    """
+    Returns the STOMP 1.1 escaped form of a header key or value.
+    
+    :param s: The header key or value.
+    :type s: `str`
+    
+    :rtype: `str`
+    """
+    # Backslashes must be escaped first, so that they are not doubled up again.
+    return s.replace('\\', '\\\\').replace('\n', '\\n').replace(':', '\\c').replace('\r', '\\r')
+
+def _unescape_char(match):
+    """ Returns the character for an escape sequence matched by `_unescape_re`. """
+    try:
+        return _UNESCAPES[match.group(1)]
+    except KeyError:
+        raise FrameError("Invalid escape sequence in header: %r" % match.group(0))
+
+def unescape_header(s):
+    """
+    Returns the original form of a STOMP 1.1 escaped header key or value.
+    
+    :param s: The escaped header key or value.
+    :type s: `str`
+    
+    :rtype: `str`
+    
+    :raise stompclient.exceptions.FrameError: If `s` contains an undefined escape sequence.
+    """
+    return _unescape_re.sub(_unescape_char, s)
+
+def _is_plain_header_block(block, num_headers):
+    """
+    Checks (in a single pass) whether a block of packed "key:value\\n" header lines needs escaping.
+    
+    Each line contains exactly one ':' and one newline unless a key or value contains a
+    character that must be escaped, so the block is plain if the number of such characters
+    in it is exactly twice the number of headers.
+    
+    :rtype: `bool`
+    """
+    if isinstance(block, unicode):
+        special = len(block) - len(block.translate(_unicode_escaped_chars))
+    else:
+        special = len(block) - len(block.translate(None, ESCAPED_CHARS))
+    return special == 2 * num_headers
+
+def _body_length(body):
+    """
+    Returns the length in bytes of a frame body, which may be a `str`, a `unicode` string
+    (sent as UTF-8, see :func:`_as_bytes`) or any object supporting the buffer protocol 
+    (e.g. `bytearray`, `memoryview`, `mmap.mmap` or `array.array`).
+    """
+    if isinstance(body, str):
+        return len(body)
+    elif isinstance(body, unicode):
+        return len(body.encode('utf-8'))
+    elif isinstance(body, memoryview):
+        length = body.itemsize
+        for dim in body.shape:
+            length *= dim
+        return length
+    else:
+        return len(buffer(body))
+
+def _as_bytes(body):
+    """
+    Returns the frame body as a `str` (converting memoryview, mmap and other buffer objects, 
+    and encoding `unicode` bodies as UTF-8).
+    """
+    if isinstance(body, str):
+        return body
+    elif isinstance(body, unicode):
+        # (The buffer of a unicode object is its internal UCS-2/UCS-4 storage.)
+        return body.encode('utf-8')
+    elif isinstance(body, memoryview):
+        return body.tobytes()
+    else:
+        return str(buffer(body))
+
+def _copy_headers(headers):
+    """
+    Returns a copy of a caller-supplied (optional) headers dict, so that adding headers
+    to a frame does not modify the caller's dict.
+    """
+    return dict(headers) if headers else None
+
+def parse_heart_beat(value):
+    """
+    Parses the value of a STOMP 1.1 'heart-beat' header.
+    
+    :param value: The header value (e.g. '10000,10000'), or `None` if the header is absent.
+    :type value: `str`
+    
+    :return: The two intervals in milliseconds (both 0 if the header is absent).
+    :rtype: `tuple` of `int`
+    
+    :raise stompclient.exceptions.FrameError: If the value is not two non-negative integers.
+    """
+    if value is None:
+        return (0, 0)
+    try:
+        (x, y) = [int(v) for v in value.split(',')]
+    except ValueError:
+        raise FrameError("Invalid heart-beat header: %r" % value)
+    if x < 0 or y < 0:
+        raise FrameError("Invalid heart-beat header: %r" % value)
+    return (x, y)
+
+def parse_header_block(block):
+    """
+    Parse a block of newline-separated "key:value" header lines into a :class:`dict`.
+    
+    Lines that do not contain a ':' are ignored; whitespace surrounding keys and values
+    is stripped.
+    
+    :param block: The header lines (without the command line).
+    :type block: `str`
+    
+    :return: The headers dict.
+    :rtype: `dict`
+    """
+    headers = {}
+    for line in block.split('\n'):
+        try:
+            (k, v) = line.split(':', 1) # header values may contain ':' so specify maxsplit
+        except ValueError:
+            continue
+        headers[k.strip()] = v.strip()
+    return headers
+
+def parse_escaped_header_block(block):
+    """
+    Parse a block of STOMP 1.1 (escaped) "key:value" header lines into a :class:`dict`.
+    
+    Unlike :func:`parse_header_block`, whitespace is significant and is not stripped, and 
+    the first occurrence of a repeated header wins.  Keys and values are only unescaped if
+    the block contains a backslash at all, so plain header blocks are parsed at full speed.
+    
+    :param block: The header lines (without the command line).
+    :type block: `str`
+    
+    :return: The headers dict.
+    :rtype: `dict`
+    
+    :raise stompclient.exceptions.FrameError: If the block contains an undefined escape sequence.
+    """
+    headers = {}
+    escaped = '\\' in block
+    for line in block.split('\n'):
+        try:
+            (k, v) = line.split(':', 1)
+        except ValueError:
+            continue
+        if escaped:
+            if '\\' in k:
+                k = unescape_header(k)
+            if '\\' in v:
+                v = unescape_header(v)
+        if k not in headers:
+            headers[k] = v
+    return headers
+
 class Frame(object):
     """
     Class to hold a STOMP message frame. 
@@ -36,15 +228,28 @@ class Frame(object):
     This class is based on code from the Stomper project, with a few modifications.
     
     :ivar command: The STOMP command.  When assigned it is validated
-                against the VALID_COMMANDS module-level list.
+                against the VALID_COMMAND_SET module-level set.
     :type command: `str`
     
     :ivar headers: A dictionary of headers for this frame.
     :type headers: `dict`
     
-    :ivar body: The body of the message (bytes).
+    :ivar body: The body of the message (bytes).  Frames to be sent may also have a body of 
+                any type supporting the buffer protocol (e.g. `bytearray`, `memoryview`, 
+                `mmap.mmap` or `array.array`), which :meth:`pack_buffers` does not copy.  
+                Frames received by a buffer in zero-copy mode have a read-only `memoryview` 
+                body instead, and frames whose body was spooled to disk have an `mmap.mmap` 
+                body.
     :type body: `str`
-    """    
+    
+    Frames are slotted objects (they have no instance `__dict__`), since applications may 
+    hold very large numbers of them in queues.  Subclasses should therefore also define
+    `__slots__`.  The most commonly used headers have dedicated accessors (e.g. 
+    :attr:`message_id` and :attr:`destination`); other headers can be accessed as attributes
+    via :meth:`__getattr__`.
+    """
+    __slots__ = ('_cmd', 'headers', 'body')
+    
     def __init__(self, command=None, headers=None, body=None):
         """
         Initialize new frame with command, headers, and body.
@@ -67,13 +272,78 @@ class Frame(object):
         """
         Sets the command, after ensuring that it is a valid command (or None).
         """
-        if cmd is not None:
+        if cmd is not None and cmd not in VALID_COMMAND_SET:
             cmd = cmd.upper()
-            if cmd not in VALID_COMMANDS:
+            if cmd not in VALID_COMMAND_SET:
                 raise FrameError("The command '%s' is not valid; it must be one of %r" % (cmd, VALID_COMMANDS))
         self._cmd = cmd
     
     command = property(_get_cmd, _set_cmd)
+    
+    @classmethod
+    def trusted(cls, command, headers, body):
+        """
+        Creates a frame without validating the command or defaulting the headers and body.
+        
+        This is intended for parsers (e.g. :class:`stompclient.util.FrameBuffer`) that have 
+        already checked the command against :data:`VALID_COMMAND_SET`; frames built by 
+        applications should use the normal constructor, which validates the command.
+        
+        :param command: The (valid, upper-case) STOMP command.
+        :type command: `str`
+        
+        :param headers: The headers dict.
+        :type headers: `dict`
+        
+        :param body: The message body.
+        :type body: `str`
+        
+        :rtype: :class:`Frame`
+        """
+        frame = cls.__new__(cls)
+        frame._cmd = command
+        frame.headers = headers
+        frame.body = body
+        return frame
+    
+    def get_header(self, name, default=None):
+        """
+        Returns the value of the named header.
+        
+        :param name: The header name (e.g. 'message-id').
+        :type name: `str`
+        
+        :param default: The value to return if the frame does not have the header.
+        
+        :return: The header value (or the default).
+        """
+        return self.headers.get(name, default)
+    
+    def _set_header(self, name, value):
+        """
+        Sets the value of the named header, or removes the header if the value is `None` (so
+        that the frame is not sent with a header value of 'None').
+        """
+        if value is None:
+            self.headers.pop(name, None)
+        else:
+            self.headers[name] = value
+    
+    message_id = property(lambda self: self.get_header('message-id'), 
+                          lambda self, value: self._set_header('message-id', value),
+                          doc="The 'message-id' header value (or `None`; assigning `None` removes the header).")
+    
+    destination = property(lambda self: self.get_header('destination'), 
+                           lambda self, value: self._set_header('destination', value),
+                           doc="The 'destination' header value (or `None`; assigning `None` removes the header).")
+    
+    receipt = property(lambda self: self.get_header('receipt'), 
+                       lambda self, value: self._set_header('receipt', value),
+                       doc="The 'receipt' header value (or `None`; assigning `None` removes the header).")
+    
+    receipt_id = property(lambda self: self.get_header('receipt-id'), 
+                          lambda self, value: self._set_header('receipt-id', value),
+                          doc="The 'receipt-id' header value (or `None`; assigning `None` removes the header).")
 
     def unpack(self, framebytes):
         """
@@ -111,27 +381,65 @@ class Frame(object):
         # -> {"george": "constanza", "elaine": "benes"}
         return dict(line.split(":", 1) for line in headers_str.split("\n"))
     
-    def pack(self):
+    def pack(self, escape=False):
         """
         Create a string representation from object state.
         
+        The content-length header is always calculated from the body when the frame 
+        is packed (any 'content-length' value in the headers dict is ignored); the 
+        headers dict itself is not modified.
+        
+        :param escape: Whether to escape header keys and values as specified by STOMP 1.1 
+                        (CONNECT and CONNECTED frames are never escaped).
+        :type escape: `bool`
+        
         :return: The string (bytes) for this stomp frame.
         :rtype: `str` 
         """
+        body = _as_bytes(self.body)
+        # Frame is Command + Header + EOF marker.
+        return "%s%s\x00" % (self._pack_header(len(body), escape), body)
+    
+    def pack_buffers(self, escape=False):
+        """
+        Returns the parts of the packed frame without concatenating them.
+        
+        This avoids copying the body (which may be any object supporting the buffer protocol, 
+        e.g. a `bytearray`, `memoryview`, `mmap.mmap` or `array.array`) into a new string; the 
+        parts can be written to a socket one after the other (see 
+        :meth:`stompclient.connection.Connection.send`).
+        
+        :param escape: Whether to escape header keys and values (see :meth:`pack`).
+        :type escape: `bool`
+        
+        :return: The command and header lines (including the blank line that ends them), the
+                    body (encoded as UTF-8 if it is `unicode`) and the null terminator.
+        :rtype: `tuple`
+        """
+        body = self.body
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        return (self._pack_header(_body_length(body), escape), body, '\x00')
+    
+    def _pack_header(self, content_length, escape=False):
+        """
+        Returns the command line and header lines of the packed frame, including the blank
+        line that precedes the body.
+        
+        :rtype: `str`
+        """
         command = self.command
         headers = self.headers
-        body = self.body
         
-        headers['content-length'] = len(body)
-
         # Convert and append any existing headers to a string as the
         # protocol describes.
-        headerparts = ("%s:%s\n" % (key, value) for key, value in headers.iteritems())
-
-        # Frame is Command + Header + EOF marker.
-        framebytes = "%s\n%s\n%s\x00" % (command, "".join(headerparts), body)
+        headerparts = ["%s:%s\n" % (key, value) for key, value in headers.iteritems() if key != 'content-length']
+        headerblock = "".join(headerparts)
+        if escape and command not in (CONNECT, CONNECTED) and not _is_plain_header_block(headerblock, len(headerparts)):
+            headerblock = "".join(["%s:%s\n" % (escape_header("%s" % key), escape_header("%s" % value)) 
+                                   for key, value in headers.iteritems() if key != 'content-length'])
         
-        return framebytes
+        return "%s\ncontent-length:%d\n%s\n" % (command, content_length, headerblock)
     
     def __getattr__(self, name):
         """ Convenience way to return header values as if they're object attributes. 
@@ -147,13 +455,28 @@ class Frame(object):
         'value'
         """
         if name.startswith('_'):
-            raise AttributeError()
+            raise AttributeError(name)
         
-        try:
-            return self.headers[name]
-        except KeyError:
+        headers = self.headers
+        if name in headers:
+            return headers[name]
+        else:
             # Try converting _ to -
-            return self.headers.get(name.replace('_', '-'))
+            return headers.get(name.replace('_', '-'))
+    
+    def __getstate__(self):
+        """ Returns the state for pickling (slotted objects have no `__dict__`). """
+        state = {}
+        for cls in type(self).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        return state
+    
+    def __setstate__(self, state):
+        """ Restores the state saved by :meth:`__getstate__`. """
+        for (slot, value) in state.items():
+            object.__setattr__(self, slot, value)
     
     def __eq__(self, other):
         """ Override equality checking to test for matching command, headers, and body. """
@@ -171,6 +494,169 @@ class Frame(object):
     def __repr__(self):
         return '<%s cmd=%s len=%d>' % (self.__class__.__name__, self.command, len(self.body))
     
+class LazyFrame(Frame):
+    """
+    A frame (received from the server) that defers parsing its headers until they are needed.
+    
+    The raw header block is kept as received and only parsed into a `dict` when the
+    :attr:`headers` attribute is first accessed.  Until then, header values accessed as
+    attributes (e.g. `frame.destination` or `frame.message_id`) are found with a targeted 
+    scan of the raw block, so that routing a frame does not require parsing all of its
+    headers.
+    
+    Frames of this type are created by :class:`stompclient.util.FrameBuffer` when it is
+    configured with `lazy_headers=True`.
+    """
+    __slots__ = ('_raw_headers', '_headers')
+    
+    # The function used to parse the raw header block.
+    _parse_header_block = staticmethod(parse_header_block)
+    
+    def __init__(self, command, raw_headers='', body=None):
+        """
+        :param command: The STOMP command.
+        :type command: `str`
+        
+        :param raw_headers: The raw header lines, each preceded by a newline (i.e. the header 
+                            block as received, starting with the newline after the command).
+        :type raw_headers: `str`
+        
+        :param body: The message body bytes.
+        :type body: `str`
+        """
+        if body is None:
+            body = ''
+        self.command = command
+        self.body = body
+        self._raw_headers = raw_headers
+        self._headers = None
+    
+    @classmethod
+    def trusted(cls, command, raw_headers, body):
+        """
+        Creates a lazy frame without validating the command (see :meth:`Frame.trusted`).
+        
+        :param raw_headers: The raw header block (see :meth:`__init__`).
+        :type raw_headers: `str`
+        
+        :rtype: :class:`LazyFrame`
+        """
+        frame = cls.__new__(cls)
+        frame._cmd = command
+        frame.body = body
+        frame._raw_headers = raw_headers
+        frame._headers = None
+        return frame
+    
+    def _get_headers(self):
+        """
+        Returns the headers dict, parsing the raw header block if necessary.
+        """
+        if self._headers is None:
+            self._headers = self._parse_header_block(self._raw_headers)
+        return self._headers
+    
+    def _set_headers(self, headers):
+        """
+        Sets the headers dict (replacing any unparsed raw headers).
+        """
+        self._headers = headers
+        self._raw_headers = None
+    
+    headers = property(_get_headers, _set_headers)
+    
+    def get_header(self, name, default=None):
+        """
+        Returns the value of the named header, scanning the raw header block if the
+        headers have not been parsed yet.
+        
+        :param name: The header name (e.g. 'message-id').
+        :type name: `str`
+        
+        :param default: The value to return if the frame does not have the header.
+        
+        :return: The header value (or the default).
+        """
+        if self._headers is None:
+            value = self._scan_header(name)
+            if value is not None:
+                return value
+        return self.headers.get(name, default)
+    
+    def _scan_header(self, name):
+        """
+        Finds the value of the named header in the raw header block without parsing it.
+        
+        As with the parsed headers, the last occurrence of a repeated header wins.
+        
+        :return: The header value or `None` if it could not be found by the scan.
+        :rtype: `str`
+        """
+        raw = self._raw_headers
+        key = '\n%s:' % name
+        i = raw.rfind(key)
+        if i == -1:
+            return None
+        i += len(key)
+        j = raw.find('\n', i)
+        if j == -1:
+            return raw[i:].strip()
+        else:
+            return raw[i:j].strip()
+        
+    def __getattr__(self, name):
+        """ Return header values as attributes (see :meth:`Frame.__getattr__`).
+        
+        If the headers have not been parsed yet, the value is found by scanning the raw
+        header block; the headers are only parsed if the scan does not find the header.
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+        
+        if self._headers is None:
+            value = self._scan_header(name)
+            if value is None and '_' in name:
+                value = self._scan_header(name.replace('_', '-'))
+            if value is not None:
+                return value
+        return super(LazyFrame, self).__getattr__(name)
+    
+class EscapedLazyFrame(LazyFrame):
+    """
+    A :class:`LazyFrame` whose raw headers are STOMP 1.1 escaped.
+    
+    Header keys and values are unescaped (and not stripped of whitespace) and the first 
+    occurrence of a repeated header wins (see :func:`parse_escaped_header_block`).
+    
+    Frames of this type are created by :class:`stompclient.util.FrameBuffer` when it is
+    configured with `lazy_headers=True` and `unescape_headers=True`.
+    """
+    __slots__ = ()
+    
+    _parse_header_block = staticmethod(parse_escaped_header_block)
+    
+    def _scan_header(self, name):
+        """
+        Finds the (unescaped) value of the named header in the raw header block without parsing it.
+        
+        :return: The header value or `None` if it could not be found by the scan.
+        :rtype: `str`
+        """
+        raw = self._raw_headers
+        key = '\n%s:' % escape_header(name)
+        i = raw.find(key)
+        if i == -1:
+            return None
+        i += len(key)
+        j = raw.find('\n', i)
+        if j == -1:
+            value = raw[i:]
+        else:
+            value = raw[i:j]
+        if '\\' in value:
+            value = unescape_header(value)
+        return value
+    
 class HeaderValue(object):
     """
     An descriptor class that can be used when a calculated header value is needed.
@@ -221,22 +707,35 @@ class HeaderValue(object):
 
 class ConnectFrame(Frame):
     """ A CONNECT client frame. """
+    __slots__ = ()
     
-    def __init__(self, login=None, passcode=None, extra_headers=None):
-        super(ConnectFrame, self).__init__('CONNECT', headers=extra_headers)
+    def __init__(self, login=None, passcode=None, extra_headers=None, heart_beat=None):
+        """
+        :param heart_beat: (optional) The STOMP 1.1 heart-beat intervals to request, in
+                            milliseconds: the smallest interval at which the client can send
+                            heart-beats and the interval at which it wants to receive them
+                            (0 for none).  Brokers only heart-beat once STOMP 1.1 has been
+                            negotiated (see the 'accept-version' header).
+        :type heart_beat: `tuple` of `int`
+        """
+        super(ConnectFrame, self).__init__(CONNECT, headers=_copy_headers(extra_headers))
         if login:
             self.headers['login'] = login
         if passcode:
             self.headers['passcode'] = passcode
+        if heart_beat:
+            self.headers['heart-beat'] = '%d,%d' % tuple(heart_beat)
 
 class DisconnectFrame(Frame):
     """ A DISCONNECT client frame. """
+    __slots__ = ()
     
     def __init__(self, extra_headers=None):
-        super(DisconnectFrame, self).__init__('DISCONNECT', headers=extra_headers)
+        super(DisconnectFrame, self).__init__(DISCONNECT, headers=_copy_headers(extra_headers))
         
 class SendFrame(Frame):
     """ A SEND client frame. """
+    __slots__ = ()
     
     def __init__(self, destination, body=None, transaction=None, extra_headers=None):
         """
@@ -249,14 +748,186 @@ class SendFrame(Frame):
         :param transaction: (optional) transaction identifier.
         :type transaction: `str`
         """
-        super(SendFrame, self).__init__('SEND', headers=extra_headers, body=body)
-        self.headers['content-length'] = HeaderValue(calculator=lambda: len(self.body))
-        self.headers['destination'] = destination
+        super(SendFrame, self).__init__(SEND, headers={})
+        self.reset(destination, body, transaction, extra_headers)
+    
+    def reset(self, destination, body=None, transaction=None, extra_headers=None):
+        """
+        Re-initializes the frame in place (reusing its headers dict), as if it had just been
+        constructed with the specified arguments.  See :class:`FramePool`.
+        
+        :return: This frame.
+        :rtype: :class:`SendFrame`
+        """
+        headers = self.headers
+        headers.clear()
+        if extra_headers:
+            headers.update(extra_headers)
+        headers['destination'] = destination
         if transaction:
-            self.headers['transaction'] = transaction
+            headers['transaction'] = transaction
+        self.body = body if body is not None else ''
+        return self
+
+class PreparedSend(object):
+    """
+    A template for sending many messages with identical headers to the same destination.
+    
+    The command and header lines (everything except the content-length) are encoded once,
+    when the template is created, so packing a message only requires formatting the 
+    content-length and concatenating the body::
+    
+        prepared = client.prepare_send('/queue/telemetry', extra_headers={'persistent': 'true'})
+        for reading in readings:
+            prepared.send(reading)
+    
+    The 'receipt' header is not supported, since every message would share the same receipt id.
+    
+    :ivar headers: The (fixed) headers of the messages; this dict is shared by all frames
+                    created from the template and must not be modified.
+    :type headers: `dict`
+    
+    :ivar prefix: The encoded command and header lines.
+    :type prefix: `str`
+    
+    :ivar escaped_prefix: The encoded command and STOMP 1.1 escaped header lines.
+    :type escaped_prefix: `str`
+    
+    :ivar sender: The callable used by :meth:`send` to send frames (e.g. a client's `send_frame` method).
+    :type sender: `callable`
+    """
+    __slots__ = ('headers', 'prefix', 'escaped_prefix', 'sender')
+    
+    def __init__(self, destination, transaction=None, extra_headers=None, sender=None):
+        """
+        :param destination: The destination for messages.
+        :type destination: `str`
+        
+        :param transaction: (optional) transaction identifier.
+        :type transaction: `str`
+        
+        :param extra_headers: Additional headers for every message.
+        :type extra_headers: `dict`
+        
+        :param sender: The callable that :meth:`send` passes frames to.
+        :type sender: `callable`
+        
+        :raise ValueError: If the headers include a 'receipt' header.
+        """
+        headers = dict(extra_headers) if extra_headers else {}
+        if 'receipt' in headers:
+            raise ValueError("Prepared messages cannot request a receipt.")
+        headers.pop('content-length', None)
+        headers['destination'] = destination
+        if transaction:
+            headers['transaction'] = transaction
+        self.headers = headers
+        headerparts = ["%s:%s\n" % (key, value) for (key, value) in headers.iteritems()]
+        self.prefix = 'SEND\n' + ''.join(headerparts)
+        if _is_plain_header_block(self.prefix[5:], len(headerparts)):
+            self.escaped_prefix = self.prefix
+        else:
+            self.escaped_prefix = 'SEND\n' + ''.join(["%s:%s\n" % (escape_header("%s" % key), escape_header("%s" % value)) 
+                                                      for (key, value) in headers.iteritems()])
+        self.sender = sender
+    
+    def pack(self, body, escape=False):
+        """
+        Returns the bytes of a SEND frame with the specified body.
+        
+        :param body: The message body bytes.
+        :type body: `str`
+        
+        :param escape: Whether to use the STOMP 1.1 escaped headers.
+        :type escape: `bool`
+        
+        :rtype: `str`
+        """
+        body = _as_bytes(body)
+        prefix = self.escaped_prefix if escape else self.prefix
+        return "%scontent-length:%d\n\n%s\x00" % (prefix, len(body), body)
+    
+    def pack_buffers(self, body, escape=False):
+        """
+        Returns the parts of a SEND frame with the specified body (see :meth:`Frame.pack_buffers`).
+        
+        :param body: The message body (`str` or any object supporting the buffer protocol).
+        
+        :param escape: Whether to use the STOMP 1.1 escaped headers.
+        :type escape: `bool`
+        
+        :rtype: `tuple`
+        """
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        prefix = self.escaped_prefix if escape else self.prefix
+        return ("%scontent-length:%d\n\n" % (prefix, _body_length(body)), body, '\x00')
+    
+    def frame(self, body=None):
+        """
+        Creates a frame for a message with the specified body.
+        
+        :param body: The message body bytes.
+        :type body: `str`
+        
+        :rtype: :class:`PreparedSendFrame`
+        """
+        return PreparedSendFrame(self, body)
+    
+    def send(self, body=None):
+        """
+        Sends a message with the specified body (using the configured `sender`).
+        
+        :param body: The message body bytes.
+        :type body: `str`
+        """
+        return self.sender(PreparedSendFrame(self, body))
+
+class PreparedSendFrame(Frame):
+    """
+    A SEND frame created from a :class:`PreparedSend` template (which encodes its headers).
+    
+    :ivar template: The template the frame was created from.
+    :type template: :class:`PreparedSend`
+    """
+    __slots__ = ('template',)
+    
+    def __init__(self, template, body=None):
+        """
+        :param template: The template for the frame.
+        :type template: :class:`PreparedSend`
+        
+        :param body: The message body bytes.
+        :type body: `str`
+        """
+        self._cmd = SEND
+        self.headers = template.headers
+        self.body = body if body is not None else ''
+        self.template = template
+    
+    def pack(self, escape=False):
+        """
+        Create a string representation from the template and body.
+        
+        :param escape: Whether to use STOMP 1.1 escaped headers.
+        :type escape: `bool`
+        
+        :return: The string (bytes) for this stomp frame.
+        :rtype: `str` 
+        """
+        return self.template.pack(self.body, escape)
+    
+    def pack_buffers(self, escape=False):
+        """
+        Returns the parts of the packed frame (see :meth:`Frame.pack_buffers`).
+        
+        :rtype: `tuple`
+        """
+        return self.template.pack_buffers(self.body, escape)
 
 class SubscribeFrame(Frame):
     """ A SUBSCRIBE client frame. """
+    __slots__ = ()
     
     def __init__(self, destination, ack=None, id=None, selector=None, extra_headers=None):
         """
@@ -272,7 +943,7 @@ class SubscribeFrame(Frame):
         :param selector: A SQL-92 selector for content-based routing (if supported by broker). 
         :type selector: `str`
         """
-        super(SubscribeFrame, self).__init__('SUBSCRIBE', headers=extra_headers)
+        super(SubscribeFrame, self).__init__(SUBSCRIBE, headers=_copy_headers(extra_headers))
         self.headers['destination'] = destination
         if ack is not None:
             self.headers['ack'] = ack
@@ -283,6 +954,7 @@ class SubscribeFrame(Frame):
 
 class UnsubscribeFrame(Frame):
     """ An UNSUBSCRIBE client frame. """
+    __slots__ = ()
     
     def __init__(self, destination=None, id=None, extra_headers=None):
         """
@@ -294,7 +966,7 @@ class UnsubscribeFrame(Frame):
         
         :raise ValueError: If neither destination nor id are specified.
         """
-        super(UnsubscribeFrame, self).__init__('UNSUBSCRIBE', headers=extra_headers)
+        super(UnsubscribeFrame, self).__init__(UNSUBSCRIBE, headers=_copy_headers(extra_headers))
         if not destination and not id:
             raise ValueError("Must specify destination or id for unsubscribe request.")
         
@@ -305,39 +977,43 @@ class UnsubscribeFrame(Frame):
             
 class BeginFrame(Frame):
     """ A BEGIN client frame. """
+    __slots__ = ()
     
     def __init__(self, transaction, extra_headers=None):
         """
         :param transaction: The transaction identifier.
         :type transaction: `str`
         """
-        super(BeginFrame, self).__init__('BEGIN', headers=extra_headers)
+        super(BeginFrame, self).__init__(BEGIN, headers=_copy_headers(extra_headers))
         self.headers['transaction'] = transaction
 
 class CommitFrame(Frame):
     """ A COMMIT client frame. """
+    __slots__ = ()
     
     def __init__(self, transaction, extra_headers=None):
         """
         :param transaction: The transaction identifier.
         :type transaction: `str`
         """
-        super(CommitFrame, self).__init__('COMMIT', headers=extra_headers)
+        super(CommitFrame, self).__init__(COMMIT, headers=_copy_headers(extra_headers))
         self.headers['transaction'] = transaction
 
 class AbortFrame(Frame):
     """ An ABORT client frame. """
+    __slots__ = ()
     
     def __init__(self, transaction, extra_headers=None):
         """
         :param transaction: The transaction identifier.
         :type transaction: `str`
         """
-        super(AbortFrame, self).__init__('ABORT', headers=extra_headers)
+        super(AbortFrame, self).__init__(ABORT, headers=_copy_headers(extra_headers))
         self.headers['transaction'] = transaction
         
 class AckFrame(Frame):
     """ An ACK client frame. """
+    __slots__ = ()
     
     def __init__(self, message_id, transaction=None, extra_headers=None):
         """
@@ -347,10 +1023,69 @@ class AckFrame(Frame):
         :param transaction: The transaction identifier.
         :type transaction: `str`
         """
-        super(AckFrame, self).__init__('ACK', headers=extra_headers)
-        self.headers['message-id'] = message_id
+        super(AckFrame, self).__init__(ACK, headers={})
+        self.reset(message_id, transaction, extra_headers)
+    
+    def reset(self, message_id, transaction=None, extra_headers=None):
+        """
+        Re-initializes the frame in place (reusing its headers dict), as if it had just been
+        constructed with the specified arguments.  See :class:`FramePool`.
+        
+        :return: This frame.
+        :rtype: :class:`AckFrame`
+        """
+        headers = self.headers
+        headers.clear()
+        if extra_headers:
+            headers.update(extra_headers)
+        headers['message-id'] = message_id
         if transaction:
-            self.headers['transaction'] = transaction
+            headers['transaction'] = transaction
+        return self
+
+class FramePool(object):
+    """
+    Reusable SEND and ACK frames, for clients that send or acknowledge messages at high rates.
+    
+    Each thread gets its own SEND frame and ACK frame, which are re-initialized (see 
+    :meth:`SendFrame.reset` and :meth:`AckFrame.reset`) for every message instead of being 
+    allocated anew.  A pooled frame is therefore only valid until the same thread requests
+    another frame of the same type from the pool; this is the case for frames sent with 
+    :meth:`stompclient.connection.Connection.send`, which writes the frame before returning.
+    
+    Enable frame reuse by passing a pool to the client::
+    
+        client = PublishClient('localhost', frame_pool=FramePool())
+    """
+    
+    def __init__(self):
+        self._local = threading.local()
+    
+    def send_frame(self, destination, body=None, transaction=None, extra_headers=None):
+        """
+        Returns this thread's SEND frame, initialized with the specified arguments.
+        
+        :rtype: :class:`SendFrame`
+        """
+        local = self._local
+        frame = getattr(local, 'send', None)
+        if frame is None:
+            frame = local.send = SendFrame(destination, body, transaction, extra_headers)
+            return frame
+        return frame.reset(destination, body, transaction, extra_headers)
+    
+    def ack_frame(self, message_id, transaction=None, extra_headers=None):
+        """
+        Returns this thread's ACK frame, initialized with the specified arguments.
+        
+        :rtype: :class:`AckFrame`
+        """
+        local = self._local
+        frame = getattr(local, 'ack', None)
+        if frame is None:
+            frame = local.ack = AckFrame(message_id, transaction, extra_headers)
+            return frame
+        return frame.reset(message_id, transaction, extra_headers)
 
 # ---------------------------------------------------------------------------------
 # Server Frames
@@ -362,52 +1097,54 @@ class ConnectedFrame(Frame):
     :ivar session: The (throw-away) session ID to include in response.
     :type session: `str` 
     """
+    __slots__ = ()
     def __init__(self, session, extra_headers=None):
         """
         :param session: The (throw-away) session ID to include in response.
         :type session: `str`
         """
-        super(ConnectedFrame,self).__init__('CONNECTED', headers=extra_headers)
+        super(ConnectedFrame,self).__init__(CONNECTED, headers=_copy_headers(extra_headers))
         self.headers['session'] = session
 
 class MessageFrame(Frame):
     """ A MESSAGE server frame. """
+    __slots__ = ()
     
     def __init__(self, destination, body=None, message_id=None, extra_headers=None):
         """
         :param body: The message body bytes.
         :type body: `str` 
         """
-        super(MessageFrame, self).__init__('MESSAGE', headers=extra_headers, body=body)
+        super(MessageFrame, self).__init__(MESSAGE, headers=_copy_headers(extra_headers), body=body)
         if message_id is None:
             message_id = uuid.uuid4()
         self.headers['message-id'] = message_id
         self.headers['destination'] = destination
-        self.headers['content-length'] = HeaderValue(calculator=lambda: len(self.body))
         
 # TODO: Figure out what we need from ErrorFrame (exception wrapping?)
 class ErrorFrame(Frame):
     """ An ERROR server frame. """
+    __slots__ = ()
     
     def __init__(self, message, body=None, extra_headers=None):
         """
         :param body: The message body bytes.
         :type body: `str` 
         """
-        super(ErrorFrame, self).__init__('ERROR', headers=extra_headers, body=body)
+        super(ErrorFrame, self).__init__(ERROR, headers=_copy_headers(extra_headers), body=body)
         self.headers['message'] = message
-        self.headers['content-length'] = HeaderValue(calculator=lambda: len(self.body))
     
     def __repr__(self):
         return '<%s message=%r>' % (self.__class__.__name__, self.headers['message']) 
     
 class ReceiptFrame(Frame):
     """ A RECEIPT server frame. """
+    __slots__ = ()
     
     def __init__(self, receipt, extra_headers=None):
         """
         :param receipt: The receipt message ID.
         :type receipt: `str`
         """
-        super(ReceiptFrame, self).__init__('RECEIPT', headers=extra_headers)
+        super(ReceiptFrame, self).__init__(RECEIPT, headers=_copy_headers(extra_headers))
         self.headers['receipt-id'] = receipt
\ No newline at end of file
@@ -0,0 +1,418 @@
+"""
+A reactor that receives frames for many duplex clients on a single thread.
+"""
+import math
+import time
+import errno
+import select
+import logging
+import threading
+from Queue import Empty
+
+from stompclient.exceptions import ConnectionError, NotConnectedError, FrameSizeError
+
+__authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
+__copyright__ = "Copyright 2010 Hans Lellelid"
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+class EpollPoller(object):
+    """
+    Waits for readable (and writable) sockets using `select.epoll` (Linux).
+    """
+    
+    def __init__(self):
+        self._epoll = select.epoll()
+    
+    def register(self, fd):
+        self._epoll.register(fd, select.EPOLLIN)
+    
+    def modify(self, fd, writable):
+        """
+        Sets whether the descriptor is also watched for becoming writable.
+        """
+        self._epoll.modify(fd, select.EPOLLIN | select.EPOLLOUT if writable else select.EPOLLIN)
+    
+    def unregister(self, fd):
+        self._epoll.unregister(fd)
+    
+    def poll(self, timeout):
+        """
+        Returns the registered descriptors that are readable (or closed) and those that are
+        writable (if watched for that), waiting at most `timeout` seconds.
+        
+        :rtype: `tuple` of (`list` of int, `list` of int)
+        """
+        # epoll has millisecond resolution and would round shorter timeouts down to 0.
+        events = self._epoll.poll(math.ceil(timeout * 1000) / 1000.0)
+        return ([fd for (fd, event) in events if event & ~select.EPOLLOUT],
+                [fd for (fd, event) in events if event & select.EPOLLOUT])
+
+class PollPoller(object):
+    """
+    Waits for readable (and writable) sockets using `select.poll`.
+    """
+    
+    def __init__(self):
+        self._poll = select.poll()
+    
+    def register(self, fd):
+        self._poll.register(fd, select.POLLIN)
+    
+    def modify(self, fd, writable):
+        self._poll.modify(fd, select.POLLIN | select.POLLOUT if writable else select.POLLIN)
+    
+    def unregister(self, fd):
+        self._poll.unregister(fd)
+    
+    def poll(self, timeout):
+        events = self._poll.poll(int(math.ceil(timeout * 1000)))
+        return ([fd for (fd, event) in events if event & ~select.POLLOUT],
+                [fd for (fd, event) in events if event & select.POLLOUT])
+
+class SelectPoller(object):
+    """
+    Waits for readable (and writable) sockets using `select.select` (available on all platforms).
+    """
+    
+    def __init__(self):
+        self._fds = set()
+        self._writers = set()
+    
+    def register(self, fd):
+        self._fds.add(fd)
+    
+    def modify(self, fd, writable):
+        if writable:
+            self._writers.add(fd)
+        else:
+            self._writers.discard(fd)
+    
+    def unregister(self, fd):
+        self._fds.discard(fd)
+        self._writers.discard(fd)
+    
+    def poll(self, timeout):
+        (readable, writable, _) = select.select(list(self._fds), list(self._writers), [], timeout)
+        return (readable, writable)
+
+def default_poller():
+    """
+    Returns the most scalable poller available on this platform (epoll, then poll, then select).
+    """
+    if hasattr(select, 'epoll'):
+        return EpollPoller()
+    elif hasattr(select, 'poll'):
+        return PollPoller()
+    else:
+        return SelectPoller()
+
+class Reactor(object):
+    """
+    Receives and dispatches the frames of many duplex clients from a single loop.
+    
+    This is an alternative to running each client's :meth:`listen_forever` method in its own
+    thread: the reactor waits for any of the registered connections to become readable (using
+    epoll, poll or select) and passes the frames read from it to the owning client's
+    :meth:`process_frames` method, so the number of threads stays the same however many
+    connections are open::
+        
+        reactor = Reactor()
+        for host in hosts:
+            client = PublishSubscribeClient(host)
+            reactor.register(client)
+            client.connect()
+            client.subscribe('/queue/example', callback)
+        reactor.run_forever()
+    
+    Calls that wait for a response from the server (:meth:`connect`, or sending a frame with a
+    'receipt' header) work whether or not the reactor is running: on the thread that runs the
+    reactor (e.g. in a callback), or while it is not running at all, they run the reactor
+    themselves (see :meth:`poll_until`) until the response has been dispatched.
+    
+    Callbacks are invoked on the reactor thread and should not block.  Registered connections
+    are switched to non-blocking mode (see 
+    :meth:`stompclient.connection.Connection.set_nonblocking`): frames are only read when a
+    socket is readable, and frames sent (e.g. from callbacks) that a socket cannot accept at
+    once are kept and written when it becomes writable, so that a slow server does not stall
+    the other clients.  (Data left unsent by other threads is written on the next pass of the
+    loop, i.e. within `poll_timeout`.)  The reactor also sends and checks the heart-beats of
+    its connections.  A client whose connection
+    is closed (or whose server stops heart-beating) is unregistered and must be registered
+    again after reconnecting; so is a client for which receiving or dispatching frames raises
+    an unexpected error, while the other clients are unaffected.
+    
+    :ivar shutdown_event: An event that will be set when the loop should terminate.
+    :type shutdown_event: threading.Event
+    
+    :ivar poll_timeout: The maximum time (in seconds) to wait for a readable socket before
+                        checking the `shutdown_event` again.
+    :type poll_timeout: float
+    """
+    
+    def __init__(self, poller=None, poll_timeout=1.0):
+        """
+        :param poller: The poller used to wait for readable sockets (defaults to the
+                        result of :func:`default_poller`).
+        
+        :param poll_timeout: The maximum time (in seconds) to wait for a readable socket
+                        before checking the `shutdown_event` again.
+        :type poll_timeout: float
+        """
+        self.log = logging.getLogger('%s.%s' % (self.__module__, self.__class__.__name__))
+        if poller is None:
+            poller = default_poller()
+        self.poller = poller
+        self.poll_timeout = poll_timeout
+        self.shutdown_event = threading.Event()
+        self._clients = {}
+        # The descriptors that are watched for becoming writable.
+        self._writing = set()
+        self._lock = threading.Lock()
+        # The thread running run_forever (if any).
+        self._loop_thread = None
+    
+    @property
+    def clients(self):
+        """ The registered clients. """
+        with self._lock:
+            return [client for (client, _) in self._clients.values()]
+    
+    def register(self, client):
+        """
+        Registers a duplex client, connecting it if necessary.
+        
+        The client's `listening_event` is set, since its frames will now be received by
+        the reactor (its :meth:`listen_forever` method must not also be running), its
+        connection is made non-blocking and its `reactor` is set to this reactor.
+        
+        :param client: The client.
+        :type client: :class:`stompclient.duplex.BaseBlockingDuplexClient`
+        """
+        connection = client.connection
+        fd = connection.fileno()
+        connection.set_nonblocking(True)
+        with self._lock:
+            self._clients[fd] = (client, connection)
+            self.poller.register(fd)
+        client.reactor = self
+        client.listening_event.set()
+    
+    def unregister(self, client):
+        """
+        Stops receiving frames for a client (the client is not disconnected, and its connection
+        is made blocking again).
+        
+        :param client: The client.
+        :type client: :class:`stompclient.duplex.BaseBlockingDuplexClient`
+        """
+        with self._lock:
+            for (fd, (registered, _)) in self._clients.items():
+                if registered is client:
+                    self._remove(fd)
+        client.reactor = None
+        client.listening_event.clear()
+    
+    def _remove(self, fd):
+        """
+        Removes a descriptor from the poller, making its connection blocking again.  Must be
+        called with the lock held.
+        """
+        (_, connection) = self._clients.pop(fd)
+        self._writing.discard(fd)
+        connection.set_nonblocking(False)
+        try:
+            self.poller.unregister(fd)
+        except (KeyError, ValueError, IOError, OSError), e:
+            # The socket may already have been closed (epoll forgets closed descriptors).
+            self.log.debug("Error unregistering descriptor %d: %s" % (fd, e))
+    
+    def _drop(self, fd, client):
+        """
+        Unregisters the client of a connection that has failed (if still registered).
+        """
+        with self._lock:
+            if fd in self._clients:
+                self._remove(fd)
+        client.reactor = None
+        client.listening_event.clear()
+    
+    def _prune(self):
+        """
+        Unregisters clients whose connections have been closed.
+        """
+        with self._lock:
+            closed = [(fd, client) for (fd, (client, connection)) in self._clients.items()
+                      if not connection.connected]
+            for (fd, client) in closed:
+                self._remove(fd)
+        for (fd, client) in closed:
+            self.log.info("Connection closed; unregistered client %r" % client)
+            client.reactor = None
+            client.listening_event.clear()
+    
+    def _heartbeat(self):
+        """
+        Sends and checks the heart-beats of the registered connections (see 
+        :meth:`stompclient.connection.Connection.heartbeat`), unregistering clients whose
+        server has stopped sending data.
+        
+        :return: The time (in seconds) until heart-beats next need attention, or `None`.
+        :rtype: float
+        """
+        with self._lock:
+            registered = self._clients.items()
+        wait = None
+        for (fd, (client, connection)) in registered:
+            try:
+                due = connection.heartbeat()
+            except (ConnectionError, NotConnectedError), e:
+                self.log.warning("Heart-beat failed for client %r: %s" % (client, e))
+                self._drop(fd, client)
+                continue
+            except Exception:
+                self.log.exception("Error heart-beating for client %r; unregistered client." % client)
+                self._drop(fd, client)
+                continue
+            if due is not None and (wait is None or due < wait):
+                wait = due
+        return wait
+    
+    def _watch_writes(self):
+        """
+        Watches the connections with unsent data for becoming writable (and stops watching
+        those whose data has been written).
+        """
+        with self._lock:
+            for (fd, (_, connection)) in self._clients.items():
+                writable = connection.unsent_bytes > 0
+                if writable != (fd in self._writing):
+                    self.poller.modify(fd, writable)
+                    if writable:
+                        self._writing.add(fd)
+                    else:
+                        self._writing.discard(fd)
+    
+    def poll(self, timeout=None):
+        """
+        Waits for frames on the registered connections and dispatches them.
+        
+        :param timeout: The maximum time (in seconds) to wait for a readable connection
+                        (defaults to `poll_timeout`).
+        :type timeout: float
+        
+        :return: The number of frames dispatched.
+        :rtype: int
+        """
+        if timeout is None:
+            timeout = self.poll_timeout
+        self._prune()
+        wait = self._heartbeat()
+        if wait is not None:
+            timeout = min(timeout, wait)
+        self._watch_writes()
+        try:
+            (readable, writable) = self.poller.poll(timeout)
+        except (select.error, IOError), e:
+            if e.args[0] == errno.EINTR:
+                return 0
+            raise
+        
+        for fd in writable:
+            with self._lock:
+                registered = self._clients.get(fd)
+            if registered is None:
+                continue
+            (client, connection) = registered
+            try:
+                connection.write_available()
+            except (ConnectionError, NotConnectedError), e:
+                self.log.warning("Error sending data for client %r: %s" % (client, e))
+                self._drop(fd, client)
+        
+        dispatched = 0
+        for fd in readable:
+            with self._lock:
+                registered = self._clients.get(fd)
+            if registered is None:
+                continue
+            (client, connection) = registered
+            try:
+                frames = connection.read_available()
+                if frames:
+                    client.process_frames(frames)
+                    dispatched += len(frames)
+            except FrameSizeError, e:
+                self.log.error("Discarded received frame: %s" % e)
+            except (ConnectionError, NotConnectedError), e:
+                self.log.warning("Error receiving data for client %r: %s" % (client, e))
+                self._drop(fd, client)
+            except Exception:
+                # Only this client is affected (as if its own listening loop had aborted).
+                self.log.exception("Error receiving data for client %r; unregistered client." % client)
+                self._drop(fd, client)
+        return dispatched
+    
+    def poll_until(self, queue, timeout=None):
+        """
+        Returns the next item of a queue that is filled by frame dispatching (e.g. a
+        client's `connected_queue`).
+        
+        If the reactor is running in another thread, this simply waits for the item; otherwise
+        (on the reactor thread, or while the reactor is not running) it polls the connections
+        itself until the item has been dispatched, since nothing else would dispatch it.
+        
+        :param queue: The queue.
+        :type queue: `Queue.Queue`
+        
+        :param timeout: The maximum time (in seconds) to wait (`None` to wait indefinitely).
+        :type timeout: float
+        
+        :raise Queue.Empty: If no item became available in time.
+        """
+        loop_thread = self._loop_thread
+        if loop_thread is not None and loop_thread is not threading.current_thread():
+            return queue.get(timeout=timeout)
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            try:
+                return queue.get_nowait()
+            except Empty:
+                pass
+            if deadline is None:
+                wait = self.poll_timeout
+            else:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    raise Empty()
+            self.poll(min(wait, self.poll_timeout))
+    
+    def run_forever(self):
+        """
+        Blocking method that dispatches frames until the `shutdown_event` is set.
+        
+        This would typically be started within its own thread.
+        """
+        self.shutdown_event.clear()
+        self._loop_thread = threading.current_thread()
+        try:
+            while not self.shutdown_event.is_set():
+                self.poll()
+        except:
+            self.log.exception("Error receiving data; aborting reactor loop.")
+            raise
+        finally:
+            self._loop_thread = None
+            with self._lock:
+                clients = [client for (client, _) in self._clients.values()]
+            for client in clients:
+                client.listening_event.clear()
@@ -5,7 +5,8 @@ import abc
 import logging
 
 from stompclient import frame
-from stompclient.connection import ConnectionPool, ThreadLocalConnectionPool
+from stompclient.codec import CodecRegistry
+from stompclient.connection import ConnectionPool, ThreadLocalConnectionPool, BoundedConnectionPool
 from stompclient.exceptions import ConnectionError, NotConnectedError
 
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>', 'Benjamin W. Smith (stompy)']
@@ -37,10 +38,22 @@ class BaseClient(object):
     
     :ivar connection_pool: Object responsible for issuing STOMP connections.
     :type connection_pool: :class:`stompclient.connection.ConnectionPool`
+    
+    :ivar compression: Object that compresses the bodies of sent messages (and decompresses
+                        received ones), or `None` to disable compression.
+    :type compression: :class:`stompclient.compression.ZlibCompression`
+    
+    :ivar codecs: The codecs used to encode message bodies (see the `codec` parameter of :meth:`send`).
+    :type codecs: :class:`stompclient.codec.CodecRegistry`
+    
+    :ivar frame_pool: The pool of reusable frames used by :meth:`send` and :meth:`ack`, or `None` to 
+                        create a new frame for every message.
+    :type frame_pool: :class:`stompclient.frame.FramePool`
     """
     __metaclass__ = abc.ABCMeta
 
-    def __init__(self, host, port=61613, socket_timeout=3.0, connection_pool=None):
+    def __init__(self, host, port=61613, socket_timeout=3.0, connection_pool=None, compression=None, 
+                 codecs=None, frame_pool=None):
         """
         Initialize STOMP client.
         
@@ -55,12 +68,24 @@ class BaseClient(object):
         
         :param connection_pool: A configured connection pool (defaults to non-threadsafe ConnectionPool).
         :type connection_pool: :class:`stompclient.connection.ConnectionPool`
+        
+        :param compression: (optional) Message body compression (e.g. :class:`stompclient.compression.ZlibCompression`).
+        :type compression: :class:`stompclient.compression.ZlibCompression`
+        
+        :param codecs: (optional) The codec registry (defaults to one with just the JSON codec).
+        :type codecs: :class:`stompclient.codec.CodecRegistry`
+        
+        :param frame_pool: (optional) A pool of reusable SEND and ACK frames.
+        :type frame_pool: :class:`stompclient.frame.FramePool`
         """
         self.log = logging.getLogger('%s.%s' % (self.__class__.__module__, self.__class__.__name__))
         self.connection_pool = connection_pool if connection_pool else ConnectionPool()
         self.host = host
         self.port = port
         self.socket_timeout = socket_timeout
+        self.compression = compression
+        self.codecs = codecs if codecs is not None else CodecRegistry()
+        self.frame_pool = frame_pool
     
     @property
     def connection(self):
@@ -70,11 +95,17 @@ class BaseClient(object):
         """
         return self.connection_pool.get_connection(self.host, self.port, self.socket_timeout)
     
-    def connect(self, login=None, passcode=None, extra_headers=None):
+    def connect(self, login=None, passcode=None, extra_headers=None, heart_beat=None):
         """
         Send CONNECT frame to the STOMP server. 
+        
+        :param heart_beat: (optional) The heart-beat intervals to request, in milliseconds (see
+                            :class:`stompclient.frame.ConnectFrame`).  Heart-beats are sent and
+                            checked by the connection while it is read (or when its
+                            :meth:`stompclient.connection.Connection.heartbeat` method is called).
+        :type heart_beat: `tuple` of `int`
         """
-        connect = frame.ConnectFrame(login, passcode)
+        connect = frame.ConnectFrame(login, passcode, extra_headers=extra_headers, heart_beat=heart_beat)
         return self.send_frame(connect)
 
     def disconnect(self, conf=None, extra_headers=None):
@@ -96,21 +127,64 @@ class BaseClient(object):
         self.disconnect()
 
 
-    def send(self, destination, body=None, transaction=None, extra_headers=None):
+    def send(self, destination, body=None, transaction=None, extra_headers=None, codec=None):
         """
         Sends a message to STOMP server.
         
         :param destination: The destination "path" for message.
         :type destination: C{str}
         
-        :param body: The body (bytes) of the message.
+        :param body: The body (bytes) of the message, or the object to encode if `codec` is specified.
         :type body: C{str}
         
         :param transaction: (optional) The transaction ID associated with this ACK.
         :type transaction: C{str}
+        
+        :param codec: (optional) The name of the codec (in `codecs`) used to encode the body, e.g. 
+                        'json'.  The content-type header is set accordingly.
+        :type codec: C{str}
+        
+        If the client was configured with `compression`, the body is compressed when it is
+        large enough.
         """
-        send = frame.SendFrame(destination, body, transaction, extra_headers=extra_headers)
+        if codec is not None:
+            (body, content_type) = self.codecs.encode(codec, body)
+            extra_headers = dict(extra_headers) if extra_headers else {}
+            extra_headers['content-type'] = content_type
+        if self.frame_pool is not None:
+            send = self.frame_pool.send_frame(destination, body, transaction, extra_headers)
+        else:
+            send = frame.SendFrame(destination, body, transaction, extra_headers=extra_headers)
+        if self.compression is not None:
+            self.compression.compress_frame(send)
         return self.send_frame(send)
+    
+    def prepare_send(self, destination, transaction=None, extra_headers=None):
+        """
+        Prepares for sending many messages with the same headers to a destination.
+        
+        The headers are encoded once, so that each subsequent send only needs to add 
+        the content-length and the body::
+        
+            prepared = client.prepare_send('/queue/example')
+            prepared.send('message 1')
+            prepared.send('message 2')
+        
+        :param destination: The destination "path" for the messages.
+        :type destination: C{str}
+        
+        :param transaction: (optional) The transaction ID associated with the messages.
+        :type transaction: C{str}
+        
+        :param extra_headers: Additional headers for the messages (the 'receipt' header is not supported).
+        :type extra_headers: C{dict}
+        
+        Messages sent through the handle are never compressed.
+        
+        :return: A handle whose `send(body)` method sends a message through this client.
+        :rtype: :class:`stompclient.frame.PreparedSend`
+        """
+        return frame.PreparedSend(destination, transaction, extra_headers=extra_headers, sender=self.send_frame)
 
     def begin(self, transaction, extra_headers=None):
         """
@@ -168,7 +242,10 @@ class BaseClient(object):
         :param transaction: (optional) The transaction ID associated with this ACK.
         :type transaction: C{str}
         """
-        ack = frame.AckFrame(message_id, transaction, extra_headers=extra_headers)
+        if self.frame_pool is not None:
+            ack = self.frame_pool.ack_frame(message_id, transaction, extra_headers)
+        else:
+            ack = frame.AckFrame(message_id, transaction, extra_headers=extra_headers)
         return self.send_frame(ack)
     
     @abc.abstractmethod
@@ -194,14 +271,17 @@ class PublishClient(BaseClient):
     
     This client is ideally suited for use in a multi-threaded server environment, 
     since it can be used with a ThreadLocalConnection pool (since there is no need for a message-
-    receiving thread).
+    receiving thread).  With a :class:`stompclient.connection.BoundedConnectionPool`, the client
+    checks out a connection for each frame instead, so that many threads share a small number
+    of sockets.
     
     :ivar connection_pool: Object responsible for issuing STOMP connections (defaults to using
                             :class:`stompclient.connection.ThreadLocalConnectionPool` for this client impl).
     :type connection_pool: :class:`stompclient.connection.ConnectionPool`
     """
 
-    def __init__(self, host, port=61613, socket_timeout=None, connection_pool=None):
+    def __init__(self, host, port=61613, socket_timeout=None, connection_pool=None, compression=None,
+                 codecs=None, frame_pool=None):
         """
         Initialize STOMP client.
         
@@ -216,13 +296,74 @@ class PublishClient(BaseClient):
         
         :param connection_pool: A configured connection pool (defaults to :class:`ThreadLocalConnectionPool`).
         :type connection_pool: :class:`stompclient.connection.ConnectionPool`
+        
+        :param compression: (optional) Message body compression.
+        :type compression: :class:`stompclient.compression.ZlibCompression`
+        
+        :param codecs: (optional) The codec registry.
+        :type codecs: :class:`stompclient.codec.CodecRegistry`
+        
+        :param frame_pool: (optional) A pool of reusable SEND and ACK frames.
+        :type frame_pool: :class:`stompclient.frame.FramePool`
         """
         connection_pool = connection_pool if connection_pool else ThreadLocalConnectionPool()
         super(PublishClient, self).__init__(host=host,
                                             port=port,
                                             socket_timeout=socket_timeout,
-                                            connection_pool=connection_pool)
+                                            connection_pool=connection_pool,
+                                            compression=compression,
+                                            codecs=codecs,
+                                            frame_pool=frame_pool)
 
+    def connect(self, login=None, passcode=None, extra_headers=None, heart_beat=None):
+        """
+        Send CONNECT frame to the STOMP server.
+        
+        With a :class:`stompclient.connection.BoundedConnectionPool`, the CONNECT frame is sent
+        on every pooled connection as it connects (and the pool's `min_connections`, or at least
+        one connection, are opened immediately).
+        
+        :param heart_beat: (optional) The heart-beat intervals to request, in milliseconds.  
+                            Since this client does not read from the connection, only the 
+                            interval at which the client sends heart-beats is requested (the 
+                            second interval is sent as 0), and the CONNECTED frame is read
+                            to negotiate it.  The application must then call the connection's
+                            :meth:`stompclient.connection.Connection.heartbeat` method 
+                            periodically while idle (or, with a bounded pool, the pool's
+                            :meth:`stompclient.connection.BoundedConnectionPool.heartbeat`
+                            method).
+        :type heart_beat: `tuple` of `int`
+        
+        :return: The CONNECTED frame, if heart-beats were requested.
+        :rtype: :class:`stompclient.frame.Frame`
+        """
+        if heart_beat is not None:
+            # The server's heart-beats would never be read.
+            heart_beat = (heart_beat[0], 0)
+        pool = self.connection_pool
+        if not isinstance(pool, BoundedConnectionPool):
+            super(PublishClient, self).connect(login, passcode, extra_headers=extra_headers,
+                                               heart_beat=heart_beat)
+            if heart_beat is not None:
+                return self.connection.read_connected()
+            return
+        connect = frame.ConnectFrame(login, passcode, extra_headers=extra_headers, heart_beat=heart_beat)
+        pool.set_connect_frame(self.host, self.port, connect)
+        with pool.connection(self.host, self.port, self.socket_timeout):
+            pass
+    
+    def disconnect(self, conf=None, extra_headers=None):
+        """
+        Disconnect from the server.
+        
+        With a :class:`stompclient.connection.BoundedConnectionPool`, the idle pooled
+        connections are disconnected.
+        """
+        pool = self.connection_pool
+        if not isinstance(pool, BoundedConnectionPool):
+            return super(PublishClient, self).disconnect(conf, extra_headers=extra_headers)
+        pool.close(self.host, self.port, frame.DisconnectFrame(extra_headers=extra_headers))
+    
     def subscribe(self, destination, extra_headers=None):
         """
         Subscribe to a given destination.
@@ -257,6 +398,17 @@ class PublishClient(BaseClient):
         if 'receipt' in frame.headers:
             raise NotImplementedError('%s client implementation does not support message receipts.' % (self.__class__,))
         
+        pool = self.connection_pool
+        if isinstance(pool, BoundedConnectionPool):
+            try:
+                with pool.connection(self.host, self.port, self.socket_timeout) as connection:
+                    connection.send(frame)
+            except ConnectionError:
+                # The failed connection has been discarded; retry with another one.
+                with pool.connection(self.host, self.port, self.socket_timeout) as connection:
+                    connection.send(frame)
+            return
+        
         try:
             self.connection.send(frame)
         except ConnectionError:
@@ -2,6 +2,7 @@
 Utilities for working with mock objects.
 """
 import socket
+import select
 
 from mock import Mock
 
@@ -28,6 +29,7 @@ class MockingConnectionPool(object):
     
     def __init__(self):
         self.connection = Mock(spec=Connection)
+        self.connection.buffer_options = {}
 
     def get_connection(self, host, port, socket_timeout=None):
         """
@@ -46,9 +48,63 @@ class MockingSocketModule(object):
     """
     def __init__(self):
         self.mocksocket = Mock(spec=socket._socketobject)
+        self.mocksocket.recv_into.side_effect = self.recv_into
+        self.unread = ''
         
     def socket(self, *args, **kwargs):
         return self.mocksocket
     
+    def recv_into(self, buf, nbytes=0, flags=0):
+        """
+        Implements C{recv_into} for the mock socket using the (mocked) C{recv} method.
+        
+        Any data returned by C{recv} that does not fit is returned by the next call.
+        """
+        nbytes = nbytes or len(buf)
+        if not self.unread:
+            self.unread = self.mocksocket.recv(nbytes)
+        data = self.unread[:nbytes]
+        self.unread = self.unread[nbytes:]
+        buf[:len(data)] = data
+        return len(data)
+    
     def __getattr__(self, name):
-        return getattr(socket, name)
\ No newline at end of file
+        return getattr(socket, name)
+
+class MockingSelectModule(object):
+    """
+    A class that replaces the C{select} module; sockets are reported as readable while the 
+    L{MockingSocketModule} has unread data (or never, if no socket module is specified).
+    """
+    def __init__(self, socketmodule):
+        self.socketmodule = socketmodule
+    
+    POLLIN = select.POLLIN
+    
+    def select(self, rlist, wlist, xlist, timeout=None):
+        if self.socketmodule is not None and self.socketmodule.unread:
+            return (rlist, [], [])
+        else:
+            return ([], [], [])
+    
+    def poll(self):
+        return MockingPollObject(self)
+
+class MockingPollObject(object):
+    """
+    A C{select.poll} object of the L{MockingSelectModule}, which reports the registered
+    descriptors in the same way as its C{select} method.
+    """
+    def __init__(self, selectmodule):
+        self.selectmodule = selectmodule
+        self.fds = []
+    
+    def register(self, fd, eventmask=None):
+        self.fds.append(fd)
+    
+    def unregister(self, fd):
+        self.fds.remove(fd)
+    
+    def poll(self, timeout=None):
+        (readable, _, _) = self.selectmodule.select(self.fds, [], [], timeout)
+        return [(fd, self.selectmodule.POLLIN) for fd in readable]
\ No newline at end of file
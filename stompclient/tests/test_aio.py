@@ -0,0 +1,215 @@
+"""
+Tests for the event loop clients (these require trollius).
+"""
+import unittest
+from unittest import TestCase
+
+try:
+    import trollius as asyncio
+    from trollius import From, Return
+except ImportError:
+    asyncio = None
+else:
+    from stompclient.aio import AsyncPublishClient, AsyncPublishSubscribeClient
+
+from stompclient.util import FrameBuffer
+from stompclient.exceptions import ConnectionError, FrameError
+from stompclient import frame
+
+__authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
+__copyright__ = "Copyright 2010 Hans Lellelid"
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+class MockServerProtocol(object):
+    """ A minimal STOMP server that records received frames and answers CONNECT and receipts. """
+
+    def __init__(self, server):
+        self.server = server
+        self.buffer = FrameBuffer()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections.append(self)
+
+    def data_received(self, data):
+        self.buffer.append(data)
+        for f in self.buffer.extract_frames():
+            self.server.received.append(f)
+            if f.command == 'CONNECT':
+                if f.get_header('login') == 'bad':
+                    self.send(frame.ErrorFrame('Bad login'))
+                else:
+                    self.send(frame.ConnectedFrame('session-1'))
+            elif f.receipt is not None:
+                self.send(frame.ReceiptFrame(f.receipt))
+
+    def send(self, f):
+        self.transport.write(f.pack())
+
+    def eof_received(self):
+        pass
+
+    def connection_lost(self, exc):
+        pass
+
+    def pause_writing(self):
+        pass
+
+    def resume_writing(self):
+        pass
+
+@unittest.skipIf(asyncio is None, "trollius is not installed")
+class AsyncClientTest(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.received = []
+        self.connections = []
+        self.server = self.loop.run_until_complete(
+            self.loop.create_server(lambda: MockServerProtocol(self), '127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def run_coroutine(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5.0, loop=self.loop))
+
+    def commands(self):
+        return [f.command for f in self.received]
+
+    def test_publish(self):
+        """ Test sending frames with the publish-only client. """
+        client = AsyncPublishClient('127.0.0.1', self.port, loop=self.loop)
+
+        @asyncio.coroutine
+        def publish():
+            yield From(client.connect())
+            for i in range(10):
+                yield From(client.send('/queue/test', 'body %d' % i))
+            yield From(client.send('/queue/test', {'a': 1}, codec='json'))
+            yield From(client.disconnect())
+            yield From(asyncio.sleep(0.1, loop=self.loop))
+
+        self.run_coroutine(publish())
+        self.assertEquals(['CONNECT'] + ['SEND'] * 11 + ['DISCONNECT'], self.commands())
+        self.assertEquals(['body %d' % i for i in range(10)], [f.body for f in self.received[1:11]])
+        self.assertEquals('application/json', self.received[11].get_header('content-type'))
+        self.assertFalse(client.connection.connected)
+        self.assertRaises(NotImplementedError, client.send, '/queue/test', 'x', extra_headers={'receipt': '1'})
+
+    def test_connect_error(self):
+        """ Test connection failures. """
+        client = AsyncPublishSubscribeClient('127.0.0.1', self.port, loop=self.loop)
+        self.assertRaises(FrameError, self.run_coroutine, client.connect(login='bad'))
+
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        client = AsyncPublishClient('127.0.0.1', self.port, loop=self.loop)
+        self.assertRaises(ConnectionError, self.run_coroutine, client.connect())
+
+    def test_receipts(self):
+        """ Test awaiting receipts. """
+        client = AsyncPublishSubscribeClient('127.0.0.1', self.port, loop=self.loop)
+
+        @asyncio.coroutine
+        def send():
+            connected = yield From(client.connect())
+            futures = [client.send('/queue/test', 'body', extra_headers={'receipt': 'r%d' % i})
+                       for i in range(3)]
+            receipts = yield From(asyncio.gather(*futures, loop=self.loop))
+            raise Return((connected, receipts))
+
+        (connected, receipts) = self.run_coroutine(send())
+        self.assertEquals('CONNECTED', connected.command)
+        self.assertEquals('session-1', client.session)
+        self.assertEquals(['r0', 'r1', 'r2'], [r.receipt_id for r in receipts])
+        self.assertEquals({}, client._receipts)
+
+    def test_receipt_flow_control(self):
+        """ Test that receipted sends also wait until the transport can accept more data. """
+        client = AsyncPublishSubscribeClient('127.0.0.1', self.port, loop=self.loop)
+
+        @asyncio.coroutine
+        def send():
+            yield From(client.connect())
+            client.connection.pause_writing()
+            future = client.send('/queue/test', 'body', extra_headers={'receipt': 'r0'})
+            yield From(asyncio.sleep(0.1, loop=self.loop))
+            # The receipt has been received, but the transport has not drained.
+            self.assertEquals({}, client._receipts)
+            self.assertFalse(future.done())
+            client.connection.resume_writing()
+            receipt = yield From(future)
+            raise Return(receipt)
+
+        self.assertEquals('r0', self.run_coroutine(send()).receipt_id)
+        self.assertEquals({}, client._receipts)
+
+    def test_subscribe(self):
+        """ Test receiving messages from subscriptions. """
+        client = AsyncPublishSubscribeClient('127.0.0.1', self.port, loop=self.loop)
+
+        @asyncio.coroutine
+        def consume():
+            yield From(client.connect())
+            sub1 = yield From(client.subscribe('/queue/1'))
+            sub2 = yield From(client.subscribe('/queue/2', decode=True))
+            server = self.connections[0]
+            server.send(frame.MessageFrame('/queue/1', 'a'))
+            server.send(frame.MessageFrame('/queue/2', '[1,2]', extra_headers={'content-type': 'application/json'}))
+            server.send(frame.MessageFrame('/queue/3', 'ignored'))
+            server.send(frame.MessageFrame('/queue/1', 'b'))
+
+            first = yield From(sub1.get())
+            second = yield From(sub1.get())
+            (decoded_frame, payload) = yield From(sub2.get())
+
+            yield From(client.unsubscribe('/queue/1'))
+            end = yield From(sub1.get())
+            raise Return(([first.body, second.body], payload, end, sub2))
+
+        (bodies, payload, end, sub2) = self.run_coroutine(consume())
+        self.assertEquals(['a', 'b'], bodies)
+        self.assertEquals([1, 2], payload)
+        self.assertEquals(None, end)
+        self.assertEquals(['/queue/2'], client.subscribed_destinations.keys())
+
+        # Subscriptions are closed when the connection is lost.
+        self.connections[0].transport.close()
+        self.assertEquals(None, self.run_coroutine(sub2.get()))
+        self.assertEquals({}, client.subscribed_destinations)
+        self.assertFalse(client.connection.connected)
+
+    def test_escape_headers(self):
+        """ Test that header values are escaped in sent frames and unescaped in received frames. """
+        client = AsyncPublishSubscribeClient('127.0.0.1', self.port, loop=self.loop,
+                                             connection_options={'escape_headers': True})
+
+        @asyncio.coroutine
+        def consume():
+            yield From(client.connect())
+            sub = yield From(client.subscribe('/queue/1'))
+            yield From(client.send('/queue/1', 'body', extra_headers={'note': 'a:b\nc'}))
+            server = self.connections[0]
+            server.transport.write(frame.MessageFrame('/queue/1', 'a', 
+                                                      extra_headers={'note': 'x:y\nz'}).pack(escape=True))
+            message = yield From(sub.get())
+            raise Return(message)
+
+        message = self.run_coroutine(consume())
+        self.assertEquals('x:y\nz', message.get_header('note'))
+        # The mock server does not unescape.
+        self.assertEquals('a\\cb\\nc', self.received[-1].get_header('note'))
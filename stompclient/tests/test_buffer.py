@@ -1,11 +1,14 @@
 """
 Test the FrameBuffer utility class.
 """
+import mmap
 import unittest
 import uuid
 
-from stompclient.frame import Frame
+from stompclient import frame
+from stompclient.frame import Frame, LazyFrame
 from stompclient.util import FrameBuffer
+from stompclient.exceptions import FrameError, FrameSizeError
 
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
 __copyright__ = "Copyright 2010 Hans Lellelid"
@@ -145,4 +148,388 @@ class TestFrameBuffer(unittest.TestCase):
         
         assert idx == 2
     
-    
\ No newline at end of file
+    def test_compaction(self):
+        """ Test that consumed bytes are discarded without disturbing buffered data. """
+        sb = FrameBuffer()
+        sb.compact_threshold = 64
+        m = 'SEND\ndestination:/queue/test\n\n0123456789\x00'
+        for i in range(50):
+            sb.append(m + m[:10])
+            f = sb.extract_frame()
+            assert f.command == 'SEND'
+            assert f.body == '0123456789'
+            sb.append(m[10:])
+            f = sb.extract_frame()
+            assert f.body == '0123456789'
+            assert sb.extract_frame() is None
+            assert sb.buffer_empty()
+        
+        sb.append(m * 20)
+        assert sb.buffer_len() == len(m) * 20
+        frames = list(sb)
+        assert len(frames) == 20
+        assert sb.buffer_len() == 0
+        assert len(sb.buffer) == 0
+    
+    def test_extract_frame_large(self):
+        """ Test a large body arriving in many small chunks. """
+        sb = FrameBuffer()
+        sb.shrink_threshold = 4096
+        body = 'x' * 100000
+        m1 = self.createMessage('send', {'destination': '/queue/test'}, body)
+        for i in range(0, len(m1), 1000):
+            sb.append(m1[i:i + 1000])
+        f = sb.extract_frame()
+        assert f.body == body
+        assert sb.buffer_empty()
+        assert len(sb.buffer) == 0
+    
+    def test_sync_buffer(self):
+        """ Test that leading garbage is discarded up to the next frame boundary. """
+        sb = FrameBuffer()
+        sb.append('BUNK\nJUNK\x00SEND\ndestination:/queue/test\n\nbody\x00')
+        f = sb.extract_frame()
+        assert f.command == 'SEND'
+        assert f.body == 'body'
+        assert sb.buffer_empty()
+        assert sb.resync_count == 1
+        assert sb.discarded_bytes == 10
+        
+        sb.append('\n\nGARBAGE\nmore garbage')
+        assert sb.extract_frame() is None
+        assert sb.buffer_empty()
+        assert sb.resync_count == 2
+        assert sb.discarded_bytes == 30
+        
+        # Bodies are never inspected for commands
+        sb.append('SEND\ndestination:/queue/test\n\nBUNK\nbody')
+        assert sb.extract_frame() is None
+        sb.append('\x00')
+        f = sb.extract_frame()
+        assert f.body == 'BUNK\nbody'
+        assert sb.resync_count == 2
+    
+    def test_extract_frame_byte_at_a_time(self):
+        """ Test frames delivered one byte at a time (boundaries split across appends). """
+        m1 = 'SEND\ncontent-length:4\ndestination:/queue/test\n\n\x00\x00\x00\x00\x00'
+        m2 = 'SEND\ndestination:/queue/test\n\n0123456789\x00'
+        sb = FrameBuffer()
+        frames = []
+        for c in m1 + m2:
+            sb.append(c)
+            f = sb.extract_frame()
+            if f:
+                frames.append(f)
+        assert len(frames) == 2
+        assert frames[0].body == '\x00\x00\x00\x00'
+        assert frames[1].body == '0123456789'
+        assert sb.buffer_empty()
+    
+    def test_extract_frames(self):
+        """ Test extracting all complete frames at once. """
+        sb = FrameBuffer()
+        m = 'SEND\ndestination:/queue/test\n\n0123456789\x00\n'
+        sb.append(m * 5 + m[:12])
+        
+        frames = sb.extract_frames(2)
+        assert len(frames) == 2
+        frames = sb.extract_frames()
+        assert len(frames) == 3
+        assert [f.body for f in frames] == ['0123456789'] * 3
+        assert sb.extract_frames() == []
+        
+        sb.append(m[12:])
+        frames = sb.extract_frames()
+        assert len(frames) == 1
+    
+    def test_lazy_headers(self):
+        """ Test extracting frames with lazily-parsed headers. """
+        sb = FrameBuffer(lazy_headers=True)
+        sb.append('MESSAGE\ndestination:/queue/test\nmessage-id: id-1 \nx-other : value\n\nbody\x00')
+        f = sb.extract_frame()
+        assert isinstance(f, LazyFrame)
+        assert f.command == 'MESSAGE'
+        assert f.body == 'body'
+        assert f.destination == '/queue/test'
+        assert f.message_id == 'id-1'
+        assert f._headers is None
+        assert f.x_other == 'value'
+        assert f.headers == {'destination': '/queue/test', 'message-id': 'id-1', 'x-other': 'value'}
+        assert f.missing is None
+        
+        f.headers = {'destination': '/queue/other'}
+        assert f.destination == '/queue/other'
+        assert f.message_id is None
+    
+    def test_zero_copy(self):
+        """ Test that zero-copy bodies are views that remain valid as more data arrives. """
+        sb = FrameBuffer(zero_copy=True)
+        m1 = 'SEND\ndestination:/queue/test\n\n0123456789\x00'
+        m2 = 'SEND\ncontent-length:5\ndestination:/queue/test\n\nab\x00cd\x00'
+        sb.append(m1 + m2 + m1[:10])
+        f1 = sb.extract_frame()
+        f2 = sb.extract_frame()
+        assert isinstance(f1.body, memoryview)
+        assert f1.body.readonly
+        assert f1.body.tobytes() == '0123456789'
+        assert f2.body.tobytes() == 'ab\x00cd'
+        assert sb.extract_frame() is None
+        
+        # The views must not be disturbed by further appends
+        sb.append(m1[10:] + m1)
+        for f in sb.extract_frames():
+            assert f.body.tobytes() == '0123456789'
+        assert sb.buffer_empty()
+        sb.append('X' * 1000)
+        assert f1.body.tobytes() == '0123456789'
+        assert f2.body.tobytes() == 'ab\x00cd'
+        assert f2.pack() == 'SEND\ncontent-length:5\ndestination:/queue/test\n\nab\x00cd\x00'
+    
+    def test_size_limits(self):
+        """ Test that frames exceeding the size limits are rejected and skipped. """
+        m = 'SEND\ndestination:/queue/test\n\n0123456789\x00'
+        big_cl = 'SEND\ncontent-length:20\ndestination:/queue/test\n\n' + 'x' * 20 + '\x00'
+        big_nocl = 'SEND\ndestination:/queue/test\n\n' + 'x' * 20 + '\x00'
+        
+        sb = FrameBuffer(max_body_size=10)
+        sb.append(m + big_cl[:50])
+        frames = sb.extract_frames()
+        assert len(frames) == 1
+        self.assertRaises(FrameSizeError, sb.extract_frame)
+        assert sb.buffer_empty()
+        # The remainder of the oversized frame is discarded as it arrives
+        sb.append(big_cl[50:] + m)
+        assert sb.buffer_len() == len(m)
+        assert sb.extract_frame().body == '0123456789'
+        
+        sb.append(big_nocl[:45])
+        self.assertRaises(FrameSizeError, sb.extract_frame)
+        sb.append(big_nocl[45:] + m)
+        assert sb.extract_frame().body == '0123456789'
+        assert sb.skipped_frames == 2
+        
+        sb = FrameBuffer(max_header_size=20)
+        sb.append('SEND\ndestination:/queue/test/with/a/long/name')
+        self.assertRaises(FrameSizeError, sb.extract_frame)
+        sb.append('\n\nbody\x00' + m[:5])
+        assert sb.extract_frame() is None
+        
+        sb = FrameBuffer(max_buffer_size=30, skip_oversized=True)
+        sb.append(big_nocl[:40])
+        assert sb.extract_frame() is None
+        sb.append(big_nocl[40:] + m)
+        frames = sb.extract_frames()
+        assert len(frames) == 1
+        assert frames[0].body == '0123456789'
+        assert sb.skipped_frames == 1
+    
+    def test_spool(self):
+        """ Test spooling large bodies to a temporary file. """
+        sb = FrameBuffer(spool_threshold=100)
+        body = ''.join([chr(i % 256) for i in range(5000)])
+        m1 = self.createMessage('send', {'destination': '/queue/test'}, body)
+        m2 = 'SEND\ndestination:/queue/test\n\n0123456789\x00'
+        data = m2 + m1 + m2
+        frames = []
+        for i in range(0, len(data), 700):
+            sb.append(data[i:i + 700])
+            frames.extend(sb.extract_frames())
+            assert sb.buffer_len() < 700
+        assert len(frames) == 3
+        f = frames[1]
+        assert isinstance(f.body, mmap.mmap)
+        assert f.destination == '/queue/test'
+        assert len(f.body) == 5000
+        assert f.body[:] == body
+        assert f.pack() == m1
+        assert frames[2].body == '0123456789'
+        assert sb.buffer_empty()
+        
+        # A body received all at once is spooled too
+        sb.append(m1)
+        f = sb.extract_frame()
+        assert isinstance(f.body, mmap.mmap)
+        assert f.body[:] == body
+    
+    def test_bad_terminator(self):
+        """ Test that a frame whose content-length body is not followed by a null byte is dropped. """
+        good = 'SEND\ndestination:/queue/test\n\n0123456789\x00'
+        bad = 'SEND\ndestination:/queue/test\ncontent-length:%d\n\n%sX\x00'
+        for (threshold, body) in [(None, 'short'), (100, 'x' * 200)]:
+            sb = FrameBuffer(spool_threshold=threshold)
+            sb.append(good + bad % (len(body), body) + good)
+            # The frame extracted before the error is returned first.
+            frames = sb.extract_frames()
+            assert [f.body for f in frames] == ['0123456789']
+            self.assertRaises(FrameError, sb.extract_frames)
+            frames = sb.extract_frames()
+            assert [f.body for f in frames] == ['0123456789']
+            assert sb.resync_count == 1
+            assert sb.buffer_empty()
+    
+    def test_header_accessors(self):
+        """ Test the header accessors of extracted (eager and lazy) frames. """
+        m = 'MESSAGE\ndestination:/queue/test\nmessage-id:id-1\nreceipt:r-1\nx-other:value\n\nbody\x00'
+        for lazy in (False, True):
+            sb = FrameBuffer(lazy_headers=lazy)
+            sb.append(m)
+            f = sb.extract_frame()
+            assert not hasattr(f, '__dict__')
+            assert f.destination == '/queue/test'
+            assert f.message_id == 'id-1'
+            assert f.receipt == 'r-1'
+            assert f.receipt_id is None
+            assert f.get_header('x-other') == 'value'
+            assert f.get_header('x-missing', 'default') == 'default'
+            assert f.x_other == 'value'
+            f.destination = '/queue/other'
+            assert f.headers['destination'] == '/queue/other'
+            # Assigning None removes the header rather than storing None in the headers.
+            f.receipt = None
+            assert f.receipt is None
+            assert 'receipt' not in f.headers
+            assert '\nreceipt:' not in f.pack()
+            f.receipt_id = None
+            assert 'receipt-id' not in f.headers
+    
+    def test_trusted_frames(self):
+        """ Test that extracted frames use the interned command constants. """
+        m = '\nMESSAGE\ndestination:/queue/test\n\nbody\x00RECEIPT\nreceipt-id:r-1\n\n\x00'
+        for lazy in (False, True):
+            sb = FrameBuffer(lazy_headers=lazy)
+            sb.append(m)
+            (f1, f2) = sb.extract_frames()
+            assert f1.command is frame.MESSAGE
+            assert f1.headers == {'destination': '/queue/test'}
+            assert f1.body == 'body'
+            assert f2.command is frame.RECEIPT
+            assert f2.receipt_id == 'r-1'
+        
+        f = Frame('message')
+        assert f.command == frame.MESSAGE
+        self.assertRaises(FrameError, Frame, 'BUNK')
+    
+    def test_intern_headers(self):
+        """ Test interning of header keys and values. """
+        def message(dest, msgid):
+            return 'MESSAGE\ndestination:%s\nmessage-id:%s\n\nbody\x00' % (dest, msgid)
+        
+        sb = FrameBuffer(intern_headers=('destination',), intern_table_size=4)
+        sb.append(message('/queue/a', 'id-1'))
+        sb.append(message('/queue/a', 'id-2'))
+        (f1, f2) = sb.extract_frames()
+        assert f1.headers == {'destination': '/queue/a', 'message-id': 'id-1'}
+        assert f1.destination is f2.destination
+        assert f1.message_id == 'id-1' and f2.message_id == 'id-2'
+        (k1, k2) = [[k for k in f.headers if k == 'message-id'][0] for f in (f1, f2)]
+        assert k1 is k2
+        assert len(sb.intern_table) == 3
+        
+        # Once the table is full, new values are no longer shared (but still parsed).
+        sb.append(message('/queue/b', 'id-3'))
+        sb.append(message('/queue/c', 'id-4'))
+        sb.append(message('/queue/c', 'id-5'))
+        (f3, f4, f5) = sb.extract_frames()
+        assert len(sb.intern_table) == 4
+        assert f3.destination == '/queue/b'
+        assert f4.destination == f5.destination == '/queue/c'
+        assert f4.destination is not f5.destination
+    
+    def test_unescape_headers(self):
+        """ Test parsing of STOMP 1.1 escaped headers. """
+        headers = {'x-path': 'c:\\temp\\new', 'x-space': ' padded '}
+        packed = frame.SendFrame('/queue/a:b', body='body', extra_headers=headers).pack(escape=True)
+        assert 'x-path:c\\cnew' not in packed
+        assert 'x-path:c\\c\\\\temp\\\\new' in packed
+        plain = frame.SendFrame('/queue/test', body='body').pack(escape=True)
+        assert plain == frame.SendFrame('/queue/test', body='body').pack()
+        for lazy in (False, True):
+            sb = FrameBuffer(lazy_headers=lazy, unescape_headers=True)
+            sb.append(packed)
+            f = sb.extract_frame()
+            assert f.destination == '/queue/a:b'
+            assert f.x_space == ' padded '
+            assert f.headers['x-path'] == 'c:\\temp\\new'
+            
+            sb.append('MESSAGE\ndestination:/queue/first\ndestination:/queue/second\n\n\x00')
+            assert sb.extract_frame().destination == '/queue/first'
+            
+            sb.append('MESSAGE\nx-bad:\\t\n\n\x00')
+            self.assertRaises(FrameError, lambda: sb.extract_frame().headers)
+        
+        prepared = frame.PreparedSend('/queue/a:b')
+        assert '\ndestination:/queue/a\\cb\n' in prepared.frame('body').pack(escape=True)
+        assert '\ndestination:/queue/a:b\n' in prepared.frame('body').pack()
+        
+        # CONNECT and CONNECTED frames are never escaped.
+        packed = frame.ConnectFrame(extra_headers={'passcode': 'a:b'}).pack(escape=True)
+        assert '\npasscode:a:b\n' in packed
+        sb = FrameBuffer(unescape_headers=True)
+        sb.append('CONNECTED\nsession:a\\b\n\n\x00')
+        assert sb.extract_frame().headers == {'session': 'a\\b'}
+    
+    def test_pack_buffers(self):
+        """ Test packing frames with buffer-protocol bodies into separate parts. """
+        import array
+        bodies = [bytearray('body'), memoryview('body'), buffer('body'), array.array('c', 'body'),
+                  array.array('i', [1, 2])]
+        for body in bodies:
+            if isinstance(body, memoryview):
+                expected = body.tobytes()
+            else:
+                expected = str(buffer(body))
+            f = frame.SendFrame('/queue/test', body=body)
+            (header, fbody, terminator) = f.pack_buffers()
+            assert fbody is body
+            assert terminator == '\x00'
+            packed = header + expected + terminator
+            assert packed == f.pack()
+            
+            sb = FrameBuffer()
+            sb.append(packed)
+            assert sb.extract_frame().body == expected
+        
+        (header, _, _) = frame.SendFrame('/queue/test', body=array.array('i', [1, 2])).pack_buffers()
+        assert '\ncontent-length:%d\n' % (2 * array.array('i').itemsize) in header
+        
+        prepared = frame.PreparedSend('/queue/test')
+        assert ''.join(prepared.frame('body').pack_buffers()) == prepared.pack('body')
+    
+    def test_pack_unicode(self):
+        """ Test that unicode bodies are packed as UTF-8. """
+        f = frame.SendFrame('/queue/test', body=u'hello')
+        assert f.pack() == 'SEND\ncontent-length:5\ndestination:/queue/test\n\nhello\x00'
+        
+        body = u'caf\xe9'
+        packed = frame.SendFrame('/queue/test', body=body).pack()
+        assert '\ncontent-length:5\n' in packed
+        sb = FrameBuffer()
+        sb.append(packed)
+        assert sb.extract_frame().body.decode('utf-8') == body
+        
+        sb.append(frame.PreparedSend('/queue/test').pack(body))
+        assert sb.extract_frame().body == 'caf\xc3\xa9'
+        
+        # The parts carry the encoded body and its byte length.
+        (header, fbody, terminator) = frame.SendFrame('/queue/test', body=body).pack_buffers()
+        assert fbody == 'caf\xc3\xa9'
+        assert header + fbody + terminator == packed
+        assert ''.join(frame.PreparedSend('/queue/test').pack_buffers(body)) == frame.PreparedSend('/queue/test').pack(body)
+    
+    def test_bytes_needed(self):
+        """ Test reporting the missing bytes of a partially received frame. """
+        packed = str(frame.MessageFrame('/queue/test', body='x' * 1000))
+        sb = FrameBuffer()
+        sb.append(memoryview(bytearray(packed[:200])))
+        assert sb.bytes_needed() == 0 # the header has not been scanned yet
+        assert sb.extract_frame() is None
+        assert sb.bytes_needed() == len(packed) - 200
+        sb.append(memoryview(packed)[200:])
+        assert sb.bytes_needed() == 0
+        assert sb.extract_frame().body == 'x' * 1000
+        
+        sb = FrameBuffer(max_body_size=10, skip_oversized=True)
+        sb.append(packed[:200])
+        assert sb.extract_frame() is None
+        sb.append(memoryview(packed[200:] + 'MESSAGE\n\nok\x00'))
+        assert sb.extract_frame().body == 'ok'
@@ -0,0 +1,99 @@
+"""
+Tests for message body codecs.
+"""
+import datetime
+import threading
+from unittest import TestCase
+
+from stompclient import frame
+from stompclient.codec import CodecRegistry, Codec, JSONCodec, PickleCodec
+
+__authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
+__copyright__ = "Copyright 2010 Hans Lellelid"
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+ 
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+class UpperCodec(Codec):
+    name = 'upper'
+    content_type = 'text/x-upper'
+    
+    def encode(self, obj):
+        return obj.upper()
+    
+    def decode(self, body):
+        return str(body).lower()
+
+class CodecRegistryTest(TestCase):
+    
+    def test_round_trip(self):
+        """ Test encoding and decoding with the JSON and pickle codecs. """
+        registry = CodecRegistry([JSONCodec(), PickleCodec()])
+        payload = {'key': 'value', 'list': [1, 2, 3]}
+        for name in ('json', 'pickle'):
+            (body, content_type) = registry.encode(name, payload)
+            assert isinstance(body, str)
+            f = frame.MessageFrame('/queue/test', body=body, extra_headers={'content-type': content_type})
+            self.assertEquals(payload, registry.decode_frame(f))
+            self.assertEquals(1, registry.stats[name].encoded)
+            self.assertEquals(1, registry.stats[name].decoded)
+        
+        self.assertRaises(KeyError, registry.encode, 'bunk', payload)
+    
+    def test_default_excludes_pickle(self):
+        """ Test that the default registry does not unpickle pickle-typed messages. """
+        registry = CodecRegistry()
+        body = PickleCodec().encode({'key': 'value'})
+        f = frame.MessageFrame('/queue/test', body=body,
+                               extra_headers={'content-type': PickleCodec.content_type})
+        self.assertEquals(body, registry.decode_frame(f))
+        assert 'pickle' not in registry.stats
+        self.assertRaises(KeyError, registry.encode, 'pickle', {'key': 'value'})
+    
+    def test_stats_threads(self):
+        """ Test that the counters are exact when the registry is shared by threads. """
+        registry = CodecRegistry()
+        f = frame.MessageFrame('/queue/test', body='[1]', extra_headers={'content-type': 'application/json'})
+        def work():
+            for i in range(1000):
+                registry.encode('json', [i])
+                registry.decode_frame(f)
+        threads = [threading.Thread(target=work) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals(8000, registry.stats['json'].encoded)
+        self.assertEquals(8000, registry.stats['json'].decoded)
+    
+    def test_pickle_reuse(self):
+        """ Test that the reused pickler does not leak state between messages. """
+        codec = PickleCodec()
+        obj = {'date': datetime.datetime(2010, 1, 1)}
+        first = codec.encode(obj)
+        second = codec.encode(obj)
+        self.assertEquals(first, second)
+        self.assertEquals(obj, codec.decode(bytearray(second)))
+        self.assertEquals([1], codec.decode(codec.encode([1])))
+    
+    def test_content_type_lookup(self):
+        """ Test codec lookup by content-type and registration of custom codecs. """
+        registry = CodecRegistry([JSONCodec()])
+        assert isinstance(registry.for_content_type('application/json; charset=utf-8'), JSONCodec)
+        assert registry.for_content_type('application/x-python-pickle') is None
+        
+        registry.register(UpperCodec())
+        self.assertEquals(('HELLO', 'text/x-upper'), registry.encode('upper', 'hello'))
+        
+        f = frame.MessageFrame('/queue/test', body='HELLO', extra_headers={'content-type': 'text/x-upper'})
+        self.assertEquals('hello', registry.decode_frame(f))
+        f = frame.MessageFrame('/queue/test', body='HELLO')
+        self.assertEquals('HELLO', registry.decode_frame(f))
@@ -0,0 +1,88 @@
+"""
+Tests for message body compression.
+"""
+import os
+import zlib
+from unittest import TestCase
+
+from stompclient import frame
+from stompclient.compression import ZlibCompression
+from stompclient.exceptions import FrameError, FrameSizeError
+
+__authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
+__copyright__ = "Copyright 2010 Hans Lellelid"
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+ 
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+class ZlibCompressionTest(TestCase):
+    
+    def test_compress_frame(self):
+        """ Test that only large enough (compressible) bodies are compressed. """
+        compression = ZlibCompression(threshold=100, level=9)
+        body = '{"key": "value"}' * 100
+        
+        f = frame.SendFrame('/queue/test', body=body)
+        self.assertTrue(compression.compress_frame(f))
+        self.assertEquals('zlib', f.headers['content-encoding'])
+        self.assertEquals(body, zlib.decompress(f.body))
+        
+        small = frame.SendFrame('/queue/test', body='{}')
+        self.assertFalse(compression.compress_frame(small))
+        assert 'content-encoding' not in small.headers
+        
+        # Already compressed (or incompressible) bodies are left alone.
+        incompressible = frame.SendFrame('/queue/test', body=os.urandom(1000))
+        self.assertFalse(compression.compress_frame(incompressible))
+        assert 'content-encoding' not in incompressible.headers
+        self.assertFalse(compression.compress_frame(f))
+        
+        stats = compression.stats
+        self.assertEquals(1, stats.compressed_frames)
+        self.assertEquals(len(body), stats.uncompressed_bytes)
+        self.assertEquals(len(f.body), stats.compressed_bytes)
+        assert stats.ratio < 0.1
+    
+    def test_decompress_frame(self):
+        """ Test decompression of received frames. """
+        compression = ZlibCompression()
+        body = 'x' * 1000
+        f = frame.MessageFrame('/queue/test', body=bytearray(zlib.compress(body)),
+                               extra_headers={'content-encoding': 'zlib', 'content-length': '12'})
+        self.assertTrue(compression.decompress_frame(f))
+        self.assertEquals(body, f.body)
+        self.assertEquals({'destination': '/queue/test', 'content-length': '1000'}, 
+                          dict((k, v) for (k, v) in f.headers.items() if k != 'message-id'))
+        self.assertFalse(compression.decompress_frame(f))
+        self.assertEquals(1, compression.stats.decompressed_frames)
+        
+        f = frame.MessageFrame('/queue/test', body='bunk', extra_headers={'content-encoding': 'zlib'})
+        self.assertRaises(FrameError, compression.decompress_frame, f)
+        
+        truncated = zlib.compress(body)[:-3]
+        f = frame.MessageFrame('/queue/test', body=truncated, extra_headers={'content-encoding': 'zlib'})
+        self.assertRaises(FrameError, compression.decompress_frame, f)
+    
+    def test_decompress_max_size(self):
+        """ Test that decompressed bodies are limited in size. """
+        compressed = zlib.compress('x' * 1000000)
+        compression = ZlibCompression(max_size=1000)
+        f = frame.MessageFrame('/queue/test', body=compressed, extra_headers={'content-encoding': 'zlib'})
+        self.assertRaises(FrameSizeError, compression.decompress_frame, f)
+        self.assertRaises(FrameSizeError, compression.decompress_frame, f, 999999)
+        
+        self.assertTrue(compression.decompress_frame(f, 1000000))
+        self.assertEquals(1000000, len(f.body))
+        
+        f = frame.MessageFrame('/queue/test', body=zlib.compress('x' * 1000), 
+                               extra_headers={'content-encoding': 'zlib'})
+        self.assertTrue(compression.decompress_frame(f))
+        self.assertEquals('x' * 1000, f.body)
@@ -1,16 +1,24 @@
+import os
+import time
+import resource
 import threading
 from Queue import Queue
 from unittest import TestCase
 import socket
 
+import select
+
 import mock
 
 import stompclient.connection
-from stompclient.connection import ThreadLocalConnectionPool, ConnectionPool, Connection
-from stompclient.exceptions import ConnectionError, ConnectionTimeoutError, NotConnectedError
+from stompclient.connection import ThreadLocalConnectionPool, ConnectionPool, BoundedConnectionPool, Connection, ReconnectingConnection
+from stompclient.simplex import PublishClient
+from stompclient.duplex import QueueingDuplexClient
+from stompclient.util import FrameBuffer
+from stompclient.exceptions import ConnectionError, ConnectionTimeoutError, NotConnectedError, FrameError, PoolTimeoutError
 from stompclient import frame
 
-from stompclient.tests.mockutil import MockingSocketModule
+from stompclient.tests.mockutil import MockingSocketModule, MockingSelectModule
 
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
 __copyright__ = "Copyright 2010 Hans Lellelid"
@@ -66,6 +74,13 @@ class ConnectionPoolTest(TestCase):
         assert c3.host == c2.host
         assert c3.port == c2.port
         
+    def test_connection_kwargs(self):
+        """ Test that pools pass extra arguments through to the connections. """
+        pool = ConnectionPool(buffer_options={'lazy_headers': True})
+        c1 = pool.get_connection('localhost', 1234)
+        assert c1.buffer_options == {'lazy_headers': True}
+        assert c1._buffer.lazy_headers
+        
         
 class ConnectionTest(TestCase):
     
@@ -73,8 +88,13 @@ class ConnectionTest(TestCase):
         #self.conn._sock = mock.Mock(spec=socket._socketobject)
         mocksocketmodule = MockingSocketModule()
         stompclient.connection.socket = mocksocketmodule
+        stompclient.connection.select = MockingSelectModule(mocksocketmodule)
         self.mocksocket = mocksocketmodule.mocksocket
     
+    def tearDown(self):
+        stompclient.connection.socket = socket
+        stompclient.connection.select = select
+    
     def test_connect(self):
         """ Test basic connection functionality. """
         conn = Connection('1.2.3.4', 61613)
@@ -149,4 +169,713 @@ class ConnectionTest(TestCase):
         
         self.assertTrue(self.mocksocket.connect.called)
         self.assertTrue(self.mocksocket.sendall.called)
-        
\ No newline at end of file
+            
+    def test_read_many(self):
+        """ Test reading all of the frames received in one socket read. """
+        conn = Connection('1.2.3.4', 61613)
+        frames = [frame.MessageFrame('/queue/test', body='Message %d' % i) for i in range(5)]
+        self.mocksocket.recv.side_effect = lambda len: ''.join([str(f) for f in frames])
+        
+        result = conn.read_many(2)
+        self.assertEquals([f.body for f in frames[:2]], [f.body for f in result])
+        result = conn.read()
+        self.assertEquals(frames[2].body, result.body)
+        result = conn.read_many()
+        self.assertEquals([f.body for f in frames[3:]], [f.body for f in result])
+        self.assertEquals(1, self.mocksocket.recv.call_count)
+        
+        result = conn.read_many()
+        self.assertEquals([f.body for f in frames], [f.body for f in result])
+        self.assertEquals(2, self.mocksocket.recv.call_count)
+    
+    def test_escape_headers(self):
+        """ Test STOMP 1.1 header escaping of sent and received frames. """
+        conn = Connection('1.2.3.4', 61613, escape_headers=True)
+        f = frame.SendFrame('/queue/a:b', body='body', extra_headers={'x-note': 'line1\nline2 '})
+        conn.send(f)
+        sent = self.mocksocket.sendall.call_args[0][0]
+        assert '\ndestination:/queue/a\\cb\n' in sent
+        assert '\nx-note:line1\\nline2 \n' in sent
+        
+        self.mocksocket.recv.side_effect = lambda len: sent
+        result = conn.read()
+        self.assertEquals('/queue/a:b', result.destination)
+        self.assertEquals('line1\nline2 ', result.headers['x-note'])
+        
+        conn = Connection('1.2.3.4', 61613)
+        conn.send(f)
+        assert '\ndestination:/queue/a:b\n' in self.mocksocket.sendall.call_args[0][0]
+    
+    def test_send_large_body(self):
+        """ Test that large (buffer-protocol) bodies are written without being packed. """
+        conn = Connection('1.2.3.4', 61613)
+        body = bytearray('x' * conn.gather_threshold)
+        f = frame.SendFrame('/queue/test', body=body)
+        conn.send(f)
+        parts = [c[0][0] for c in self.mocksocket.sendall.call_args_list]
+        self.assertEquals(3, len(parts))
+        assert parts[1] is body
+        self.assertEquals(f.pack(), ''.join([str(p) for p in parts]))
+        
+        self.mocksocket.reset_mock()
+        f = frame.SendFrame('/queue/test', body=bytearray('small'))
+        conn.send(f)
+        self.assertEquals([f.pack()], [c[0][0] for c in self.mocksocket.sendall.call_args_list])
+        
+        # The threshold applies to the bytes sent (unicode bodies are sent as UTF-8), not to
+        # len() of the body.
+        self.mocksocket.reset_mock()
+        body = u'\xe9' * (conn.gather_threshold // 2)
+        f = frame.SendFrame('/queue/test', body=body)
+        conn.send(f)
+        parts = [c[0][0] for c in self.mocksocket.sendall.call_args_list]
+        self.assertEquals(3, len(parts))
+        self.assertEquals(body.encode('utf-8'), parts[1])
+        self.assertEquals(f.pack(), ''.join(parts))
+        
+        self.mocksocket.reset_mock()
+        f = frame.SendFrame('/queue/test', body=u'x' * (conn.gather_threshold // 2))
+        conn.send(f)
+        self.assertEquals([f.pack()], [c[0][0] for c in self.mocksocket.sendall.call_args_list])
+    
+    def test_buffered_writes(self):
+        """ Test that frames are coalesced into a single write in buffered-write mode. """
+        conn = Connection('1.2.3.4', 61613, flush_frames=3, flush_bytes=4096)
+        frames = [frame.SendFrame('/queue/test', body='Message %d' % i) for i in range(4)]
+        for f in frames[:2]:
+            conn.send(f)
+        self.assertFalse(self.mocksocket.sendall.called)
+        conn.send(frames[2])
+        self.assertEquals([((''.join([str(f) for f in frames[:3]]),), {})], 
+                          self.mocksocket.sendall.call_args_list)
+        
+        # Explicit flush
+        self.mocksocket.reset_mock()
+        conn.send(frames[3])
+        self.assertFalse(self.mocksocket.sendall.called)
+        conn.flush()
+        self.assertEquals(str(frames[3]), self.mocksocket.sendall.call_args[0][0])
+        conn.flush()
+        self.assertEquals(1, self.mocksocket.sendall.call_count)
+        
+        # Byte threshold
+        self.mocksocket.reset_mock()
+        conn.send(frame.SendFrame('/queue/test', body='x' * 4096))
+        self.assertEquals(1, self.mocksocket.sendall.call_count)
+        
+        # Receipt requests (and pending frames before them) are written immediately.
+        self.mocksocket.reset_mock()
+        conn.send(frames[0])
+        receipt = frame.SendFrame('/queue/test', body='receipt', extra_headers={'receipt': 'r-1'})
+        conn.send(receipt)
+        self.assertEquals(str(frames[0]) + str(receipt), self.mocksocket.sendall.call_args[0][0])
+        
+        # Pending frames are written on disconnect.
+        self.mocksocket.reset_mock()
+        conn.send(frames[1])
+        conn.disconnect()
+        self.assertEquals(str(frames[1]), self.mocksocket.sendall.call_args[0][0])
+    
+    def test_flush_interval(self):
+        """ Test that pending frames are written after the flush interval. """
+        conn = Connection('1.2.3.4', 61613, flush_interval=0.01)
+        f = frame.SendFrame('/queue/test', body='Message')
+        conn.send(f)
+        conn.send(f)
+        self.assertFalse(self.mocksocket.sendall.called)
+        for i in range(100):
+            if self.mocksocket.sendall.called:
+                break
+            time.sleep(0.01)
+        self.assertEquals(str(f) * 2, self.mocksocket.sendall.call_args[0][0])
+        
+        # The flusher thread ends when the connection is closed.
+        flusher = conn._flusher
+        conn.disconnect()
+        flusher.join(1.0)
+        self.assertFalse(flusher.is_alive())
+    
+    def test_read_adaptive(self):
+        """ Test that reads are sized to the missing part of a frame and drain available data. """
+        conn = Connection('1.2.3.4', 61613)
+        f = frame.MessageFrame('/queue/test', body='x' * 200000)
+        packed = str(f)
+        self.mocksocket.recv.side_effect = lambda len: packed
+        
+        result = conn.read()
+        self.assertEquals(f.body, result.body)
+        self.assertEquals(1, self.mocksocket.recv.call_count)
+        sizes = [c[0][1] for c in self.mocksocket.recv_into.call_args_list]
+        self.assertEquals([8192, 16384, 32768, 65536, 131072], sizes)
+        
+        # Once the header of a partially received frame has been parsed, the next read is 
+        # sized to the rest of the frame.
+        self.mocksocket.recv_into.reset_mock()
+        stompclient.connection.select = MockingSelectModule(None)
+        chunks = [packed[:1000], packed[1000:]]
+        self.mocksocket.recv.side_effect = lambda len: chunks.pop(0)
+        result = conn.read()
+        self.assertEquals(f.body, result.body)
+        sizes = [c[0][1] for c in self.mocksocket.recv_into.call_args_list]
+        self.assertEquals([131072, len(packed) - 1000], sizes)
+        
+        # Small reads shrink the read size again.
+        small = str(frame.MessageFrame('/queue/test', body='small'))
+        self.mocksocket.recv.side_effect = lambda len: small
+        for i in range(10):
+            conn.read()
+        self.assertEquals(conn.min_read_size, conn._read_size)
+
+    def test_read_high_descriptor(self):
+        """ Test reading from a socket whose descriptor is beyond FD_SETSIZE (1024). """
+        if resource.getrlimit(resource.RLIMIT_NOFILE)[0] < 1100:
+            return
+        stompclient.connection.socket = socket
+        stompclient.connection.select = select
+        # Use up the low descriptors, so that the socket pair gets high ones.
+        fillers = []
+        try:
+            while len(fillers) < 1030:
+                fillers.append(os.open(os.devnull, os.O_RDONLY))
+            (client_sock, server_sock) = socket.socketpair()
+            self.assertTrue(client_sock.fileno() >= 1024)
+            client_sock.settimeout(1.0)
+            conn = Connection('127.0.0.1', 61613)
+            conn._sock = client_sock
+            conn._connected.set()
+            # (Enough data to fill a read, so that the socket is checked for more.)
+            body = 'x' * 20000
+            server_sock.sendall(frame.MessageFrame('/queue/test', body).pack() * 2)
+            self.assertEquals([body, body], [f.body for f in conn.read_many()])
+            conn.disconnect()
+            server_sock.close()
+        finally:
+            for fd in fillers:
+                os.close(fd)
+
+class HeartbeatTest(TestCase):
+    
+    def setUp(self):
+        (client_sock, self.server_sock) = socket.socketpair()
+        self.conn = Connection('127.0.0.1', 61613, socket_timeout=0.25)
+        self.conn._sock = client_sock
+        self.conn._connected.set()
+        self.server_sock.settimeout(1.0)
+    
+    def tearDown(self):
+        self.server_sock.close()
+        if self.conn.connected:
+            self.conn.disconnect()
+    
+    def negotiate(self, client_heart_beat, server_heart_beat):
+        self.conn.send(frame.ConnectFrame(heart_beat=client_heart_beat))
+        connect = self.server_sock.recv(1024)
+        self.assertTrue('heart-beat:%d,%d\n' % client_heart_beat in connect)
+        connected = frame.ConnectedFrame('session', extra_headers={'heart-beat': server_heart_beat})
+        self.server_sock.sendall(connected.pack())
+        self.assertEquals([frame.CONNECTED], [f.command for f in self.conn.read_many()])
+    
+    def test_parse_heart_beat(self):
+        """ Test parsing heart-beat headers. """
+        self.assertEquals((0, 0), frame.parse_heart_beat(None))
+        self.assertEquals((100, 2000), frame.parse_heart_beat('100,2000'))
+        self.assertRaises(FrameError, frame.parse_heart_beat, '100')
+        self.assertRaises(FrameError, frame.parse_heart_beat, '-1,0')
+        self.assertFalse('heart-beat' in frame.ConnectFrame().headers)
+    
+    def test_negotiate(self):
+        """ Test negotiating heart-beat intervals. """
+        self.negotiate((100, 200), '300,50')
+        self.assertEquals(0.1, self.conn.send_heartbeat)
+        self.assertEquals(0.3, self.conn.receive_heartbeat)
+        
+        # Either side can decline.
+        self.negotiate((100, 0), '300,50')
+        self.assertEquals(0.1, self.conn.send_heartbeat)
+        self.assertEquals(0, self.conn.receive_heartbeat)
+        self.negotiate((100, 200), '0,0')
+        self.assertEquals(None, self.conn.heartbeat())
+        
+        self.conn.disconnect()
+        self.assertEquals(0, self.conn.send_heartbeat)
+    
+    def test_heartbeats(self):
+        """ Test sending heart-beats while idle and detecting a dead server. """
+        self.negotiate((50, 200), '200,50')
+        
+        # Heart-beats are sent while waiting for frames.
+        self.assertEquals([], self.conn.read_many())
+        self.assertTrue(self.server_sock.recv(1024).count('\n') >= 2)
+        
+        # Data from the server (including heart-beats) keeps the connection alive.
+        for i in range(3):
+            self.server_sock.sendall('\n')
+            self.assertEquals([], self.conn.read_many())
+        self.assertTrue(self.conn.connected)
+        
+        # The connection is closed once the server has been silent for twice its interval.
+        start = time.time()
+        self.assertRaises(ConnectionError, self.conn.read_many)
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertFalse(self.conn.connected)
+    
+    def test_publish_client(self):
+        """ Test that publish-only clients negotiate heart-beats when connecting. """
+        pool = ConnectionPool()
+        pool.connections[pool.make_connection_key('127.0.0.1', 61613)] = self.conn
+        client = PublishClient('127.0.0.1', 61613, connection_pool=pool)
+        
+        self.server_sock.sendall(frame.ErrorFrame('Bad login').pack())
+        self.assertRaises(FrameError, client.connect, heart_beat=(50, 200))
+        
+        self.server_sock.sendall(frame.ConnectedFrame('session', extra_headers={'heart-beat': '200,30'}).pack())
+        connected = client.connect(heart_beat=(50, 200))
+        self.assertEquals(frame.CONNECTED, connected.command)
+        # The server's heart-beats are not requested, since they would never be read.
+        self.assertTrue('heart-beat:50,0\n' in self.server_sock.recv(1024))
+        self.assertEquals(0.05, self.conn.send_heartbeat)
+        self.assertEquals(0, self.conn.receive_heartbeat)
+        
+        time.sleep(0.06)
+        self.assertTrue(self.conn.heartbeat() <= 0.05)
+        self.assertEquals('\n', self.server_sock.recv(1024))
+
+class ReconnectingConnectionTest(TestCase):
+    
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.server.settimeout(2.0)
+        self.port = self.server.getsockname()[1]
+        # A port that nothing is listening on.
+        unused = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        unused.bind(('127.0.0.1', 0))
+        self.dead_port = unused.getsockname()[1]
+        unused.close()
+    
+    def tearDown(self):
+        self.server.close()
+    
+    def read_frames(self, sock, n):
+        buf = FrameBuffer()
+        frames = []
+        while len(frames) < n:
+            buf.append(sock.recv(4096))
+            frames.extend(buf.extract_frames())
+        return frames
+    
+    def test_pool(self):
+        """ Test creating reconnecting connections with a pool. """
+        pool = ConnectionPool(ReconnectingConnection, failover=[('127.0.0.1', 1234)], max_attempts=3)
+        conn = pool.get_connection('localhost', 61613, 1.0)
+        self.assertTrue(isinstance(conn, ReconnectingConnection))
+        self.assertEquals([('localhost', 61613), ('127.0.0.1', 1234)], conn.brokers)
+        self.assertEquals(3, conn.max_attempts)
+        self.assertEquals(1.0, conn.socket_timeout)
+    
+    def test_backoff(self):
+        """ Test the jittered exponential backoff and giving up. """
+        conn = ReconnectingConnection('127.0.0.1', self.dead_port, initial_delay=0.01, max_delay=0.04, 
+                                      max_attempts=4)
+        for (attempt, delay) in [(1, 0.01), (2, 0.02), (3, 0.04), (10, 0.04)]:
+            for i in range(10):
+                self.assertTrue(delay / 2 <= conn.backoff_delay(attempt) <= delay)
+        
+        start = time.time()
+        self.assertRaises(ConnectionError, conn.connect)
+        self.assertTrue(time.time() - start >= 0.005 + 0.01 + 0.02)
+        self.assertFalse(conn.connected)
+    
+    def test_failover_and_replay(self):
+        """ Test failing over to the next broker and replaying the session. """
+        conn = ReconnectingConnection('127.0.0.1', self.dead_port, socket_timeout=2.0,
+                                      failover=[('127.0.0.1', self.port)], initial_delay=0.01)
+        conn.send(frame.ConnectFrame('user', 'pass'))
+        self.assertEquals(self.port, conn.port)
+        (server_conn, _) = self.server.accept()
+        conn.send(frame.SubscribeFrame('/queue/a', ack='client'))
+        conn.send(frame.SubscribeFrame('/queue/b'))
+        conn.send(frame.SubscribeFrame('/queue/c', id='sub-c'))
+        conn.send(frame.UnsubscribeFrame('/queue/b'))
+        self.assertEquals(5, len(self.read_frames(server_conn, 5)))
+        
+        # The broker goes away; the reader reconnects and replays the session in one write.
+        server_conn.close()
+        self.assertEquals([], conn.read_many())
+        self.assertTrue(conn.connected)
+        (server_conn, _) = self.server.accept()
+        server_conn.settimeout(2.0)
+        frames = self.read_frames(server_conn, 3)
+        self.assertEquals([frame.CONNECT, frame.SUBSCRIBE, frame.SUBSCRIBE], [f.command for f in frames])
+        self.assertEquals('user', frames[0].get_header('login'))
+        self.assertEquals(('/queue/a', 'client'), (frames[1].destination, frames[1].get_header('ack')))
+        self.assertEquals(('/queue/c', 'sub-c'), (frames[2].destination, frames[2].get_header('id')))
+        
+        # After a DISCONNECT nothing is replayed.
+        conn.send(frame.DisconnectFrame())
+        conn.disconnect()
+        conn.connect()
+        (server_conn2, _) = self.server.accept()
+        conn.send(frame.SendFrame('/queue/a', 'body'))
+        self.assertEquals([frame.SEND], [f.command for f in self.read_frames(server_conn2, 1)])
+        server_conn.close()
+        server_conn2.close()
+        conn.disconnect()
+    
+    def test_replay_connected(self):
+        """ Test that the CONNECTED frame answering a replayed session is not dispatched. """
+        pool = ConnectionPool(ReconnectingConnection, initial_delay=0.01)
+        client = QueueingDuplexClient('127.0.0.1', self.port, socket_timeout=0.1, connection_pool=pool)
+        listener = threading.Thread(target=client.listen_forever)
+        listener.start()
+        try:
+            client.listening_event.wait(2.0)
+            (server_conn, _) = self.server.accept()
+            server_conn.settimeout(2.0)
+            respond = lambda: server_conn.sendall(frame.ConnectedFrame('session').pack())
+            t = threading.Thread(target=lambda: (self.read_frames(server_conn, 1), respond()))
+            t.start()
+            self.assertEquals('session', client.connect().session)
+            t.join(2.0)
+            
+            # Fail over; the replayed CONNECT frame is answered too.
+            server_conn.close()
+            (server_conn, _) = self.server.accept()
+            server_conn.settimeout(2.0)
+            self.assertEquals([frame.CONNECT], [f.command for f in self.read_frames(server_conn, 1)])
+            server_conn.sendall(frame.ConnectedFrame('replayed').pack() 
+                               + frame.ReceiptFrame('receipt-1').pack())
+            self.assertEquals('receipt-1', client.receipt_queue.get(timeout=2.0).receipt_id)
+            self.assertTrue(client.connected_queue.empty())
+            
+            # A later CONNECT gets its own CONNECTED frame.
+            t = threading.Thread(target=lambda: (self.read_frames(server_conn, 1), 
+                                                 server_conn.sendall(frame.ConnectedFrame('new').pack())))
+            t.start()
+            self.assertEquals('new', client.connect().session)
+            t.join(2.0)
+        finally:
+            client.shutdown_event.set()
+            listener.join(2.0)
+            server_conn.close()
+    
+    def test_replay_first_connect(self):
+        """ Test that the CONNECTED frame answers the CONNECT frame replayed before the session was established. """
+        conn = ReconnectingConnection('127.0.0.1', self.port, socket_timeout=2.0, initial_delay=0.01)
+        conn.connect()
+        (server_conn, _) = self.server.accept()
+        server_conn.close()
+        # Sending the first CONNECT frame fails; it is sent again after reconnecting.
+        conn._sock.shutdown(socket.SHUT_WR)
+        conn.send(frame.ConnectFrame('user', 'pass'))
+        (server_conn, _) = self.server.accept()
+        server_conn.settimeout(2.0)
+        self.assertEquals([frame.CONNECT], [f.command for f in self.read_frames(server_conn, 1)])
+        
+        # The connection drops before the CONNECTED frame arrives; the CONNECT frame is replayed.
+        server_conn.close()
+        self.assertEquals([], conn.read_many())
+        (server_conn, _) = self.server.accept()
+        server_conn.settimeout(2.0)
+        self.assertEquals([frame.CONNECT], [f.command for f in self.read_frames(server_conn, 1)])
+        server_conn.sendall(frame.ConnectedFrame('session').pack())
+        self.assertEquals('session', conn.read_connected().session)
+        
+        # Once established, the answer to a replay is not returned.
+        server_conn.close()
+        self.assertEquals([], conn.read_many())
+        (server_conn, _) = self.server.accept()
+        server_conn.settimeout(2.0)
+        self.read_frames(server_conn, 1)
+        server_conn.sendall(frame.ConnectedFrame('replayed').pack() + frame.ReceiptFrame('receipt-1').pack())
+        self.assertEquals(['RECEIPT'], [f.command for f in conn.read_many()])
+        server_conn.close()
+        conn.disconnect()
+    
+    def test_unsubscribe_replay(self):
+        """ Test that subscriptions are forgotten when unsubscribing by destination or id. """
+        conn = ReconnectingConnection('127.0.0.1', self.port, socket_timeout=2.0)
+        conn.send(frame.ConnectFrame())
+        (server_conn, _) = self.server.accept()
+        conn.send(frame.SubscribeFrame('/queue/a', id='sub-a'))
+        conn.send(frame.SubscribeFrame('/queue/b', id='sub-b'))
+        conn.send(frame.SubscribeFrame('/queue/c'))
+        conn.send(frame.UnsubscribeFrame('/queue/a'))
+        conn.send(frame.UnsubscribeFrame(id='sub-b'))
+        self.assertEquals(6, len(self.read_frames(server_conn, 6)))
+        
+        server_conn.close()
+        self.assertEquals([], conn.read_many())
+        (server_conn, _) = self.server.accept()
+        server_conn.settimeout(2.0)
+        frames = self.read_frames(server_conn, 2)
+        self.assertEquals([frame.CONNECT, frame.SUBSCRIBE], [f.command for f in frames])
+        self.assertEquals('/queue/c', frames[1].destination)
+        
+        # The next frame is the SEND, so no other SUBSCRIBE frames were replayed.
+        conn.send(frame.SendFrame('/queue/d', 'body'))
+        self.assertEquals([frame.SEND], [f.command for f in self.read_frames(server_conn, 1)])
+        conn.disconnect()
+        server_conn.close()
+
+class BoundedConnectionPoolTest(TestCase):
+    
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(20)
+        self.server.settimeout(2.0)
+        self.port = self.server.getsockname()[1]
+        self.pool = BoundedConnectionPool(max_connections=2)
+    
+    def tearDown(self):
+        self.pool.close()
+        for conn in self.pool.get_all_connections():
+            if conn.connected:
+                conn.disconnect()
+        self.server.close()
+    
+    def test_invalid_size(self):
+        """ Test validation of the pool size. """
+        self.assertRaises(ValueError, BoundedConnectionPool, max_connections=0)
+        self.assertRaises(ValueError, BoundedConnectionPool, min_connections=3, max_connections=2)
+        self.assertRaises(TypeError, self.pool.get_connection, '127.0.0.1', self.port)
+    
+    def test_checkout_limit(self):
+        """ Test that checkouts block (or time out) once all connections are in use. """
+        c1 = self.pool.checkout('127.0.0.1', self.port)
+        c2 = self.pool.checkout('127.0.0.1', self.port)
+        self.assertTrue(c1 is not c2)
+        self.assertTrue(c1.connected and c2.connected)
+        
+        self.assertRaises(PoolTimeoutError, self.pool.checkout, '127.0.0.1', self.port, block=False)
+        start = time.time()
+        self.assertRaises(PoolTimeoutError, self.pool.checkout, '127.0.0.1', self.port, timeout=0.05)
+        self.assertTrue(time.time() - start >= 0.05)
+        
+        # A blocked checkout gets the connection that is checked in.
+        queue = Queue()
+        t = threading.Thread(target=lambda: queue.put(self.pool.checkout('127.0.0.1', self.port)))
+        t.start()
+        time.sleep(0.05)
+        self.assertTrue(queue.empty())
+        self.pool.checkin(c2)
+        t.join(2.0)
+        self.assertTrue(queue.get(timeout=1.0) is c2)
+        self.assertEquals(2, len(self.pool.get_all_connections()))
+    
+    def test_reuse(self):
+        """ Test that the most recently used idle connection is reused. """
+        with self.pool.connection('127.0.0.1', self.port) as c1:
+            with self.pool.connection('127.0.0.1', self.port) as c2:
+                pass
+        self.assertTrue(self.pool.checkout('127.0.0.1', self.port) is c1)
+        self.assertTrue(self.pool.checkout('127.0.0.1', self.port) is c2)
+    
+    def test_health_check(self):
+        """ Test that failed connections are discarded. """
+        with self.pool.connection('127.0.0.1', self.port) as c1:
+            (server_conn, _) = self.server.accept()
+            self.assertTrue(self.pool.check_connection(c1))
+            server_conn.close()
+            time.sleep(0.05)
+            self.assertFalse(self.pool.check_connection(c1))
+        self.assertEquals([], self.pool.get_all_connections())
+        self.assertFalse(c1.connected)
+        
+        # The CONNECTED frame is read at checkout, so a closed connection is detected.
+        self.pool.set_connect_frame('127.0.0.1', self.port, frame.ConnectFrame(heart_beat=(50, 0)))
+        def respond():
+            (sock, _) = self.server.accept()
+            sock.recv(4096)
+            sock.sendall(frame.ConnectedFrame('session', extra_headers={'heart-beat': '0,0'}).pack())
+            return sock
+        queue = Queue()
+        t = threading.Thread(target=lambda: queue.put(respond()))
+        t.start()
+        with self.pool.connection('127.0.0.1', self.port) as c3:
+            t.join(2.0)
+            server_conn = queue.get(timeout=1.0)
+            self.assertTrue(self.pool.check_connection(c3))
+            # Heart-beats are read and ignored.
+            server_conn.sendall('\n\n')
+            time.sleep(0.05)
+            self.assertTrue(self.pool.check_connection(c3))
+            server_conn.sendall('\n')
+            server_conn.close()
+            time.sleep(0.05)
+            self.assertFalse(self.pool.check_connection(c3))
+        self.assertFalse(c3.connected)
+        
+        # Other frames (e.g. an ERROR frame) fail the check.
+        t = threading.Thread(target=lambda: queue.put(respond()))
+        t.start()
+        with self.pool.connection('127.0.0.1', self.port) as c4:
+            t.join(2.0)
+            server_conn = queue.get(timeout=1.0)
+            server_conn.sendall(frame.ErrorFrame('Failed').pack())
+            time.sleep(0.05)
+        self.assertFalse(c4.connected)
+        self.assertEquals([], self.pool.get_all_connections())
+        server_conn.close()
+        self.pool.set_connect_frame('127.0.0.1', self.port, None)
+        
+        # Connections are discarded when a socket error is raised while they are in use.
+        try:
+            with self.pool.connection('127.0.0.1', self.port) as c2:
+                raise ConnectionError("Failed")
+        except ConnectionError:
+            pass
+        self.assertEquals([], self.pool.get_all_connections())
+        self.assertFalse(c2.connected)
+    
+    def test_idle_timeout(self):
+        """ Test closing surplus idle connections. """
+        pool = BoundedConnectionPool(min_connections=1, max_connections=3, idle_timeout=0.05)
+        conns = [pool.checkout('127.0.0.1', self.port) for i in range(3)]
+        pool.checkin(conns[0])
+        pool.checkin(conns[1])
+        time.sleep(0.1)
+        pool.checkin(conns[2])
+        self.assertEquals([conns[2]], pool.get_all_connections())
+        self.assertFalse(conns[0].connected)
+        self.assertFalse(conns[1].connected)
+        pool.close(frame=frame.DisconnectFrame())
+        self.assertEquals([], pool.get_all_connections())
+    
+    def test_min_connections(self):
+        """ Test that the first checkout opens min_connections connections. """
+        pool = BoundedConnectionPool(min_connections=2, max_connections=3)
+        c1 = pool.checkout('127.0.0.1', self.port)
+        conns = pool.get_all_connections()
+        self.assertEquals(2, len(conns))
+        self.assertTrue(all(conn.connected for conn in conns))
+        c2 = pool.checkout('127.0.0.1', self.port, block=False)
+        self.assertTrue(c2 is not c1 and c2 in conns)
+        
+        # Closed connections are replaced by the next checkout.
+        pool.checkin(c2, discard=True)
+        c3 = pool.checkout('127.0.0.1', self.port)
+        self.assertEquals(2, len(pool.get_all_connections()))
+        pool.checkin(c1)
+        pool.checkin(c3)
+        pool.close()
+        self.assertEquals([], pool.get_all_connections())
+    
+    def test_close_forgets_connect_frames(self):
+        """ Test that close() forgets the CONNECT frames of hosts with no idle connection. """
+        self.pool.set_connect_frame('127.0.0.2', self.port, frame.ConnectFrame())
+        c1 = self.pool.checkout('127.0.0.1', self.port)
+        self.pool.checkin(c1, discard=True)
+        self.pool.close()
+        self.assertEquals({}, self.pool._connect_frames)
+        self.assertEquals({}, self.pool.connections)
+    
+    def test_idle_heartbeat(self):
+        """ Test that heartbeat() beats on idle connections and discards failed ones. """
+        self.pool.set_connect_frame('127.0.0.1', self.port, frame.ConnectFrame(heart_beat=(50, 0)))
+        def respond():
+            (sock, _) = self.server.accept()
+            sock.recv(4096)
+            sock.sendall(frame.ConnectedFrame('session', extra_headers={'heart-beat': '0,50'}).pack())
+            return sock
+        queue = Queue()
+        t = threading.Thread(target=lambda: queue.put(respond()))
+        t.start()
+        self.assertEquals(None, self.pool.heartbeat())
+        with self.pool.connection('127.0.0.1', self.port) as c1:
+            t.join(2.0)
+            server_conn = queue.get(timeout=1.0)
+        self.assertEquals(0.05, c1.send_heartbeat)
+        wait = self.pool.heartbeat()
+        self.assertTrue(0 < wait <= 0.05)
+        time.sleep(0.06)
+        wait = self.pool.heartbeat()
+        self.assertTrue(0.04 < wait <= 0.05)
+        server_conn.settimeout(1.0)
+        self.assertEquals('\n', server_conn.recv(4096))
+        self.assertTrue(self.pool.checkout('127.0.0.1', self.port, block=False) is c1)
+        self.pool.checkin(c1)
+        
+        server_conn.close()
+        time.sleep(0.05)
+        self.assertEquals(None, self.pool.heartbeat())
+        self.assertEquals([], self.pool.get_all_connections())
+        self.assertFalse(c1.connected)
+    
+    def test_heartbeat_checkout(self):
+        """ Test that idle connections can be checked out while heartbeat() checks the others. """
+        c1 = self.pool.checkout('127.0.0.1', self.port)
+        c2 = self.pool.checkout('127.0.0.1', self.port)
+        self.pool.checkin(c1)
+        self.pool.checkin(c2)
+        checked_out = []
+        check_connection = self.pool.check_connection
+        def check(conn):
+            if not checked_out:
+                checked_out.append(self.pool.checkout('127.0.0.1', self.port, block=False))
+            return check_connection(conn)
+        self.pool.check_connection = check
+        self.pool.heartbeat()
+        # The least recently used connection is checked first, and the other one is checked out.
+        self.assertTrue(checked_out[0] is c2)
+        self.assertEquals([c1], [conn for (conn, _) in self.pool._idle[self.pool.make_connection_key('127.0.0.1', self.port)]])
+        self.pool.checkin(c2)
+    
+    def test_publish_client(self):
+        """ Test publishing from many threads over a bounded number of connections. """
+        received = Queue()
+        
+        def serve(sock):
+            sock.settimeout(5.0)
+            buf = FrameBuffer()
+            frames = []
+            data = sock.recv(4096)
+            while data:
+                buf.append(data)
+                for f in buf.extract_frames():
+                    if f.command == frame.CONNECT:
+                        sock.sendall(frame.ConnectedFrame('session').pack())
+                    frames.append(f)
+                data = sock.recv(4096)
+            received.put(frames)
+        
+        def accept():
+            servers = []
+            for i in range(2):
+                (sock, _) = self.server.accept()
+                t = threading.Thread(target=serve, args=(sock,))
+                t.start()
+                servers.append(t)
+            for t in servers:
+                t.join()
+        
+        acceptor = threading.Thread(target=accept)
+        acceptor.start()
+        
+        client = PublishClient('127.0.0.1', self.port, connection_pool=self.pool)
+        client.connect(login='user')
+        def publish(n):
+            for i in range(20):
+                client.send('/queue/test', 'body-%d-%d' % (n, i))
+        publishers = [threading.Thread(target=publish, args=(n,)) for n in range(10)]
+        for t in publishers:
+            t.start()
+        for t in publishers:
+            t.join()
+        # Make sure that both connections have been opened.
+        with self.pool.connection('127.0.0.1', self.port):
+            with self.pool.connection('127.0.0.1', self.port):
+                pass
+        self.assertEquals(2, len(self.pool.get_all_connections()))
+        client.disconnect()
+        acceptor.join(5.0)
+        
+        frames = [received.get(timeout=1.0) for i in range(2)]
+        for conn_frames in frames:
+            self.assertEquals(frame.CONNECT, conn_frames[0].command)
+            self.assertEquals('user', conn_frames[0].get_header('login'))
+            self.assertEquals(frame.DISCONNECT, conn_frames[-1].command)
+        bodies = sorted(f.body for conn_frames in frames for f in conn_frames if f.command == frame.SEND)
+        self.assertEquals(sorted('body-%d-%d' % (n, i) for n in range(10) for i in range(20)), bodies)
@@ -9,6 +9,7 @@ from mockutil import MockingConnectionPool
 from Queue import Queue, Empty
 
 from stompclient.duplex import PublishSubscribeClient, QueueingDuplexClient
+from stompclient.compression import ZlibCompression
 from stompclient import frame
     
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
@@ -55,8 +56,13 @@ class DuplexClientTestBase(TestCase):
             except Empty:
                 return None
         
+        def queued_frames_returner(max_n=None):
+            f = queued_frame_returner()
+            return [f] if f else []
+        
         self.mockconn.send.side_effect = queue_response_frames
         self.mockconn.read.side_effect = queued_frame_returner
+        self.mockconn.read_many.side_effect = queued_frames_returner
         
         # setup listener thread
         self.listener = threading.Thread(target=self.client.listen_forever, name="ListenerThread-%s" % time.time())
@@ -253,3 +259,45 @@ class PublishSubscribeClientTest(DuplexClientTestBase):
         
         pushed = framequeue.get(timeout=1.0)
         self.assertEquals(messageframe, pushed)
+    
+    def test_compression(self):
+        """ Make sure that message bodies are compressed when sent and decompressed when received. """
+        dest = '/foo/bar'
+        body = "This is a test. " * 100
+        
+        framequeue = Queue()
+        self.client.compression = ZlibCompression(threshold=100)
+        self.client.subscribe(dest, framequeue.put)
+        self.client.send(dest, body)
+        
+        (sentframe,) = self.mockconn.send.call_args[0]
+        self.assertEquals('zlib', sentframe.headers['content-encoding'])
+        assert len(sentframe.body) < len(body)
+        
+        messageframe = frame.MessageFrame(dest, body=sentframe.body, extra_headers={'content-encoding': 'zlib'})
+        self.mock_frame_queue.put(messageframe)
+        
+        pushed = framequeue.get(timeout=1.0)
+        self.assertEquals(body, pushed.body)
+        assert 'content-encoding' not in pushed.headers
+        self.assertEquals(1, self.client.compression.stats.decompressed_frames)
+    
+    def test_subscribe_decode(self):
+        """ Make sure that bodies are encoded by codec and decoded for subscriptions. """
+        dest = '/foo/bar'
+        payload = {'key': 'value', 'counter': 1}
+        
+        framequeue = Queue()
+        self.client.subscribe(dest, lambda f, p: framequeue.put((f, p)), decode=True)
+        self.client.send(dest, payload, codec='json')
+        
+        (sentframe,) = self.mockconn.send.call_args[0]
+        self.assertEquals('application/json', sentframe.headers['content-type'])
+        
+        messageframe = frame.MessageFrame(dest, body=sentframe.body, 
+                                          extra_headers={'content-type': 'application/json'})
+        self.mock_frame_queue.put(messageframe)
+        
+        (pushed, decoded) = framequeue.get(timeout=1.0)
+        self.assertEquals(messageframe, pushed)
+        self.assertEquals(payload, decoded)
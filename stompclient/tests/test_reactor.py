@@ -0,0 +1,304 @@
+"""
+Tests for the single-threaded reactor.
+"""
+import socket
+import select
+import time
+import threading
+from unittest import TestCase
+
+from stompclient.connection import Connection, ConnectionPool
+from stompclient.duplex import PublishSubscribeClient
+from stompclient.reactor import Reactor, SelectPoller, PollPoller
+from stompclient.util import FrameBuffer
+from stompclient import frame
+
+__authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
+__copyright__ = "Copyright 2010 Hans Lellelid"
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+class ReactorTest(TestCase):
+
+    def setUp(self):
+        self.server_socks = []
+
+    def tearDown(self):
+        for sock in self.server_socks:
+            sock.close()
+
+    def make_client(self, port):
+        """ Returns a client whose connection is one end of a socket pair. """
+        (client_sock, server_sock) = socket.socketpair()
+        client_sock.settimeout(1.0)
+        self.server_socks.append(server_sock)
+
+        conn = Connection('127.0.0.1', port)
+        conn._sock = client_sock
+        conn._connected.set()
+        pool = ConnectionPool()
+        pool.connections[pool.make_connection_key('127.0.0.1', port)] = conn
+        return PublishSubscribeClient('127.0.0.1', port, connection_pool=pool)
+
+    def poll_until(self, reactor, condition):
+        for i in range(50):
+            if condition():
+                return
+            reactor.poll(0.1)
+        self.fail("Condition was not met.")
+
+    def _test_dispatch(self, reactor):
+        received = {}
+        clients = []
+        for i in range(10):
+            client = self.make_client(61613 + i)
+            reactor.register(client)
+            self.assertTrue(client.listening_event.is_set())
+            client.subscribe('/queue/%d' % i, lambda f, i=i: received.setdefault(i, []).append(f.body))
+            clients.append(client)
+        self.assertEquals(10, len(reactor.clients))
+
+        for (i, sock) in enumerate(self.server_socks):
+            # Two frames in one write and one frame in two writes.
+            sock.sendall(frame.MessageFrame('/queue/%d' % i, 'a').pack() +
+                         frame.MessageFrame('/queue/%d' % i, 'b').pack())
+            packed = frame.MessageFrame('/queue/%d' % i, 'c').pack()
+            sock.sendall(packed[:10])
+            sock.sendall(packed[10:])
+
+        self.poll_until(reactor, lambda: sum(len(v) for v in received.values()) == 30)
+        for i in range(10):
+            self.assertEquals(['a', 'b', 'c'], received[i])
+
+    def test_dispatch(self):
+        """ Test dispatching frames from many connections (default poller). """
+        self._test_dispatch(Reactor())
+
+    def test_dispatch_select(self):
+        """ Test dispatching frames with the select poller. """
+        self._test_dispatch(Reactor(poller=SelectPoller()))
+
+    def test_dispatch_poll(self):
+        """ Test dispatching frames with the poll poller. """
+        if not hasattr(select, 'poll'):
+            return
+        self._test_dispatch(Reactor(poller=PollPoller()))
+
+    def test_closed_connection(self):
+        """ Test that clients are unregistered when their connection is closed. """
+        reactor = Reactor()
+        c1 = self.make_client(1)
+        c2 = self.make_client(2)
+        reactor.register(c1)
+        reactor.register(c2)
+
+        # Closed by the server
+        self.server_socks[0].close()
+        self.poll_until(reactor, lambda: c1 not in reactor.clients)
+        self.assertFalse(c1.listening_event.is_set())
+        self.assertFalse(c1.connection.connected)
+
+        # Closed by the client
+        c2.connection.disconnect()
+        reactor.poll(0.01)
+        self.assertEquals([], reactor.clients)
+        self.assertFalse(c2.listening_event.is_set())
+
+    def test_failing_client(self):
+        """ Test that an unexpected error only unregisters the client concerned. """
+        reactor = Reactor()
+        received = []
+        c1 = self.make_client(1)
+        c2 = self.make_client(2)
+        c2.subscribe('/queue/2', lambda f: received.append(f.body))
+        reactor.register(c1)
+        reactor.register(c2)
+        
+        def fail():
+            raise ValueError("Unexpected")
+        c1.connection.read_available = fail
+        for (i, sock) in enumerate(self.server_socks):
+            sock.sendall(frame.MessageFrame('/queue/%d' % (i + 1), 'a').pack())
+        
+        self.poll_until(reactor, lambda: received == ['a'] and c1 not in reactor.clients)
+        self.assertEquals([c2], reactor.clients)
+        self.assertFalse(c1.listening_event.is_set())
+        self.assertTrue(c2.listening_event.is_set())
+    
+    def test_unregister(self):
+        """ Test unregistering a client. """
+        reactor = Reactor()
+        client = self.make_client(1)
+        reactor.register(client)
+        reactor.unregister(client)
+        self.assertEquals([], reactor.clients)
+        self.assertFalse(client.listening_event.is_set())
+        self.assertTrue(client.connection.connected)
+
+        self.server_socks[0].sendall(frame.MessageFrame('/queue/1', 'a').pack())
+        self.assertEquals(0, reactor.poll(0.01))
+
+    def test_run_forever(self):
+        """ Test running the reactor loop in a thread. """
+        reactor = Reactor(poll_timeout=0.05)
+        client = self.make_client(1)
+        received = threading.Event()
+        client.subscribe('/queue/1', lambda f: received.set())
+        reactor.register(client)
+
+        t = threading.Thread(target=reactor.run_forever)
+        t.start()
+        try:
+            self.server_socks[0].sendall(frame.MessageFrame('/queue/1', 'a').pack())
+            self.assertTrue(received.wait(2.0))
+        finally:
+            reactor.shutdown_event.set()
+            t.join()
+        self.assertFalse(client.listening_event.is_set())
+
+    def serve(self, sock, n):
+        """ Answers the CONNECT frames and receipts among the next n frames in a thread. """
+        def respond():
+            buf = FrameBuffer()
+            handled = 0
+            while handled < n:
+                buf.append(sock.recv(4096))
+                for f in buf.extract_frames():
+                    if f.command == frame.CONNECT:
+                        sock.sendall(frame.ConnectedFrame('session-1').pack())
+                    elif f.receipt is not None:
+                        sock.sendall(frame.ReceiptFrame(f.receipt).pack())
+                    handled += 1
+        t = threading.Thread(target=respond)
+        t.daemon = True
+        t.start()
+        return t
+
+    def test_connect_registered(self):
+        """ Test connecting (and receipts) with a registered client before the reactor runs. """
+        reactor = Reactor()
+        client = self.make_client(1)
+        client.queue_timeout = 2.0
+        reactor.register(client)
+        self.assertTrue(client.reactor is reactor)
+        responder = self.serve(self.server_socks[0], 2)
+        self.assertEquals('session-1', client.connect().session)
+        receipt = client.send('/queue/test', 'body', extra_headers={'receipt': 'r1'})
+        self.assertEquals('r1', receipt.receipt_id)
+        responder.join(2.0)
+        self.assertTrue(client.connected_queue.empty())
+        reactor.unregister(client)
+        self.assertTrue(client.reactor is None)
+
+    def test_receipt_in_callback(self):
+        """ Test waiting for a receipt from a callback on the running reactor's thread. """
+        reactor = Reactor(poll_timeout=0.05)
+        client = self.make_client(1)
+        client.queue_timeout = 2.0
+        receipts = []
+        client.subscribe('/queue/1', lambda f: receipts.append(
+            client.send('/queue/reply', 'reply', extra_headers={'receipt': 'r1'})))
+        reactor.register(client)
+        # The SUBSCRIBE frame, then the SEND frame.
+        responder = self.serve(self.server_socks[0], 2)
+
+        t = threading.Thread(target=reactor.run_forever)
+        t.start()
+        try:
+            self.server_socks[0].sendall(frame.MessageFrame('/queue/1', 'a').pack())
+            for i in range(100):
+                if receipts:
+                    break
+                time.sleep(0.02)
+        finally:
+            reactor.shutdown_event.set()
+            t.join()
+        responder.join(2.0)
+        self.assertEquals(['r1'], [r.receipt_id for r in receipts])
+
+    def test_connect_running(self):
+        """ Test connecting from another thread while the reactor runs. """
+        reactor = Reactor(poll_timeout=0.05)
+        client = self.make_client(1)
+        client.queue_timeout = 2.0
+        reactor.register(client)
+        t = threading.Thread(target=reactor.run_forever)
+        t.start()
+        try:
+            responder = self.serve(self.server_socks[0], 1)
+            self.assertEquals('session-1', client.connect().session)
+        finally:
+            reactor.shutdown_event.set()
+            t.join()
+        responder.join(2.0)
+
+    def test_heartbeat(self):
+        """ Test that the reactor sends heart-beats and drops clients whose server is silent. """
+        reactor = Reactor()
+        client = self.make_client(1)
+        reactor.register(client)
+        conn = client.connection
+        conn.send_heartbeat = 0.02
+        conn.receive_heartbeat = 0.05
+        conn._last_sent = conn._last_received = time.time()
+
+        self.poll_until(reactor, lambda: client not in reactor.clients)
+        self.assertFalse(conn.connected)
+        self.server_socks[0].settimeout(1.0)
+        self.assertTrue(self.server_socks[0].recv(1024).count('\n') >= 2)
+
+    def _test_slow_peer(self, reactor):
+        c1 = self.make_client(1)
+        c2 = self.make_client(2)
+        (slow, fast) = self.server_socks
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        c1.connection._sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        reply = 'x' * (4 * 1024 * 1024)
+        received = []
+        c1.subscribe('/queue/1', lambda f: c1.send('/queue/reply', reply))
+        c2.subscribe('/queue/2', lambda f: received.append(f.body))
+        reactor.register(c1)
+        reactor.register(c2)
+        self.assertTrue(c1.connection.nonblocking)
+
+        # The reply does not fit into the socket buffers, and the slow server does not read.
+        slow.sendall(frame.MessageFrame('/queue/1', 'a').pack())
+        self.poll_until(reactor, lambda: c1.connection.unsent_bytes > 0)
+        fast.sendall(frame.MessageFrame('/queue/2', 'b').pack())
+        self.poll_until(reactor, lambda: received == ['b'])
+        
+        # The unsent data is written as the server reads it.
+        data = []
+        expected = (frame.SubscribeFrame('/queue/1').pack() + frame.SendFrame('/queue/reply', reply).pack())
+        slow.setblocking(False)
+        for i in range(1000):
+            reactor.poll(0.01)
+            try:
+                data.append(slow.recv(1048576))
+            except socket.error:
+                pass
+            if sum(len(d) for d in data) >= len(expected) and not c1.connection.unsent_bytes:
+                break
+        self.assertEquals(0, c1.connection.unsent_bytes)
+        self.assertTrue(expected == ''.join(data))
+        
+        reactor.unregister(c1)
+        self.assertFalse(c1.connection.nonblocking)
+        self.assertEquals(None, c1.connection._sock.gettimeout())
+
+    def test_slow_peer(self):
+        """ Test that a server that does not read does not stall the other clients. """
+        self._test_slow_peer(Reactor())
+
+    def test_slow_peer_select(self):
+        """ Test writing unsent data with the select poller. """
+        self._test_slow_peer(Reactor(poller=SelectPoller()))
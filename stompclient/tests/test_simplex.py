@@ -1,12 +1,14 @@
 """
 Tests for the simple (publish-only) client.
 """
+import threading
 from unittest import TestCase
 
 from mock import sentinel
 
 from stompclient.simplex import PublishClient
 from stompclient import frame
+from stompclient.util import FrameBuffer
 
 from stompclient.tests.mockutil import MockingConnectionPool
 
@@ -101,4 +103,68 @@ class SimplexClientTest(TestCase):
         
         self.assertEquals(str(expected), str(sentframe))
         
-    
\ No newline at end of file
+    def test_send_headers_unmodified(self):
+        """ Test that sending does not modify the caller's headers. """
+        dest = '/foo/bar'
+        body = "This is a test."
+        extra_headers = {'persistent': 'true'}
+        self.client.send(dest, body, extra_headers=extra_headers)
+        (sentframe,) = self.mockconn.send.call_args[0]
+        
+        packed = str(sentframe)
+        self.assertTrue(('\ncontent-length:%d\n' % len(body)) in packed)
+        self.assertEquals({'persistent': 'true'}, extra_headers)
+        self.assertFalse('content-length' in sentframe.headers)
+        
+        sentframe.body = "Changed"
+        self.assertTrue('\ncontent-length:7\n' in str(sentframe))
+        
+    def test_prepare_send(self):
+        """ Test sending messages with prepared headers. """
+        dest = '/foo/bar'
+        prepared = self.client.prepare_send(dest, extra_headers={'persistent': 'true'})
+        for body in ("This is a test.", "", "Another\x00test"):
+            prepared.send(body)
+            (sentframe,) = self.mockconn.send.call_args[0]
+            
+            expected = frame.SendFrame(dest, body=body, extra_headers={'persistent': 'true'})
+            buf = FrameBuffer()
+            buf.append(str(sentframe))
+            received = buf.extract_frame()
+            self.assertEquals(expected.command, received.command)
+            self.assertEquals(str(expected), str(received))
+            self.assertFalse('content-length' in sentframe.headers)
+        
+        self.assertRaises(ValueError, self.client.prepare_send, dest, extra_headers={'receipt': 'r-1'})
+        
+    def test_frame_pool(self):
+        """ Test that SEND and ACK frames are reused when a frame pool is configured. """
+        client = PublishClient('127.0.0.1', 1234, connection_pool=self.mockpool, frame_pool=frame.FramePool())
+        packed = []
+        self.mockconn.send.side_effect = lambda f: packed.append(f.pack())
+        
+        client.send('/foo/bar', 'body 1', extra_headers={'persistent': 'true'})
+        client.send('/foo/baz', 'body 2', transaction='t-1')
+        (first, second) = [c[0][0] for c in self.mockconn.send.call_args_list]
+        assert first is second
+        self.assertEquals(str(frame.SendFrame('/foo/bar', 'body 1', extra_headers={'persistent': 'true'})), packed[0])
+        self.assertEquals(str(frame.SendFrame('/foo/baz', 'body 2', transaction='t-1')), packed[1])
+        
+        client.ack('message-1')
+        client.ack('message-2')
+        (first, second) = [c[0][0] for c in self.mockconn.send.call_args_list[2:]]
+        assert first is second
+        self.assertEquals([str(frame.AckFrame('message-1')), str(frame.AckFrame('message-2'))], packed[2:])
+    
+    def test_frame_pool_threads(self):
+        """ Test that each thread gets its own pooled frames. """
+        pool = frame.FramePool()
+        f = pool.send_frame('/foo/bar', 'body')
+        assert pool.send_frame('/foo/baz') is f
+        self.assertEquals('', f.body)
+        
+        others = []
+        t = threading.Thread(target=lambda: others.append(pool.send_frame('/foo/bar', 'body')))
+        t.start()
+        t.join()
+        assert others[0] is not f
@@ -2,9 +2,13 @@
 Utility functions and classes.
 """
 import re
+import mmap
 import logging
+import tempfile
 
-from stompclient.frame import Frame, VALID_COMMANDS
+from stompclient.frame import (Frame, LazyFrame, EscapedLazyFrame, CONNECTED, VALID_COMMAND_SET, 
+                               parse_header_block, parse_escaped_header_block)
+from stompclient.exceptions import FrameError, FrameSizeError
 
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>', 'Ricky Iacovou (stomper)']
 __copyright__ = "Copyright 2010 Hans Lellelid"
@@ -20,6 +24,47 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
+class InternTable(object):
+    """
+    A bounded table of shared string instances.
+    
+    Received frames typically repeat the same header keys (and, for a handful of headers 
+    such as 'destination', the same values) over and over.  Mapping each parsed string to 
+    a single shared instance means that queued frames do not each hold their own copies, 
+    and that dict lookups keyed by these strings can usually be satisfied by an identity 
+    check.  Unlike the builtin `intern()`, the table stops growing once it holds `max_size`
+    strings; strings that are not already in the (full) table are returned unchanged.
+    
+    :ivar max_size: The maximum number of strings in the table.
+    :type max_size: int
+    """
+    __slots__ = ('max_size', '_table')
+    
+    def __init__(self, max_size=1024):
+        """
+        :param max_size: The maximum number of strings to hold.
+        :type max_size: int
+        """
+        self.max_size = max_size
+        self._table = {}
+    
+    def intern(self, s):
+        """
+        Returns the shared instance of the string, adding it to the table if there is room.
+        
+        :rtype: str
+        """
+        table = self._table
+        shared = table.get(s)
+        if shared is None:
+            if len(table) >= self.max_size:
+                return s
+            shared = table[s] = s
+        return shared
+    
+    def __len__(self):
+        return len(self._table)
+
 class FrameBuffer(object):
     """
     A customized version of the StompBuffer class from Stomper project that returns frame objects
@@ -33,58 +78,405 @@ class FrameBuffer(object):
     This class can be used to smooth over a transport that may provide partial frames (or
     may provide multiple frames in one data buffer).
     
-    :ivar buffer: The internal byte buffer.
-    :type buffer: str
+    Received bytes are accumulated in a growable `bytearray` and consumed by advancing a
+    read offset, rather than by slicing off the front of an immutable string.  The consumed
+    prefix is only discarded once it is large enough to be worth the copy (see
+    `compact_threshold`), so both appending data and extracting a frame cost time proportional
+    to the size of the data involved rather than to the size of the whole buffer.
+    
+    :ivar buffer: The internal byte buffer; bytes before the current read offset have already
+                    been consumed.
+    :type buffer: bytearray
     
     :ivar debug: Log extra parsing debug (logs will be DEBUG level). 
     :type debug: bool 
+    
+    :ivar lazy_headers: Whether to return :class:`stompclient.frame.LazyFrame` instances, which only
+                        parse their headers when they are accessed.
+    :type lazy_headers: bool
+    
+    :ivar zero_copy: Whether extracted frame bodies are read-only `memoryview` slices of the
+                        internal buffer rather than (copied) strings.  See :meth:`extract_frame`.
+    :type zero_copy: bool
+    
+    :ivar max_header_size: The maximum size (in bytes) of a frame's command and header lines (`None`
+                            for no limit).
+    :type max_header_size: int
+    
+    :ivar max_body_size: The maximum size (in bytes) of a frame's body (`None` for no limit).
+    :type max_body_size: int
+    
+    :ivar max_buffer_size: The maximum number of bytes that may be buffered while waiting for a 
+                            frame to be completed (`None` for no limit).
+    :type max_buffer_size: int
+    
+    :ivar skip_oversized: Whether frames exceeding the limits above are silently skipped (logged at
+                            WARNING level) instead of raising :class:`stompclient.exceptions.FrameSizeError`.
+    :type skip_oversized: bool
+    
+    :ivar skipped_frames: The number of frames skipped (or rejected) for exceeding the limits.
+    :type skipped_frames: int
+    
+    :ivar spool_threshold: Frames with a content-length of at least this many bytes have their body
+                            written to a temporary file as it is received, rather than buffered in
+                            memory (`None` to disable).  See :meth:`extract_frame`.
+    :type spool_threshold: int
+    
+    :ivar spool_dir: The directory for the temporary files (`None` for the system default).
+    :type spool_dir: str
+    
+    :ivar intern_headers: The names of the headers whose values are shared between frames via
+                            :attr:`intern_table` (`None` to disable interning).  When set, all
+                            header keys are interned too.  Applies to eagerly parsed headers only.
+    :type intern_headers: frozenset
+    
+    :ivar intern_table: The table of shared header keys and values.
+    :type intern_table: :class:`InternTable`
+    
+    :ivar unescape_headers: Whether received headers are STOMP 1.1 escaped (in which case they are
+                            unescaped, and whitespace is not stripped).  See 
+                            :func:`stompclient.frame.parse_escaped_header_block`.
+    :type unescape_headers: bool
+    
+    :ivar resync_count: The number of times corrupt data was discarded from the buffer.
+    :type resync_count: int
+    
+    :ivar discarded_bytes: The total number of corrupt bytes discarded from the buffer.
+    :type discarded_bytes: int
     """
-        
-    # regexp to check that the buffer starts with a command.
-    command_re = re.compile('^(.+?)\n')
     
-    # regexp to remove everything up to and including the first
-    # instance of '\x00' (used in resynching the buffer).
-    sync_re = re.compile('^.*?\x00')
+    # The commands that a (valid) frame may start with.
+    valid_commands = VALID_COMMAND_SET
     
     # regexp to determine the content length. The buffer should always start
     # with a command followed by the headers, so the content-length header will
     # always be preceded by a newline.  It may not always proceeded by a newline, though!
     content_length_re = re.compile('\ncontent-length\s*:\s*(\d+)\s*(\n|$)')
     
-    def __init__(self):
-        self.buffer = ''
+    # Consumed bytes at the front of the buffer are only discarded once there are at
+    # least this many of them (and they make up at least half of the buffer).
+    compact_threshold = 65536
+    
+    # A drained (or compacted) buffer larger than this is replaced by a fresh one, so 
+    # that the memory held onto after a very large frame is released.
+    shrink_threshold = 1048576
+    
+    def __init__(self, lazy_headers=False, zero_copy=False, max_header_size=None, 
+                 max_body_size=None, max_buffer_size=None, skip_oversized=False,
+                 spool_threshold=None, spool_dir=None, intern_headers=None, 
+                 intern_table_size=1024, unescape_headers=False):
+        """
+        :param lazy_headers: Whether to defer parsing the headers of extracted frames
+                                (see :class:`stompclient.frame.LazyFrame`).
+        :type lazy_headers: bool
+        
+        :param zero_copy: Whether to expose frame bodies as read-only `memoryview` slices
+                            of the receive buffer instead of copying them.
+        :type zero_copy: bool
+        
+        :param max_header_size: The maximum size of a frame's command and header lines.
+        :type max_header_size: int
+        
+        :param max_body_size: The maximum size of a frame's body.
+        :type max_body_size: int
+        
+        :param max_buffer_size: The maximum number of bytes to buffer for an incomplete frame.
+        :type max_buffer_size: int
+        
+        :param skip_oversized: Whether to skip frames exceeding the limits instead of raising
+                                an exception.
+        :type skip_oversized: bool
+        
+        :param spool_threshold: The content-length above which bodies are spooled to a temporary file.
+        :type spool_threshold: int
+        
+        :param spool_dir: The directory in which to create temporary files.
+        :type spool_dir: str
+        
+        :param intern_headers: The names of low-cardinality headers whose values should be
+                                interned, e.g. ('destination', 'subscription', 'content-type').
+                                Header keys are interned whenever this is not `None`.
+        :type intern_headers: iterable
+        
+        :param intern_table_size: The maximum number of interned keys and values.
+        :type intern_table_size: int
+        
+        :param unescape_headers: Whether to unescape STOMP 1.1 headers.
+        :type unescape_headers: bool
+        """
+        self.buffer = bytearray()
+        self.lazy_headers = lazy_headers
+        self.zero_copy = zero_copy
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.max_buffer_size = max_buffer_size
+        self.skip_oversized = skip_oversized
+        self.skipped_frames = 0
+        self.spool_threshold = spool_threshold
+        self.spool_dir = spool_dir
+        if intern_headers is not None:
+            self.intern_headers = frozenset(intern_headers)
+            self.intern_table = InternTable(intern_table_size)
+        else:
+            self.intern_headers = None
+            self.intern_table = None
+        self.unescape_headers = unescape_headers
         self.debug = False
         self.log = logging.getLogger('%s.%s' % (self.__module__, self.__class__.__name__))
+        self.resync_count = 0
+        self.discarded_bytes = 0
+        self._pos = 0
+        # Whether views of the current buffer storage have been handed out (in which
+        # case it must not be modified any more).
+        self._exported = False
+        # Number of bytes (of an oversized frame) still to be discarded as they are appended.
+        self._skip_bytes = 0
+        # Whether appended bytes are discarded up to and including the next null byte.
+        self._skip_to_nul = False
+        # An error to raise on the next call to extract_frame().
+        self._deferred_error = None
+        # The temporary file (if any) receiving the body of the frame at the read offset,
+        # the frame's command, header data, body length and number of body bytes still expected.
+        self._spool_file = None
+        self._spool_command = None
+        self._spool_header = None
+        self._spool_length = 0
+        self._spool_remaining = 0
+        self._reset_parse_state()
     
     def clear(self):
         """
         Clears (empties) the internal buffer.
         """
-        self.buffer = ''
+        self.buffer = bytearray()
+        self._pos = 0
+        self._exported = False
+        self._skip_bytes = 0
+        self._skip_to_nul = False
+        self._deferred_error = None
+        if self._spool_file is not None:
+            self._spool_file.close()
+            self._spool_file = None
+        self._spool_remaining = 0
+        self._reset_parse_state()
         
     def buffer_len(self):
         """
-        :return: Number of bytes in the internal buffer.
+        :return: Number of (unconsumed) bytes in the internal buffer.
         :rtype: int
         """
-        return len(self.buffer)
+        return len(self.buffer) - self._pos
     
     def buffer_empty(self):
         """
         :return: `True` if buffer is empty, `False` otherwise. 
         :rtype: bool
         """
-        return not bool(self.buffer)
+        return self._pos >= len(self.buffer)
+    
+    def bytes_needed(self):
+        """
+        Returns the number of bytes still needed to complete the frame at the read offset,
+        if it is known (i.e. once the frame's header, including a content-length, has been 
+        received).
+        
+        Readers can use this to size their next read.
+        
+        :return: The number of missing bytes (0 if unknown).
+        :rtype: int
+        """
+        if self._spool_remaining:
+            # The rest of the body plus the null terminator.
+            return self._spool_remaining + 1
+        if self._header_len is None or self._content_length is None:
+            return 0
+        frame_len = self._header_len + len('\n\n') + self._content_length + 1
+        return max(frame_len - self.buffer_len(), 0)
         
     def append(self, data):
         """
         Appends bytes to the internal buffer (may or may not contain full stomp frames).
         
+        The data is copied, so a reusable receive buffer (or a `memoryview` of one) may be 
+        passed.
+        
         :param data: The bytes to append.
-        :type data: str
+        :type data: str, bytearray or memoryview
+        """
+        if self._skip_bytes or self._skip_to_nul:
+            data = self._discard(data)
+            if not data:
+                return
+        if self._spool_remaining:
+            data = self._spool(data)
+            if not data:
+                return
+        if self._exported:
+            self._detach()
+        else:
+            self._compact()
+        self.buffer.extend(data)
+    
+    def _discard(self, data):
+        """
+        Discards the leading part of `data` that belongs to a frame being skipped.
+        
+        :return: The remaining data (which starts at the next frame boundary).
+        :rtype: str
+        """
+        if self._skip_bytes:
+            n = min(self._skip_bytes, len(data))
+            self._skip_bytes -= n
+            return data[n:]
+        else:
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            i = data.find('\x00')
+            if i == -1:
+                return ''
+            self._skip_to_nul = False
+            return data[i + 1:]
+    
+    def _start_spool(self):
+        """
+        Starts writing the body of the frame at the read offset to a temporary file.
+        
+        The header is kept aside and the part of the body received so far is moved from 
+        the buffer to the file; the rest of the body is written to the file by :meth:`append`. 
+        """
+        start = self._pos
+        body_start = start + self._header_len + len('\n\n')
+        self._spool_command = self._command
+        self._spool_header = str(buffer(self.buffer, start, self._header_len))
+        self._spool_length = self._content_length
+        self._spool_remaining = self._content_length
+        self._spool_file = tempfile.TemporaryFile(dir=self.spool_dir)
+        if self.debug:
+            self.log.debug("Spooling %d byte body to temporary file." % self._content_length)
+        
+        n = min(len(self.buffer) - body_start, self._spool_remaining)
+        self._spool_file.write(buffer(self.buffer, body_start, n))
+        self._spool_remaining -= n
+        self._consume(body_start + n - start)
+    
+    def _spool(self, data):
+        """
+        Writes the leading part of `data` that belongs to the spooled body to the temporary file.
+        
+        :return: The remaining data (which starts with the frame's null terminator).
+        :rtype: str
+        """
+        n = min(self._spool_remaining, len(data))
+        self._spool_file.write(data[:n])
+        self._spool_remaining -= n
+        return data[n:]
+    
+    def _extract_spooled_frame(self):
+        """
+        Returns the frame whose body is being spooled, if the body and its terminator have been received.
+        
+        :return: The completed frame (or `None` if it is not complete yet).
+        :rtype: :class:`stompclient.frame.Frame`
+        """
+        if self._spool_remaining or self.buffer_empty():
+            return None
+        spool_file = self._spool_file
+        self._spool_file = None
+        if self.buffer[self._pos] != 0:
+            # The content-length was wrong: the frame is dropped (as in extract_frame).
+            spool_file.close()
+            raise FrameError("Frame body (content-length %d) is not followed by a null byte." 
+                             % self._spool_length)
+        # Consume the null terminator.
+        self._consume(1)
+        
+        try:
+            spool_file.flush()
+            body = mmap.mmap(spool_file.fileno(), self._spool_length, access=mmap.ACCESS_READ)
+        finally:
+            spool_file.close()
+        return self._make_frame(self._spool_command, self._spool_header, body)
+    
+    def _skip_frame(self):
+        """
+        Discards the (oversized) frame at the read offset, including any part of it that
+        has not been received yet.
+        """
+        self.skipped_frames += 1
+        avail = self.buffer_len()
+        if self._content_length is not None:
+            total = self._header_len + len('\n\n') + self._content_length + len('\x00')
+            if total > avail:
+                self._skip_bytes = total - avail
+                total = avail
+            self._consume(total)
+        else:
+            if self._header_len is None:
+                j = self.buffer.find('\x00', self._pos)
+            else:
+                j = self.buffer.find('\x00', self._pos + self._scan_pos)
+            if j == -1:
+                self._skip_to_nul = True
+                self._consume(avail)
+            else:
+                self._consume(j + 1 - self._pos)
+    
+    def _detach(self):
+        """
+        Moves the unconsumed bytes into new storage, leaving the current (exported) 
+        storage untouched for the frame bodies that reference it.
+        """
+        self.buffer = bytearray(buffer(self.buffer, self._pos))
+        self._pos = 0
+        self._exported = False
+    
+    def _compact(self):
+        """
+        Discards the consumed bytes at the front of the buffer, if there are enough of them.
         """
-        self.buffer += data
+        pos = self._pos
+        if pos < self.compact_threshold or pos * 2 < len(self.buffer):
+            return
+        if len(self.buffer) > self.shrink_threshold:
+            self.buffer = self.buffer[pos:]
+        else:
+            del self.buffer[:pos]
+        self._pos = 0
+    
+    def _reset_parse_state(self):
+        """
+        Forgets what is known about the frame at the read offset.
+        
+        The parse state is kept relative to the read offset (the start of the
+        next frame), so it survives compaction of the buffer.
+        """
+        # Whether the frame at the read offset has been checked to start with a valid command.
+        self._synced = False
+        # The (interned) command of the frame at the read offset, once it has been validated.
+        self._command = None
+        # Length of the header (command line + headers), once the '\n\n' has been found.
+        self._header_len = None
+        # Value of the content-length header, if the frame has one.
+        self._content_length = None
+        # Offset (from the read offset) at which the next scan should resume.
+        self._scan_pos = 0
+    
+    def _consume(self, nbytes):
+        """
+        Advances the read offset past `nbytes` bytes, resetting the buffer once it is drained.
+        
+        :param nbytes: The number of bytes that have been consumed.
+        :type nbytes: int
+        """
+        self._reset_parse_state()
+        self._pos += nbytes
+        if self._pos >= len(self.buffer):
+            if self._exported or len(self.buffer) > self.shrink_threshold:
+                self.buffer = bytearray()
+                self._exported = False
+            else:
+                del self.buffer[:]
+            self._pos = 0
 
     def extract_frame(self):
         """
@@ -96,41 +488,178 @@ class FrameBuffer(object):
         should therefore call this method in a loop (or use iterator
         functionality exposed by class) until None returned.
         
+        If the buffer is in `zero_copy` mode, the body of the returned frame is a read-only
+        `memoryview` of the internal buffer rather than a copy.  The view belongs to the frame:
+        the buffer never modifies (or reuses) storage once a view of it has been handed out; it
+        allocates new storage for subsequently received data instead.  The view therefore remains
+        valid and unchanged for as long as it is referenced.  Note, however, that a view keeps
+        the entire underlying storage alive (which may include the data of other frames), so
+        code that holds onto bodies for a long time should copy them (`body.tobytes()`).
+        
+        Frames whose body was spooled to a temporary file (see `spool_threshold`) have a read-only
+        `mmap.mmap` body instead.  The temporary file has already been removed, so its storage is
+        released when the mapping is closed (`body.close()`) or garbage-collected.
+        
         :return: The next complete frame in the buffer.
         :rtype: :class:`stompclient.frame.Frame`
+        
+        :raise stompclient.exceptions.FrameSizeError: If the next frame exceeds the configured size 
+                    limits (and `skip_oversized` is not set).  The offending frame is discarded, so
+                    extraction may continue after the error.
+        :raise stompclient.exceptions.FrameError: If the body of the next frame (as sized by its
+                    content-length header) is not followed by a null byte.  The frame is discarded
+                    too, and the data that follows it is resynchronized (see :meth:`sync_buffer`).
         """
-        (mbytes, hbytes) = self._find_message_bytes(self.buffer)
+        if self._deferred_error:
+            (error, self._deferred_error) = (self._deferred_error, None)
+            raise error
+        
+        if self._spool_file is None:
+            (mbytes, hbytes) = self._find_message_bytes()
+        if self._spool_file is not None:
+            return self._extract_spooled_frame()
         if not mbytes:
             return None
         
-        msgdata = self.buffer[:mbytes]
-        self.buffer = self.buffer[mbytes:]
-        hdata = msgdata[:hbytes]
-        # Strip off any leading whitespace from headers; this is necessary, because
-        # we do not (any longer) expect a trailing \n after the \x00 byte (which means
-        # it will become a leading \n to the next frame).
-        hdata = hdata.lstrip() 
-        elems = hdata.split('\n')
-        cmd = elems.pop(0)
-        headers = {}
+        start = self._pos
+        if self._content_length is not None and self.buffer[start + mbytes - 1] != 0:
+            # The content-length was wrong: the frame is dropped, and the data where its 
+            # terminator should be is resynchronized by sync_buffer.
+            self._consume(mbytes - 1)
+            raise FrameError("Frame body (content-length %d) is not followed by a null byte." 
+                             % (mbytes - hbytes - 3))
+        hdata = str(buffer(self.buffer, start, hbytes))
+        # hbytes points to the start of the '\n\n' at the end of the header,
+        # so 2 bytes beyond this is the start of the body. The body EXCLUDES
+        # the final byte, which is  '\x00'.
+        if self.zero_copy:
+            body = memoryview(buffer(self.buffer, start + hbytes + 2, mbytes - hbytes - 3))
+            self._exported = True
+        else:
+            body = str(buffer(self.buffer, start + hbytes + 2, mbytes - hbytes - 3))
+        command = self._command
+        self._consume(mbytes)
+        return self._make_frame(command, hdata, body)
+    
+    def _make_frame(self, command, hdata, body):
+        """
+        Creates a frame from its raw header data and body.
+        
+        The command has already been validated by :meth:`sync_buffer`, so the frame is
+        built with the trusted constructor (skipping the validation in :class:`Frame`).
         
-        for e in elems:
+        :param command: The (interned) command of the frame.
+        :type command: str
+        
+        :param hdata: The command and header lines of the frame.
+        :type hdata: str
+        
+        :param body: The frame body.
+        :type body: str
+        
+        :rtype: :class:`stompclient.frame.Frame`
+        """
+        # Any newlines preceding the frame were skipped by sync_buffer, so the header
+        # data starts with the command line.
+        hlines = hdata[len(command):]
+        # CONNECTED frames are never escaped (the broker only escapes headers once
+        # STOMP 1.1 has been negotiated).
+        unescape = self.unescape_headers and command is not CONNECTED
+        
+        if self.lazy_headers:
+            if unescape:
+                return EscapedLazyFrame.trusted(command, hlines, body)
+            else:
+                return LazyFrame.trusted(command, hlines, body)
+        elif self.intern_table is not None:
+            return Frame.trusted(command, self._parse_interned_headers(hlines, unescape), body)
+        elif unescape:
+            return Frame.trusted(command, parse_escaped_header_block(hlines), body)
+        else:
+            return Frame.trusted(command, parse_header_block(hlines), body)
+    
+    def _parse_interned_headers(self, block, unescape=False):
+        """
+        Parses a header block like :func:`stompclient.frame.parse_header_block` (or 
+        :func:`stompclient.frame.parse_escaped_header_block` if `unescape` is set), interning
+        the keys and the values of the configured headers.
+        
+        :rtype: `dict`
+        """
+        intern = self.intern_table.intern
+        intern_values = self.intern_headers
+        if unescape:
+            headers = {}
+            for (k, v) in parse_escaped_header_block(block).iteritems():
+                k = intern(k)
+                headers[k] = intern(v) if k in intern_values else v
+            return headers
+        
+        headers = {}
+        for line in block.split('\n'):
             try:
-                (k,v) = e.split(':', 1) # header values may contain ':' so specify maxsplit
+                (k, v) = line.split(':', 1)
             except ValueError:
                 continue
-            headers[k.strip()] = v.strip()
-
-        # hbytes points to the start of the '\n\n' at the end of the header,
-        # so 2 bytes beyond this is the start of the body. The body EXCLUDES
-        # the final byte, which is  '\x00'.
-        body = msgdata[hbytes + 2:-1]
-        return Frame(cmd, headers=headers, body=body)
+            k = intern(k.strip())
+            if k in intern_values:
+                headers[k] = intern(v.strip())
+            else:
+                headers[k] = v.strip()
+        return headers
 
+    def extract_frames(self, max_n=None):
+        """
+        Pulls all complete frames (or at most `max_n` of them) off the buffer.
+        
+        :param max_n: The maximum number of frames to extract (`None` for no limit).
+        :type max_n: int
+        
+        :return: The complete frames in the buffer, in order (empty if there are none).
+        :rtype: `list` of :class:`stompclient.frame.Frame`
+        """
+        frames = []
+        extract_frame = self.extract_frame
+        while max_n is None or len(frames) < max_n:
+            try:
+                frame = extract_frame()
+            except FrameError as e:
+                if not frames:
+                    raise
+                # Return the frames we have; the error is raised by the next call. 
+                self._deferred_error = e
+                break
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
 
-    def _find_message_bytes(self, data):
+    def _find_message_bytes(self):
         """
-        Examines passed-in data and returns a tuple of message and header lengths.
+        Examines unconsumed buffer data and returns a tuple of message and header lengths,
+        enforcing the configured size limits.
+        
+        Frames exceeding the limits are skipped (see :meth:`_skip_frame`); unless `skip_oversized`
+        is set, a :class:`stompclient.exceptions.FrameSizeError` is then raised.
+        
+        :return: A tuple in the form (message_length, header_length)
+        :rtype: `tuple`
+        """
+        try:
+            (mbytes, hbytes) = self._scan_message_bytes()
+            if not mbytes and self.max_buffer_size is not None and self.buffer_len() > self.max_buffer_size:
+                raise FrameSizeError("Incomplete frame exceeds maximum buffer size (%d bytes)" % self.max_buffer_size)
+            return (mbytes, hbytes)
+        except FrameSizeError as e:
+            self._skip_frame()
+            if not self.skip_oversized:
+                raise
+            self.log.warning("Skipping frame: %s" % e)
+            return self._find_message_bytes()
+        
+    def _scan_message_bytes(self):
+        """
+        Examines unconsumed buffer data and returns a tuple of message and header lengths.
         
         Return data is a `tuple` in the form (message_length, header_length) where 
         message_length is the length in bytes of the first complete message, if it 
@@ -140,51 +669,82 @@ class FrameBuffer(object):
         bytes of the header. If message_length is zero, header_length should
         be ignored.
         
+        The scan is resumable: the position of the header boundary, the parsed
+        content-length and the offset already searched for the null terminator are
+        remembered between calls, so that a frame arriving in many chunks is only 
+        scanned once in total.
+        
         :return: A tuple in the form (message_length, header_length)
         :rtype: `tuple`
         """
-
-        # Sanity check. See the docstring for the method to see what it
-        # does an why we need it.
-        self.sync_buffer()
+        data = self.buffer
         
-        # If the string '\n\n' does not exist, we don't even have the complete
-        # header yet and we MUST exit.
-        try:
-            i = data.index('\n\n')
-        except ValueError:
-            if self.debug:
-                self.log.debug("No complete frames in buffer.")
-            return (0, 0)
-        # If the string '\n\n' exists, then we have the entire header and can
-        # check for the content-length header. If it exists, we can check
-        # the length of the buffer for the number of bytes, else we check for
-        # the existence of a null byte.
-
-        # Pull out the header before we perform the regexp search. This
-        # prevents us from matching (possibly malicious) strings in the
-        # body.
-        _hdr = self.buffer[:i]
-        match = self.content_length_re.search(_hdr)
-        if match:
-            # There was a content-length header, so read out the value.
-            content_length = int(match.groups()[0])
+        if self._header_len is None:
+            # Sanity check. See the docstring for the method to see what it
+            # does an why we need it.  This only does any work once per frame.
+            self.sync_buffer()
+            if not self._synced:
+                # We don't even have the command line yet.
+                if self.max_header_size is not None and self.buffer_len() > self.max_header_size:
+                    raise FrameSizeError("Frame header exceeds maximum header size (%d bytes)" % self.max_header_size)
+                return (0, 0)
+            start = self._pos
             
-            if self.debug:
-                self.log.debug("Message contains a content-length header; reading %d bytes" % content_length)
+            # If the string '\n\n' does not exist, we don't even have the complete
+            # header yet and we MUST exit.  We resume the search one byte before
+            # the end of the previous scan, in case the '\n\n' straddles two appends.
+            i = data.find('\n\n', start + max(self._scan_pos - 1, 0))
+            if i == -1:
+                self._scan_pos = len(data) - start
+                if self.max_header_size is not None and self._scan_pos > self.max_header_size:
+                    raise FrameSizeError("Frame header exceeds maximum header size (%d bytes)" % self.max_header_size)
+                if self.debug:
+                    self.log.debug("No complete frames in buffer.")
+                return (0, 0)
+            
+            # If the string '\n\n' exists, then we have the entire header and can
+            # check for the content-length header. If it exists, we can check
+            # the length of the buffer for the number of bytes, else we check for
+            # the existence of a null byte.
+    
+            # Limit the regexp search to the header. This prevents us from 
+            # matching (possibly malicious) strings in the body.
+            match = self.content_length_re.search(data, start, i)
+            if match:
+                # There was a content-length header, so read out the value.
+                self._content_length = int(match.group(1))
+                if self.debug:
+                    self.log.debug("Message contains a content-length header; reading %d bytes" % self._content_length)
+            elif self.debug:
+                self.log.debug("No content-length header present; reading until first null byte.")
+            
+            # Offsets from here on are relative to the start of the frame.
+            self._header_len = i - start
+            self._scan_pos = self._header_len + len('\n\n')
             
-            # This is the content length of the body up until the null
-            # byte, not the entire message. Note that this INCLUDES the 2
-            # '\n\n' bytes inserted by the STOMP encoder after the body
-            # (see the calculation of content_length in
-            # StompEngine.callRemote()), so we only need to add 2 final bytes
-            # for the footer.
+            if self.max_header_size is not None and self._header_len > self.max_header_size:
+                raise FrameSizeError("Frame header exceeds maximum header size (%d bytes)" % self.max_header_size)
+            if (self.max_body_size is not None and self._content_length is not None 
+                    and self._content_length > self.max_body_size):
+                raise FrameSizeError("Frame content-length (%d) exceeds maximum body size (%d bytes)" 
+                                     % (self._content_length, self.max_body_size))
+            
+            if (self.spool_threshold is not None and self._content_length is not None 
+                    and self._content_length >= max(self.spool_threshold, 1)):
+                self._start_spool()
+                return (0, 0)
+        
+        start = self._pos
+        i = self._header_len
+        
+        if self._content_length is not None:
+            # This is the content length of the body up until the null byte.
             #
-            #The message looks like:
+            # The message looks like:
             #
-            #   <header>\n\n<body>\n\n\x00
-            #           ^         ^^^^
-            #          (i)         included in content_length!
+            #   <header>\n\n<body>\x00
+            #           ^
+            #          (i)
             #
             # We have the location of the end of the header (i), so we
             # need to ensure that the message contains at least:
@@ -192,13 +752,13 @@ class FrameBuffer(object):
             #     i + len ( '\n\n' ) + content_length + len ( '\x00' )
             #
             # Note that i is also the count of bytes in the header, because
-            # of the fact that str.index() returns a 0-indexed value.
-            req_len = i + len('\n\n') + content_length + len('\x00')
+            # of the fact that str.find() returns a 0-indexed value.
+            req_len = i + len('\n\n') + self._content_length + len('\x00')
             
             if self.debug:
-                self.log.debug("We have [%s] bytes and need [%s] bytes" % (len(data), req_len)) 
+                self.log.debug("We have [%s] bytes and need [%s] bytes" % (len(data) - start, req_len))
                 
-            if len(data) < req_len:
+            if len(data) - start < req_len:
                 # We don't have enough bytes in the buffer.
                 if self.debug:
                     self.log.debug("Not enough bytes in buffer to construct a frame.")
@@ -207,22 +767,22 @@ class FrameBuffer(object):
                 # We have enough bytes in the buffer
                 return (req_len, i)
         else:
-            if self.debug:
-                self.log.debug("No content-length header present; reading until first null byte.")
             # There was no content-length header, so just look for the
-            # message terminator ('\x00' ).
-            try:
-                j = data.index('\x00')
-            except ValueError:
+            # message terminator ('\x00' ), starting where we left off.
+            j = data.find('\x00', start + self._scan_pos)
+            if j == -1:
                 # We don't have enough bytes in the buffer.
+                self._scan_pos = len(data) - start
+                if (self.max_body_size is not None 
+                        and self._scan_pos - i - len('\n\n') > self.max_body_size):
+                    raise FrameSizeError("Frame body exceeds maximum body size (%d bytes)" % self.max_body_size)
                 if self.debug:
                     self.log.debug("Could not find NULL termination byte.")
                 return (0, 0)
             
             # j points to the 0-indexed location of the null byte. However,
             # we need to add 1 (to turn it into a byte count)
-            return (j + 1, i)
-
+            return (j - start + 1, i)
 
     def sync_buffer(self):
         """
@@ -259,37 +819,49 @@ class FrameBuffer(object):
         a buffer containing the string 'BUNK' with no newline is clearly
         corrupt, but we sit and wait until the buffer contains a newline before
         attempting to see if it's a STOMP command.
+        
+        The check is only performed at frame boundaries: once the command line of
+        the frame at the read offset has been validated, this method does nothing 
+        until that frame has been extracted.  Any newlines preceding a frame (e.g.
+        after the null terminator of the previous frame) are skipped.
         """
-        while True:
-            if not self.buffer:
-                # Buffer is empty; no need to do anything.
-                break
-            m = self.command_re.match(self.buffer)
-            if m is None:
+        while not self._synced:
+            data = self.buffer
+            pos = self._pos
+            end = len(data)
+            while pos < end and data[pos] == 10: # '\n'
+                pos += 1
+            if pos > self._pos:
+                self._consume(pos - self._pos)
+                data = self.buffer
+                pos = self._pos
+            
+            eol = data.find('\n', pos)
+            if eol == -1:
                 # Buffer doesn't even contain a single newline, so we can't
                 # determine whether it's corrupt or not. Assume it's OK.
                 break
-            cmd = m.groups()[0]
-            if cmd in VALID_COMMANDS:
+            cmd = str(buffer(data, pos, eol - pos))
+            if cmd in self.valid_commands:
                 # Good: the buffer starts with a command.
+                self._synced = True
+                self._command = intern(cmd)
                 break
             else:
                 # Bad: the buffer starts with bunk, so strip it out. We first
                 # try to strip to the first occurrence of '\x00', which
-                # is likely to be a frame boundary, but if this fails, we
-                # strip until the first newline.
-                (self.buffer, nsubs) = self.sync_re.subn('', self.buffer)
-
-                if nsubs:
-                    # Good: we managed to strip something out, so restart the
-                    # loop to see if things look better.
-                    continue
-                else:
-                    # Bad: we failed to strip anything out, so kill the
-                    # entire buffer. Since this resets the buffer to a
-                    # known good state, we can break out of the loop.
-                    self.buffer = ''
-                    break
+                # is likely to be a frame boundary; if this fails, we discard
+                # the entire buffer.
+                term = data.find('\x00', pos)
+                if term == -1:
+                    term = len(data) - 1
+                
+                discarded = term + 1 - pos
+                self.resync_count += 1
+                self.discarded_bytes += discarded
+                if self.debug:
+                    self.log.debug("Discarding %d bytes of corrupt data from buffer." % discarded)
+                self._consume(discarded)
 
     def __iter__(self):
         """